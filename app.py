@@ -1,8 +1,19 @@
-from flask import Flask, redirect, url_for
+from flask import Flask, redirect, url_for, request, send_from_directory, abort
 from flask_login import LoginManager
 from models import db, Teacher, Student
 from sqlalchemy import event
 from sqlalchemy.engine import Engine
+from utils.pyodide_vendor import pyodide_index_url, download_pyodide
+from utils.media import MEDIA_FILENAME_RE
+from utils.assets import load_manifest, build_assets, download_vendor_files, dist_dir, fingerprinted_filename, asset_tags
+from utils.images import picture_tag, snake_images
+from utils.query_plans import check_query_plans
+from utils.code_store import purge_unused_blobs
+from utils.paste_index import rebuild_index as rebuild_paste_index
+from utils.search import create_index as create_search_index, rebuild_index as rebuild_search_index
+from werkzeug.utils import safe_join
+import click
+import mimetypes
 import os
 
 app = Flask(__name__)
@@ -15,8 +26,10 @@ if os.environ.get('RAILWAY_ENVIRONMENT') or os.environ.get('FLASK_ENV') == 'prod
     # Создаём папку /data если её нет
     os.makedirs('/data', exist_ok=True)
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////data/database.db'
+    app.config['MEDIA_FOLDER'] = '/data/media'
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
+    app.config['MEDIA_FOLDER'] = os.environ.get('MEDIA_FOLDER', os.path.join(app.root_path, 'media'))
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
@@ -27,15 +40,149 @@ if os.environ.get('FLASK_ENV') == 'production':
 
 db.init_app(app)
 
+# Pyodide: локальная копия (flask vendor-pyodide) или CDN.
+# На Railway копия скачивается при сборке образа (см. nixpacks.toml)
+mimetypes.add_type('application/wasm', '.wasm')
+app.config['PYODIDE_INDEX_URL'] = pyodide_index_url(app.static_folder)
 
-# Включаем поддержку внешних ключей в SQLite
+# Собранная статика (flask build-assets, на Railway — при сборке образа);
+# без сборки файлы подключаются как есть
+app.config['ASSET_MANIFEST'] = load_manifest(app.static_folder)
+
+
+# Включаем поддержку внешних ключей в SQLite.
+# WAL: чтение не ждёт записи, а запись не блокирует читателей — запросы идут
+# из многих потоков gunicorn (см. Procfile). busy_timeout: пишущий поток ждёт
+# освобождения базы, а не падает сразу с "database is locked"
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
     cursor.close()
 
 
+# Cross-origin isolation для страницы задания и воркера Pyodide:
+# открывает SharedArrayBuffer, через который зацикленный тест прерывается
+# без перезагрузки интерпретатора
+@app.after_request
+def set_isolation_headers(response):
+    if request.endpoint == 'student.task' or request.path == '/static/js/pyodide-worker.js':
+        response.headers['Cross-Origin-Opener-Policy'] = 'same-origin'
+        response.headers['Cross-Origin-Embedder-Policy'] = 'credentialless'
+    return response
+
+
+# Файлы в static/vendor лежат в папках с версией, а в static/dist содержат
+# хэш в имени — и те и другие никогда не меняются
+@app.after_request
+def set_vendor_cache_headers(response):
+    if request.path.startswith(('/static/vendor/', '/static/dist/')) and response.status_code == 200:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@app.context_processor
+def inject_pyodide_url():
+    return {'pyodide_index_url': app.config['PYODIDE_INDEX_URL']}
+
+
+@app.context_processor
+def inject_asset_tags():
+    return {'asset_tags': asset_tags, 'picture_tag': picture_tag, 'snake_images': snake_images}
+
+
+# url_for('static', filename=...) отдаёт адрес версии файла с хэшем, если она собрана
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = fingerprinted_filename(values['filename'])
+
+
+# Собранные файлы отдаются в заранее сжатом виде, если браузер это поддерживает
+@app.route('/static/dist/<path:filename>')
+def dist_asset(filename):
+    folder = dist_dir(app.static_folder)
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        compressed = safe_join(folder, filename + suffix)
+        if request.accept_encodings[encoding] and compressed and os.path.exists(compressed):
+            response = send_from_directory(folder, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(folder, filename, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+# Service worker должен отдаваться из корня, чтобы его область покрывала весь сайт
+@app.route('/sw.js')
+def service_worker():
+    response = send_from_directory(app.static_folder, 'js/sw.js', mimetype='text/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# Картинки из описаний заданий: имя файла — хэш содержимого, поэтому кэшируются навсегда
+@app.route('/media/<filename>')
+def media(filename):
+    if not MEDIA_FILENAME_RE.match(filename):
+        abort(404)
+    response = send_from_directory(app.config['MEDIA_FOLDER'], filename, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@app.cli.command('vendor-pyodide')
+def vendor_pyodide_command():
+    """Скачивает Pyodide в static/vendor, чтобы раздавать его без CDN."""
+    downloaded = download_pyodide(app.static_folder)
+    click.echo(f'Скачано файлов: {len(downloaded)}. Перезапустите сервер.')
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Проверяет, что частые запросы идут по индексам, а не сканируют таблицы."""
+    failures = check_query_plans()
+    for name, plan in failures:
+        click.echo(f'SCAN: {name}')
+        for detail in plan:
+            click.echo(f'    {detail}')
+    if failures:
+        raise SystemExit(1)
+    click.echo('Все запросы используют индексы.')
+
+
+@app.cli.command('purge-code-blobs')
+def purge_code_blobs_command():
+    """Удаляет сохранённый код, на который больше не ссылается ни один ученик."""
+    click.echo(f'Удалено текстов: {purge_unused_blobs()}')
+
+
+@app.cli.command('rebuild-paste-index')
+def rebuild_paste_index_command():
+    """Заново строит индекс для поиска источников вставок (после обновления)."""
+    click.echo(f'Проиндексировано источников: {rebuild_paste_index()}')
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Заново строит полнотекстовый индекс поиска по урокам."""
+    click.echo(f'Проиндексировано уроков: {rebuild_search_index()}')
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Скачивает библиотеки в static/vendor и собирает static/dist."""
+    downloaded = download_vendor_files(app.static_folder)
+    manifest = build_assets(app.static_folder)
+    click.echo(f'Скачано библиотек: {len(downloaded)}. '
+               f'Собрано файлов: {len(manifest["files"])}, бандлов: {len(manifest["bundles"])}. '
+               f'Перезапустите сервер.')
+
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'auth.index'
@@ -161,6 +308,79 @@ with app.app_context():
         db.session.execute(text('PRAGMA foreign_keys=ON'))
         db.session.commit()
 
+    # Миграция: материализованный путь папок (см. utils/topic_tree.py)
+    columns = [col['name'] for col in inspect(db.engine).get_columns('topics')]
+    if 'path' not in columns:
+        db.session.execute(text('ALTER TABLE topics ADD COLUMN path VARCHAR(500)'))
+        db.session.commit()
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_topics_path ON topics (path)'))
+    db.session.commit()
+    if db.session.execute(text('SELECT 1 FROM topics WHERE path IS NULL LIMIT 1')).first():
+        from utils.topic_tree import rebuild_paths
+        rebuild_paths()
+
+    # Миграция: версия дерева папок учителя
+    columns = [col['name'] for col in inspect(db.engine).get_columns('teachers')]
+    if 'tree_version' not in columns:
+        db.session.execute(text('ALTER TABLE teachers ADD COLUMN tree_version INTEGER NOT NULL DEFAULT 0'))
+        db.session.commit()
+
+    # Миграция: разреженные ключи порядка (см. utils/ordering.py).
+    # Старые 1, 2, 3... (и совпадающие) ключи раскладываются через ORDER_GAP
+    # один раз — до создания составного индекса
+    from utils.ordering import ORDER_GAP, ORDER_INDEXES
+    existing_indexes = {row[0] for row in db.session.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'index'")
+    )}
+    for index_name, (table, parent_column) in ORDER_INDEXES.items():
+        if index_name in existing_indexes:
+            continue
+        db.session.execute(text(f'''
+            UPDATE {table} SET "order" = (
+                SELECT position FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY {parent_column} ORDER BY "order", id) AS position
+                    FROM {table}
+                ) AS ranked WHERE ranked.id = {table}.id
+            ) * {ORDER_GAP}
+        '''))
+        db.session.execute(text(f'CREATE INDEX {index_name} ON {table} ({parent_column}, "order")'))
+        db.session.commit()
+
+    # Миграция: код учеников переезжает в code_blobs (см. utils/code_store.py)
+    sp_columns = [col['name'] for col in inspect(db.engine).get_columns('student_progress')]
+    if 'code_hash' not in sp_columns:
+        db.session.execute(text('ALTER TABLE student_progress ADD COLUMN code_hash VARCHAR(64) REFERENCES code_blobs(hash)'))
+        db.session.commit()
+    if 'revision_count' not in sp_columns:
+        db.session.execute(text('ALTER TABLE student_progress ADD COLUMN revision_count INTEGER DEFAULT 0'))
+        db.session.commit()
+    if 'code' in sp_columns:
+        from utils.code_store import store_code
+        while True:
+            rows = db.session.execute(text(
+                'SELECT id, code FROM student_progress WHERE code IS NOT NULL AND code_hash IS NULL LIMIT 500'
+            )).all()
+            if not rows:
+                break
+            db.session.execute(
+                text('UPDATE student_progress SET code_hash = :code_hash, code = NULL WHERE id = :id'),
+                [{'id': row.id, 'code_hash': store_code(row.code)} for row in rows]
+            )
+            db.session.commit()
+
+    # Миграция: индексы, объявленные в моделях (create_all создаёт их только для новых таблиц)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    # Миграция: полнотекстовый индекс поиска (см. utils/search.py).
+    # При первом создании наполняется всеми существующими уроками
+    search_index_exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")
+    ).first()
+    if create_search_index() and not search_index_exists:
+        rebuild_search_index()
+
 
 if __name__ == '__main__':
     # Только для локальной разработки
@@ -1 +1 @@
-from .models import db, Teacher, SchoolClass, Student, Topic, Lesson, Task, TestCase, LessonAssignment, StudentProgress, QuizElement, QuizOption, QuizAnswer, ActivityEvent
+from .models import db, Teacher, SchoolClass, Student, Topic, Lesson, LessonSnapshot, Task, TestCase, LessonAssignment, StudentProgress, CodeBlob, CodeRevision, SubmissionSignature, SimilarityBucket, PasteSource, PasteGram, SearchPending, QuizElement, QuizOption, QuizAnswer, ActivityEvent, JournalEvent
@@ -12,6 +12,8 @@ class Teacher(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
+    # Растёт при каждом изменении дерева папок (см. utils/topic_tree.py)
+    tree_version = db.Column(db.Integer, default=0, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     classes = db.relationship('SchoolClass', backref='teacher', lazy=True, cascade='all, delete-orphan')
@@ -46,7 +48,7 @@ class Student(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     login = db.Column(db.String(50), unique=True, nullable=False)
     name = db.Column(db.String(150), nullable=False)
-    class_id = db.Column(db.Integer, db.ForeignKey('school_classes.id'), nullable=False)
+    class_id = db.Column(db.Integer, db.ForeignKey('school_classes.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     progress = db.relationship('StudentProgress', backref='student', lazy=True, cascade='all, delete-orphan')
@@ -65,12 +67,19 @@ class Topic(db.Model):
     parent_id = db.Column(db.Integer, db.ForeignKey('topics.id', ondelete='CASCADE'), nullable=True)
     teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'), nullable=False)
     class_id = db.Column(db.Integer, db.ForeignKey('school_classes.id', ondelete='SET NULL'), nullable=True)
+    # Цепочка id от корня: '/3/17/42/' (см. utils/topic_tree.py)
+    path = db.Column(db.String(500), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     children = db.relationship('Topic', backref=db.backref('parent', remote_side=[id]), lazy=True, cascade='all, delete-orphan')
     lessons = db.relationship('Lesson', backref='topic', lazy=True, cascade='all, delete-orphan')
     school_class = db.relationship('SchoolClass', backref='topics', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_topics_teacher_parent', 'teacher_id', 'parent_id'),
+        db.Index('ix_topics_parent', 'parent_id'),
+    )
+
 
 class Lesson(db.Model):
     __tablename__ = 'lessons'
@@ -84,6 +93,21 @@ class Lesson(db.Model):
     tasks = db.relationship('Task', backref='lesson', lazy=True, order_by='Task.order', cascade='all, delete-orphan')
     assignments = db.relationship('LessonAssignment', backref='lesson', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('ix_lessons_teacher_topic', 'teacher_id', 'topic_id'),
+        db.Index('ix_lessons_topic', 'topic_id'),
+    )
+
+
+# Скомпилированное содержимое урока для учеников (см. utils/lesson_snapshot.py)
+class LessonSnapshot(db.Model):
+    __tablename__ = 'lesson_snapshots'
+
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lessons.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.String(64), nullable=False)
+    data = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 
 class Task(db.Model):
     __tablename__ = 'tasks'
@@ -123,7 +147,10 @@ class LessonAssignment(db.Model):
     class_id = db.Column(db.Integer, db.ForeignKey('school_classes.id'), nullable=False)
     assigned_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    __table_args__ = (db.UniqueConstraint('lesson_id', 'class_id', name='unique_lesson_class'),)
+    __table_args__ = (
+        db.UniqueConstraint('lesson_id', 'class_id', name='unique_lesson_class'),
+        db.Index('ix_lesson_assignments_class', 'class_id'),
+    )
 
 
 class StudentProgress(db.Model):
@@ -132,7 +159,9 @@ class StudentProgress(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
     task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=False)
-    code = db.Column(db.Text, nullable=True)
+    # Текст кода хранится в code_blobs (см. utils/code_store.py)
+    code_hash = db.Column(db.String(64), db.ForeignKey('code_blobs.hash'), nullable=True, index=True)
+    revision_count = db.Column(db.Integer, default=0)  # номер последней ревизии в code_revisions
     is_completed = db.Column(db.Boolean, default=False)
     has_errors = db.Column(db.Boolean, default=False)
     completed_at = db.Column(db.DateTime, nullable=True)
@@ -141,7 +170,106 @@ class StudentProgress(db.Model):
     has_copies = db.Column(db.Boolean, default=False)
     has_leaves = db.Column(db.Boolean, default=False)
 
-    __table_args__ = (db.UniqueConstraint('student_id', 'task_id', name='unique_student_task'),)
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'task_id', name='unique_student_task'),
+        db.Index('ix_student_progress_task', 'task_id'),
+    )
+
+
+# Различные тексты кода учеников, каждый один раз (см. utils/code_store.py)
+class CodeBlob(db.Model):
+    __tablename__ = 'code_blobs'
+
+    hash = db.Column(db.String(64), primary_key=True)  # sha256 текста
+    data = db.Column(db.LargeBinary, nullable=False)
+    compression = db.Column(db.String(10), nullable=False, default='none')  # 'none' | 'zlib' | 'zstd'
+    size = db.Column(db.Integer, nullable=False)  # длина текста в байтах до сжатия
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# История правок кода: опорные тексты и разницы (см. utils/code_history.py)
+class CodeRevision(db.Model):
+    __tablename__ = 'code_revisions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=False)
+    number = db.Column(db.Integer, nullable=False)
+    code_hash = db.Column(db.String(64), db.ForeignKey('code_blobs.hash'), nullable=True)  # опорная ревизия
+    delta = db.Column(db.LargeBinary, nullable=True)  # разница с предыдущей ревизией
+    compression = db.Column(db.String(10), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'task_id', 'number', name='unique_student_task_revision'),
+        db.Index('ix_code_revisions_task', 'task_id'),
+    )
+
+
+# MinHash-подпись решения для поиска похожих (см. utils/similarity.py)
+class SubmissionSignature(db.Model):
+    __tablename__ = 'submission_signatures'
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=False)
+    code_hash = db.Column(db.String(64), nullable=True)  # по какому тексту посчитана
+    signature = db.Column(db.LargeBinary, nullable=True)  # None — код слишком короткий
+
+    __table_args__ = (
+        db.UniqueConstraint('task_id', 'student_id', name='unique_task_student_signature'),
+        db.Index('ix_submission_signatures_student', 'student_id'),
+    )
+
+
+# LSH-индекс: корзина каждой полосы подписи
+class SimilarityBucket(db.Model):
+    __tablename__ = 'similarity_buckets'
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=False)
+    band = db.Column(db.Integer, nullable=False)
+    bucket = db.Column(db.BigInteger, nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_similarity_buckets_task_band_bucket', 'task_id', 'band', 'bucket'),
+        db.Index('ix_similarity_buckets_student', 'student_id'),
+    )
+
+
+# Источник для поиска происхождения вставок: код ученика или вставка (см. utils/paste_index.py)
+class PasteSource(db.Model):
+    __tablename__ = 'paste_sources'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # 'code' | 'paste'
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=False)
+    event_id = db.Column(db.Integer, db.ForeignKey('activity_events.id'), nullable=True)  # для вставки
+    code_hash = db.Column(db.String(64), nullable=True)  # для кода: по какому тексту построено
+
+    __table_args__ = (
+        db.Index('ix_paste_sources_student_task', 'student_id', 'task_id', 'kind'),
+        db.Index('ix_paste_sources_task', 'task_id'),
+    )
+
+
+# Отпечатки n-грамм источников: обратный индекс «отпечаток → источник»
+class PasteGram(db.Model):
+    __tablename__ = 'paste_grams'
+
+    gram = db.Column(db.BigInteger, primary_key=True)
+    source_id = db.Column(db.Integer, db.ForeignKey('paste_sources.id'), primary_key=True)
+
+    __table_args__ = (db.Index('ix_paste_grams_source', 'source_id'),)
+
+
+# Уроки, ожидающие переиндексации для поиска (см. utils/search.py)
+class SearchPending(db.Model):
+    __tablename__ = 'search_pending'
+
+    lesson_id = db.Column(db.Integer, primary_key=True)
 
 
 class QuizElement(db.Model):
@@ -177,7 +305,10 @@ class QuizAnswer(db.Model):
     is_correct = db.Column(db.Boolean, default=False)
     had_errors = db.Column(db.Boolean, default=False)
 
-    __table_args__ = (db.UniqueConstraint('student_id', 'element_id', name='unique_student_element'),)
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'element_id', name='unique_student_element'),
+        db.Index('ix_quiz_answers_element', 'element_id'),
+    )
 
 
 class ActivityEvent(db.Model):
@@ -189,3 +320,26 @@ class ActivityEvent(db.Model):
     event_type = db.Column(db.String(20), nullable=False)  # 'paste' | 'copy' | 'leave'
     text_content = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_activity_events_student_task_created', 'student_id', 'task_id', 'created_at'),
+        db.Index('ix_activity_events_task', 'task_id'),
+    )
+
+
+# Изменения клеток журнала для живого обновления (см. utils/journal_live.py).
+# Журнал событий, а не данные: без внешних ключей, старые строки удаляются
+class JournalEvent(db.Model):
+    __tablename__ = 'journal_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    class_id = db.Column(db.Integer, nullable=False)
+    student_id = db.Column(db.Integer, nullable=False)
+    task_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON клетки
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_journal_events_class', 'class_id', 'id'),
+        db.Index('ix_journal_events_created', 'created_at'),
+    )
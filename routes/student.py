@@ -1,6 +1,13 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, abort
 from flask_login import login_required, current_user
 from models import db, Student, LessonAssignment, StudentProgress, Task, QuizElement, QuizOption, QuizAnswer, ActivityEvent
+from utils.lesson_snapshot import get_lesson_snapshot, find_task
+from utils.http_cache import content_etag, conditional_page, private_json
+from utils.code_store import store_code, load_code
+from utils.code_history import record_revision
+from utils.similarity import index_submission
+from utils.paste_index import index_code, index_paste
+from utils.journal_live import publish_cell
 from functools import wraps
 from datetime import datetime
 
@@ -48,141 +55,177 @@ def dashboard():
     return render_template('student/dashboard.html', lessons_data=lessons_data)
 
 
+def lesson_access(lesson_id):
+    return LessonAssignment.query.filter_by(
+        lesson_id=lesson_id, class_id=current_user.class_id
+    ).first() is not None
+
+
+def page_etag(version, *parts):
+    # Имя ученика выводится в шапке страницы
+    return content_etag(version, current_user.id, current_user.name, *parts)
+
+
 @student_bp.route('/lesson/<int:lesson_id>')
 @login_required
 @student_required
 def lesson(lesson_id):
     # Проверяем, что урок назначен классу ученика
-    assignment = LessonAssignment.query.filter_by(
-        lesson_id=lesson_id, class_id=current_user.class_id
-    ).first()
-
-    if not assignment:
+    if not lesson_access(lesson_id):
         flash('Урок не доступен', 'error')
         return redirect(url_for('student.dashboard'))
 
-    lesson = assignment.lesson
+    version, lesson = get_lesson_snapshot(lesson_id)
 
-    regular_tasks = []
-    bonus_tasks = []
+    # Отметки о выполнении подставляются на странице из lesson_progress
+    def render():
+        return render_template('student/lesson.html',
+                               lesson=lesson,
+                               regular_tasks=[t for t in lesson['tasks'] if not t['is_bonus']],
+                               bonus_tasks=[t for t in lesson['tasks'] if t['is_bonus']])
+
+    return conditional_page(page_etag(version, 'lesson'), render)
 
-    all_regular_completed = True
-    for task in lesson.tasks:
-        progress = StudentProgress.query.filter_by(
-            student_id=current_user.id, task_id=task.id
-        ).first()
-        item = {
-            'task': task,
-            'is_completed': progress.is_completed if progress else False
-        }
-        if task.is_bonus:
-            bonus_tasks.append(item)
-        else:
-            regular_tasks.append(item)
-            if not item['is_completed']:
-                all_regular_completed = False
 
-    return render_template('student/lesson.html',
-                           lesson=lesson,
-                           regular_tasks=regular_tasks,
-                           bonus_tasks=bonus_tasks,
-                           show_bonus=all_regular_completed and len(regular_tasks) > 0)
+@student_bp.route('/lesson/<int:lesson_id>/progress')
+@login_required
+@student_required
+def lesson_progress(lesson_id):
+    if not lesson_access(lesson_id):
+        return jsonify({'success': False}), 403
+
+    version, lesson = get_lesson_snapshot(lesson_id)
+    completed_ids = completed_task_ids(lesson['tasks'])
+    regular_tasks = [t for t in lesson['tasks'] if not t['is_bonus']]
+
+    return private_json({
+        'success': True,
+        'completed': sorted(completed_ids),
+        'show_bonus': len(regular_tasks) > 0 and all(t['id'] in completed_ids for t in regular_tasks)
+    })
+
+
+def completed_task_ids(tasks):
+    """id выполненных учеником заданий урока — одним запросом."""
+    task_ids = [t['id'] for t in tasks]
+    if not task_ids:
+        return set()
+    rows = db.session.execute(
+        db.select(StudentProgress.task_id).filter(
+            StudentProgress.student_id == current_user.id,
+            StudentProgress.task_id.in_(task_ids),
+            StudentProgress.is_completed == True
+        )
+    ).scalars()
+    return set(rows)
+
+
+def load_task_snapshot(task_id):
+    """Снимок урока и задание из него. (None, None, None), если задания нет."""
+    lesson_id = db.session.execute(
+        db.select(Task.lesson_id).filter_by(id=task_id)
+    ).scalar()
+    if lesson_id is None:
+        return None, None, None
+    version, lesson = get_lesson_snapshot(lesson_id)
+    current_index, task = find_task(lesson, task_id)
+    return version, lesson, task
 
 
 @student_bp.route('/task/<int:task_id>')
 @login_required
 @student_required
 def task(task_id):
-    task = Task.query.get_or_404(task_id)
-    lesson = task.lesson
+    version, lesson, task = load_task_snapshot(task_id)
+    if task is None:
+        abort(404)
 
     # Проверяем доступ
-    assignment = LessonAssignment.query.filter_by(
-        lesson_id=lesson.id, class_id=current_user.class_id
-    ).first()
-
-    if not assignment:
+    if not lesson_access(lesson['id']):
         flash('Задание не доступно', 'error')
         return redirect(url_for('student.dashboard'))
 
+    all_tasks = lesson['tasks']
+    current_index, _ = find_task(lesson, task_id)
+
     # Проверяем доступ к бонусным заданиям
-    if task.is_bonus:
-        all_regular = [t for t in lesson.tasks if not t.is_bonus]
-        all_regular_done = all(
-            StudentProgress.query.filter_by(
-                student_id=current_user.id, task_id=t.id, is_completed=True
-            ).first() is not None
-            for t in all_regular
-        ) if all_regular else True
-        if not all_regular_done:
+    if task['is_bonus']:
+        completed_ids = completed_task_ids(all_tasks)
+        if not all(t['id'] in completed_ids for t in all_tasks if not t['is_bonus']):
             flash('Сначала выполните все основные задания', 'error')
-            return redirect(url_for('student.lesson', lesson_id=lesson.id))
-
-    # Получаем прогресс
-    progress = StudentProgress.query.filter_by(
-        student_id=current_user.id, task_id=task_id
-    ).first()
+            return redirect(url_for('student.lesson', lesson_id=lesson['id']))
 
     # Получаем соседние задания
-    all_tasks = lesson.tasks
-    current_index = next((i for i, t in enumerate(all_tasks) if t.id == task_id), 0)
     prev_task = all_tasks[current_index - 1] if current_index > 0 else None
     next_task = all_tasks[current_index + 1] if current_index < len(all_tasks) - 1 else None
 
-    # Проверяем доступность следующего задания
-    next_task_available = True
-    if next_task and next_task.is_bonus:
-        regular_tasks = [t for t in all_tasks if not t.is_bonus]
-        next_task_available = all(
-            StudentProgress.query.filter_by(
-                student_id=current_user.id, task_id=t.id, is_completed=True
-            ).first() is not None
-            for t in regular_tasks
-        ) if regular_tasks else True
-
-    if task.task_type == 'quiz':
-        # Считаем количество вопросов (не текстовых блоков)
-        question_ids = [e.id for e in task.quiz_elements if e.element_type != 'text']
-        question_count = len(question_ids)
-
-        # Получаем уже отвеченные вопросы
-        answered = QuizAnswer.query.filter(
-            QuizAnswer.student_id == current_user.id,
-            QuizAnswer.element_id.in_(question_ids),
-            QuizAnswer.is_correct == True
-        ).all() if question_ids else []
-        answered_ids = [a.element_id for a in answered]
-
-        return render_template('student/quiz.html',
+    # Сохранённый код, отметка о выполнении, отвеченные вопросы и доступность
+    # следующего задания приходят отдельно из task_progress
+    def render():
+        if task['task_type'] == 'quiz':
+            # Считаем количество вопросов (не текстовых блоков)
+            question_count = sum(1 for e in task['quiz_elements'] if e['element_type'] != 'text')
+            return render_template('student/quiz.html',
+                                   task=task,
+                                   lesson=lesson,
+                                   prev_task=prev_task,
+                                   next_task=next_task,
+                                   current_index=current_index + 1,
+                                   total_tasks=len(all_tasks),
+                                   question_count=question_count)
+
+        return render_template('student/task.html',
                                task=task,
                                lesson=lesson,
-                               progress=progress,
                                prev_task=prev_task,
                                next_task=next_task,
-                               next_task_available=next_task_available,
+                               tests=task['tests'],
                                current_index=current_index + 1,
-                               total_tasks=len(all_tasks),
-                               question_count=question_count,
-                               answered_ids=answered_ids)
-
-    # Получаем тесты для задания (скрываем данные скрытых тестов)
-    tests = []
-    for tc in task.test_cases:
-        if tc.is_hidden:
-            tests.append({'input': tc.input_data, 'output': tc.expected_output, 'hidden': True})
-        else:
-            tests.append({'input': tc.input_data, 'output': tc.expected_output, 'hidden': False})
+                               total_tasks=len(all_tasks))
+
+    return conditional_page(page_etag(version, 'task', task_id), render)
+
+
+@student_bp.route('/task/<int:task_id>/progress')
+@login_required
+@student_required
+def task_progress(task_id):
+    version, lesson, task = load_task_snapshot(task_id)
+    if task is None or not lesson_access(lesson['id']):
+        return jsonify({'success': False}), 403
+
+    progress = StudentProgress.query.filter_by(
+        student_id=current_user.id, task_id=task_id
+    ).first()
+
+    # Следующее бонусное задание открыто, когда выполнены все основные
+    all_tasks = lesson['tasks']
+    current_index, _ = find_task(lesson, task_id)
+    next_task = all_tasks[current_index + 1] if current_index < len(all_tasks) - 1 else None
+    next_task_available = True
+    if next_task and next_task['is_bonus']:
+        completed_ids = completed_task_ids(all_tasks)
+        next_task_available = all(t['id'] in completed_ids for t in all_tasks if not t['is_bonus'])
+
+    data = {
+        'success': True,
+        'is_completed': bool(progress and progress.is_completed),
+        'code': load_code(progress.code_hash) if progress else None,
+        'next_task_available': next_task_available
+    }
+
+    if task['task_type'] == 'quiz':
+        question_ids = [e['id'] for e in task['quiz_elements'] if e['element_type'] != 'text']
+        # Получаем уже отвеченные вопросы
+        data['answered_ids'] = db.session.execute(
+            db.select(QuizAnswer.element_id).filter(
+                QuizAnswer.student_id == current_user.id,
+                QuizAnswer.element_id.in_(question_ids),
+                QuizAnswer.is_correct == True
+            )
+        ).scalars().all() if question_ids else []
 
-    return render_template('student/task.html',
-                           task=task,
-                           lesson=lesson,
-                           progress=progress,
-                           prev_task=prev_task,
-                           next_task=next_task,
-                           next_task_available=next_task_available,
-                           tests=tests,
-                           current_index=current_index + 1,
-                           total_tasks=len(all_tasks))
+    return private_json(data)
 
 
 @student_bp.route('/task/<int:task_id>/save', methods=['POST'])
@@ -211,11 +254,14 @@ def save_code(task_id):
     code = request.json.get('code', '')
 
     if not progress:
-        progress = StudentProgress(student_id=current_user.id, task_id=task_id, code=code)
+        progress = StudentProgress(student_id=current_user.id, task_id=task_id, code_hash=store_code(code))
         db.session.add(progress)
+        record_revision(progress, None, code)
     else:
-        progress.code = code
+        record_revision(progress, load_code(progress.code_hash), code)
+        progress.code_hash = store_code(code)
 
+    index_code(current_user.id, task_id, progress.code_hash, code)
     db.session.commit()
     return jsonify({'success': True})
 
@@ -246,16 +292,21 @@ def complete_task(task_id):
         progress = StudentProgress(
             student_id=current_user.id,
             task_id=task_id,
-            code=code,
+            code_hash=store_code(code),
             is_completed=True,
             completed_at=datetime.utcnow()
         )
         db.session.add(progress)
+        record_revision(progress, None, code)
     else:
-        progress.code = code
+        record_revision(progress, load_code(progress.code_hash), code)
+        progress.code_hash = store_code(code)
         progress.is_completed = True
         progress.completed_at = datetime.utcnow()
 
+    index_submission(progress, code)
+    index_code(current_user.id, task_id, progress.code_hash, code)
+    publish_cell(current_user, task)
     db.session.commit()
     return jsonify({'success': True})
 
@@ -330,6 +381,7 @@ def quiz_check(task_id):
         else:
             progress.has_errors = True
 
+    publish_cell(current_user, task)
     db.session.commit()
     return jsonify({'correct': correct})
 
@@ -373,6 +425,7 @@ def record_activity(task_id):
         text_content=text_content
     )
     db.session.add(event)
+    index_paste(event)
 
     # Обновляем флаги в StudentProgress
     progress = StudentProgress.query.filter_by(
@@ -391,6 +444,7 @@ def record_activity(task_id):
     elif event_type == 'leave':
         progress.has_leaves = True
 
+    publish_cell(current_user, task)
     db.session.commit()
     return jsonify({'success': True})
 
@@ -424,5 +478,6 @@ def quiz_complete(task_id):
         progress.is_completed = True
         progress.completed_at = datetime.utcnow()
 
+    publish_cell(current_user, task)
     db.session.commit()
     return jsonify({'success': True})
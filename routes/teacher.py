@@ -1,9 +1,27 @@
 import json
 from urllib.parse import quote
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, Response
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
-from models import db, Teacher, SchoolClass, Student, Topic, Lesson, Task, TestCase, LessonAssignment, StudentProgress, QuizElement, QuizOption, QuizAnswer, ActivityEvent
+from models import db, Teacher, SchoolClass, Student, Topic, Lesson, Task, TestCase, LessonAssignment, StudentProgress, CodeBlob, QuizElement, QuizOption, QuizAnswer, ActivityEvent
 from utils.login_generator import generate_unique_login
+from utils.media import extract_data_images, save_data_uri, collect_media, restore_media
+from utils.topic_tree import (in_subtree, is_descendant, subtree_topics, subtree_has_lessons,
+                              subtree_lesson_counts, breadcrumbs as topic_breadcrumbs, move_subtree,
+                              folder_tree as folder_tree_data)
+from utils.http_cache import content_etag, conditional_json
+from utils.ordering import ORDER_GAP, append_key, set_order, move as move_in_order
+from utils.bulk_delete import delete_class as delete_class_rows, delete_students, delete_lessons, delete_tasks
+from utils.lesson_snapshot import invalidate_lessons
+from utils.code_store import load_code, load_codes, decode_blob
+from utils.code_history import revision_list, revision_lists, reconstruct
+from utils.similarity import similar_clusters
+from utils.paste_index import find_paste_sources
+from utils.search import search as search_library, mark_lessons_changed
+from utils.gradebook import gradebook as class_gradebook, journal_export, gradebook_export
+from utils.table_export import export_response
+from utils.journal_live import cell_entry, quiz_entry, last_event_id, open_stream, changes_since
+from sqlalchemy.orm import selectinload
+from collections import defaultdict
 from functools import wraps
 
 teacher_bp = Blueprint('teacher', __name__)
@@ -88,7 +106,7 @@ def delete_class(class_id):
         flash('Нет доступа', 'error')
         return redirect(url_for('teacher.classes'))
 
-    db.session.delete(school_class)
+    delete_class_rows(class_id)
     db.session.commit()
     flash('Класс удалён', 'success')
     return redirect(url_for('teacher.classes'))
@@ -196,7 +214,7 @@ def delete_student(student_id):
         flash('Нет доступа', 'error')
         return redirect(url_for('teacher.classes'))
 
-    db.session.delete(student)
+    delete_students([student_id])
     db.session.commit()
     flash('Ученик удалён', 'success')
     return redirect(url_for('teacher.class_detail', class_id=class_id))
@@ -219,16 +237,12 @@ def lessons():
         topics = topic.children
         lessons_list = topic.lessons
         parent = topic
-        breadcrumbs = []
-        current = topic
-        while current:
-            breadcrumbs.insert(0, current)
-            current = current.parent
         return render_template('teacher/lessons.html',
                                topics=topics,
                                lessons=lessons_list,
+                               lesson_counts=subtree_lesson_counts(topics),
                                parent=parent,
-                               breadcrumbs=breadcrumbs)
+                               breadcrumbs=topic_breadcrumbs(topic))
 
     # Иначе показываем корневые папки и уроки без папки
     topics = Topic.query.filter_by(teacher_id=current_user.id, parent_id=None).all()
@@ -236,10 +250,21 @@ def lessons():
     return render_template('teacher/lessons.html',
                            topics=topics,
                            lessons=root_lessons,
+                           lesson_counts=subtree_lesson_counts(topics),
                            parent=None,
                            breadcrumbs=[])
 
 
+@teacher_bp.route('/search')
+@login_required
+@teacher_required
+def search():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    found = search_library(current_user.id, query, page) if query else None
+    return render_template('teacher/search.html', query=query, found=found)
+
+
 @teacher_bp.route('/topics/create', methods=['POST'])
 @login_required
 @teacher_required
@@ -268,15 +293,7 @@ def delete_topic(topic_id):
         return redirect(url_for('teacher.lessons'))
 
     # Проверяем наличие уроков в папке и во всех подпапках
-    def has_lessons(t):
-        if t.lessons:
-            return True
-        for child in t.children:
-            if has_lessons(child):
-                return True
-        return False
-
-    if has_lessons(topic):
+    if subtree_has_lessons(topic):
         flash('Нельзя удалить папку, в которой есть уроки. Сначала переместите или удалите уроки.', 'error')
         if topic.parent_id:
             return redirect(url_for('teacher.lessons', topic_id=topic.parent_id))
@@ -309,17 +326,15 @@ def move_topic(topic_id):
         return redirect(url_for('teacher.lessons', topic_id=topic.parent_id))
 
     # Нельзя переместить в потомка
+    target = None
     if target_id is not None:
         target = Topic.query.get_or_404(target_id)
         if target.teacher_id != current_user.id:
             flash('Нет доступа', 'error')
             return redirect(url_for('teacher.lessons'))
-        current_node = target
-        while current_node is not None:
-            if current_node.id == topic_id:
-                flash('Нельзя переместить папку в её подпапку', 'error')
-                return redirect(url_for('teacher.lessons', topic_id=topic.parent_id))
-            current_node = current_node.parent
+        if is_descendant(target, topic):
+            flash('Нельзя переместить папку в её подпапку', 'error')
+            return redirect(url_for('teacher.lessons', topic_id=topic.parent_id))
 
     # Если уже на месте
     if topic.parent_id == target_id:
@@ -327,7 +342,7 @@ def move_topic(topic_id):
         return redirect(url_for('teacher.lessons', topic_id=target_id))
 
     old_parent_id = topic.parent_id
-    topic.parent_id = target_id
+    move_subtree(topic, target)
     db.session.commit()
     flash(f'Папка «{topic.name}» перемещена', 'success')
 
@@ -340,20 +355,8 @@ def move_topic(topic_id):
 @login_required
 @teacher_required
 def folder_tree():
-    all_topics = Topic.query.filter_by(teacher_id=current_user.id).all()
-
-    def build_tree(parent_id):
-        nodes = []
-        for t in all_topics:
-            if t.parent_id == parent_id:
-                nodes.append({
-                    'id': t.id,
-                    'name': t.name,
-                    'children': build_tree(t.id)
-                })
-        return nodes
-
-    return jsonify(build_tree(None))
+    etag = content_etag('folder-tree', current_user.id, current_user.tree_version)
+    return conditional_json(etag, lambda: folder_tree_data(current_user))
 
 
 @teacher_bp.route('/lessons/create', methods=['POST'])
@@ -407,21 +410,30 @@ def import_lessons():
 
     file_type = data.get('type', '')
 
-    if file_type == 'folder':
-        # Импорт папки с подпапками и уроками
-        counts = _import_folder_data(data, topic_id, current_user.id)
-        flash(f'Импортировано: папок — {counts["folders"]}, уроков — {counts["lessons"]}', 'success')
-    elif file_type == 'lesson':
-        # Импорт одного урока
-        _import_lesson_data(data, topic_id, current_user.id)
-        flash('Урок импортирован', 'success')
-    elif 'lessons' in data:
-        # Старый формат: список уроков
-        for lesson_data in data['lessons']:
-            _import_lesson_data(lesson_data, topic_id, current_user.id)
-        flash(f'Импортировано уроков: {len(data["lessons"])}', 'success')
-    else:
-        flash('Неизвестный формат файла', 'error')
+    try:
+        # Картинки хранятся в файле один раз, в описаниях — только ссылки на них
+        restore_media(data.get('media'))
+
+        if file_type == 'folder':
+            # Импорт папки с подпапками и уроками
+            counts = _import_folder_data(data, topic_id, current_user.id)
+            flash(f'Импортировано: папок — {counts["folders"]}, уроков — {counts["lessons"]}', 'success')
+        elif file_type == 'lesson':
+            # Импорт одного урока
+            _import_lesson_data(data, topic_id, current_user.id)
+            flash('Урок импортирован', 'success')
+        elif 'lessons' in data:
+            # Старый формат: список уроков
+            for lesson_data in data['lessons']:
+                _import_lesson_data(lesson_data, topic_id, current_user.id)
+            flash(f'Импортировано уроков: {len(data["lessons"])}', 'success')
+        else:
+            flash('Неизвестный формат файла', 'error')
+            return redirect(url_for('teacher.lessons', topic_id=topic_id))
+    except ValueError as e:
+        # Слишком большая картинка в описании или в разделе media
+        db.session.rollback()
+        flash(f'Ошибка импорта: {e}', 'error')
         return redirect(url_for('teacher.lessons', topic_id=topic_id))
 
     db.session.commit()
@@ -442,9 +454,9 @@ def _import_lesson_data(lesson_data, topic_id, teacher_id):
             title=task_data.get('title', 'Без названия'),
             task_type=task_type,
             is_bonus=task_data.get('is_bonus', False),
-            description=task_data.get('description', ''),
+            description=extract_data_images(task_data.get('description', '')),
             default_code=task_data.get('default_code', None),
-            order=order
+            order=order * ORDER_GAP
         )
         db.session.add(task)
         db.session.flush()
@@ -454,9 +466,9 @@ def _import_lesson_data(lesson_data, topic_id, teacher_id):
                 element = QuizElement(
                     task_id=task.id,
                     element_type=el_data.get('element_type', 'text'),
-                    content=el_data.get('content', ''),
+                    content=extract_data_images(el_data.get('content', '')),
                     correct_answer=el_data.get('correct_answer', None),
-                    order=el_order
+                    order=el_order * ORDER_GAP
                 )
                 db.session.add(element)
                 db.session.flush()
@@ -466,7 +478,7 @@ def _import_lesson_data(lesson_data, topic_id, teacher_id):
                         element_id=element.id,
                         text=opt_data.get('text', ''),
                         is_correct=opt_data.get('is_correct', False),
-                        order=opt_order
+                        order=opt_order * ORDER_GAP
                     )
                     db.session.add(option)
         else:
@@ -476,7 +488,7 @@ def _import_lesson_data(lesson_data, topic_id, teacher_id):
                     input_data=test_data.get('input', ''),
                     expected_output=test_data.get('output', ''),
                     is_hidden=test_data.get('hidden', False),
-                    order=test_order
+                    order=test_order * ORDER_GAP
                 )
                 db.session.add(test)
 
@@ -512,30 +524,14 @@ def _import_folder_data(folder_data, parent_topic_id, teacher_id):
 @login_required
 @teacher_required
 def export_all():
-    root_topics = Topic.query.filter_by(teacher_id=current_user.id, parent_id=None).all()
-    root_lessons = Lesson.query.filter_by(teacher_id=current_user.id, topic_id=None).all()
+    topics = Topic.query.filter_by(teacher_id=current_user.id).order_by(Topic.id).all()
+    lessons = _lessons_for_export(Lesson.query.filter_by(teacher_id=current_user.id))
+    build_folder = _folder_builder(topics, lessons)
 
-    folders = []
-    for topic in root_topics:
-        folder_data = _export_folder(topic)
-        del folder_data['type']
-        folders.append(folder_data)
-
-    lessons = []
-    for lesson in root_lessons:
-        lesson_data = _export_lesson(lesson)
-        del lesson_data['type']
-        lessons.append(lesson_data)
-
-    data = {
-        'type': 'folder',
-        'name': 'Все уроки',
-        'folders': folders,
-        'lessons': lessons
-    }
+    data = build_folder(None, 'Все уроки')
 
     return Response(
-        json.dumps(data, ensure_ascii=False, indent=2),
+        _export_json(data),
         mimetype='application/json',
         headers={'Content-Disposition': "attachment; filename*=UTF-8''" + quote('Все уроки.json')}
     )
@@ -550,16 +546,27 @@ def export_topic(topic_id):
         flash('Нет доступа', 'error')
         return redirect(url_for('teacher.lessons'))
 
-    data = _export_folder(topic)
+    lessons = _lessons_for_export(
+        Lesson.query.join(Topic, Lesson.topic_id == Topic.id).filter(in_subtree(Topic.path, topic.path))
+    )
+    data = _folder_builder(subtree_topics(topic), lessons)(topic.id, topic.name)
     filename = f'{topic.name}.json'
 
     return Response(
-        json.dumps(data, ensure_ascii=False, indent=2),
+        _export_json(data),
         mimetype='application/json',
         headers={'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}"}
     )
 
 
+def _export_json(data):
+    """Сериализует экспорт и прикладывает картинки, на которые он ссылается (каждую один раз)."""
+    media = collect_media(json.dumps(data, ensure_ascii=False))
+    if media:
+        data['media'] = media
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
 def _export_lesson(lesson):
     """Экспортирует один урок в словарь."""
     tasks = []
@@ -599,26 +606,45 @@ def _export_lesson(lesson):
     }
 
 
-def _export_folder(topic):
-    """Рекурсивно экспортирует папку с подпапками и уроками."""
-    lessons = []
-    for lesson in topic.lessons:
-        lesson_data = _export_lesson(lesson)
-        del lesson_data['type']  # Убираем type у вложенных уроков
-        lessons.append(lesson_data)
+def _lessons_for_export(query):
+    """Уроки поддерева со всем содержимым — фиксированным числом запросов."""
+    return query.options(
+        selectinload(Lesson.tasks).selectinload(Task.test_cases),
+        selectinload(Lesson.tasks).selectinload(Task.quiz_elements).selectinload(QuizElement.options),
+    ).order_by(Lesson.id).all()
 
-    folders = []
-    for child in topic.children:
-        folder_data = _export_folder(child)
-        del folder_data['type']  # Убираем type у вложенных папок
-        folders.append(folder_data)
 
-    return {
-        'type': 'folder',
-        'name': topic.name,
-        'folders': folders,
-        'lessons': lessons
-    }
+def _folder_builder(topics, lessons):
+    """Экспорт папок из уже загруженных списков: дерево собирается в памяти."""
+    children = defaultdict(list)
+    for topic in topics:
+        children[topic.parent_id].append(topic)
+    lessons_by_topic = defaultdict(list)
+    for lesson in lessons:
+        lessons_by_topic[lesson.topic_id].append(lesson)
+
+    def build_folder(topic_id, name):
+        """Папка с подпапками и уроками."""
+        lessons_data = []
+        for lesson in lessons_by_topic[topic_id]:
+            lesson_data = _export_lesson(lesson)
+            del lesson_data['type']  # Убираем type у вложенных уроков
+            lessons_data.append(lesson_data)
+
+        folders = []
+        for child in children[topic_id]:
+            folder_data = build_folder(child.id, child.name)
+            del folder_data['type']  # Убираем type у вложенных папок
+            folders.append(folder_data)
+
+        return {
+            'type': 'folder',
+            'name': name,
+            'folders': folders,
+            'lessons': lessons_data
+        }
+
+    return build_folder
 
 
 @teacher_bp.route('/lessons/<int:lesson_id>/export')
@@ -634,7 +660,7 @@ def export_lesson(lesson_id):
     filename = f'{lesson.title}.json'
 
     return Response(
-        json.dumps(data, ensure_ascii=False, indent=2),
+        _export_json(data),
         mimetype='application/json',
         headers={'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}"}
     )
@@ -686,7 +712,7 @@ def delete_lesson(lesson_id):
         return redirect(url_for('teacher.lessons'))
 
     topic_id = lesson.topic_id
-    db.session.delete(lesson)
+    delete_lessons([lesson_id], lesson.teacher_id)
     db.session.commit()
     flash('Урок удалён', 'success')
 
@@ -736,18 +762,31 @@ def assign_lesson(lesson_id):
         return jsonify({'success': False}), 403
 
     data = request.get_json()
-    class_ids = data.get('class_ids', [])
+    added, removed = _update_assignments(lesson, data.get('class_ids', []))
+    db.session.commit()
+    return jsonify({'success': True, 'added': sorted(added), 'removed': sorted(removed)})
 
-    # Удаляем старые назначения
-    LessonAssignment.query.filter_by(lesson_id=lesson_id).delete()
 
-    # Добавляем новые назначения
-    for class_id in class_ids:
-        assignment = LessonAssignment(lesson_id=lesson_id, class_id=class_id)
-        db.session.add(assignment)
+def _update_assignments(lesson, class_ids):
+    """Приводит назначения урока к набору class_ids, трогая только изменившиеся классы.
 
-    db.session.commit()
-    return jsonify({'success': True})
+    Возвращает (добавленные, снятые) id классов. Чужие классы игнорируются.
+    """
+    wanted = {int(class_id) for class_id in class_ids}
+    if wanted:
+        wanted = {row.id for row in db.session.query(SchoolClass.id).filter(
+            SchoolClass.id.in_(wanted), SchoolClass.teacher_id == lesson.teacher_id
+        )}
+    current = {row.class_id for row in db.session.query(LessonAssignment.class_id).filter_by(lesson_id=lesson.id)}
+
+    added = wanted - current
+    removed = current - wanted
+    if removed:
+        LessonAssignment.query.filter(
+            LessonAssignment.lesson_id == lesson.id, LessonAssignment.class_id.in_(removed)
+        ).delete(synchronize_session=False)
+    db.session.add_all(LessonAssignment(lesson_id=lesson.id, class_id=class_id) for class_id in sorted(added))
+    return added, removed
 
 
 @teacher_bp.route('/lessons/<int:lesson_id>/autosave', methods=['POST'])
@@ -783,8 +822,8 @@ def create_task(lesson_id):
     is_bonus = request.form.get('is_bonus') == 'on'
 
     if title:
-        max_order = db.session.query(db.func.max(Task.order)).filter_by(lesson_id=lesson_id).scalar() or 0
-        task = Task(lesson_id=lesson_id, title=title, task_type=task_type, is_bonus=is_bonus, order=max_order + 1)
+        task = Task(lesson_id=lesson_id, title=title, task_type=task_type, is_bonus=is_bonus,
+                    order=append_key(Task, lesson_id))
         db.session.add(task)
         db.session.commit()
         flash('Задание создано', 'success')
@@ -823,6 +862,12 @@ def update_task(task_id):
     description = request.form.get('description')
     default_code = request.form.get('default_code', '')
 
+    try:
+        description = extract_data_images(description)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('teacher.task_edit', task_id=task_id))
+
     if title:
         task.title = title
     task.description = description
@@ -843,10 +888,13 @@ def autosave_task(task_id):
         return jsonify({'success': False}), 403
 
     data = request.get_json()
+    if 'description' in data:
+        try:
+            task.description = extract_data_images(data['description'])
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
     if data.get('title'):
         task.title = data['title']
-    if 'description' in data:
-        task.description = data['description']
     if 'default_code' in data:
         code = data['default_code']
         task.default_code = code if code and code.strip() else None
@@ -857,6 +905,21 @@ def autosave_task(task_id):
     return jsonify({'success': True})
 
 
+@teacher_bp.route('/media/upload', methods=['POST'])
+@login_required
+@teacher_required
+def upload_media():
+    """Сохраняет вставленную в редактор картинку и возвращает её постоянный URL"""
+    data = request.get_json()
+    try:
+        url = save_data_uri(data.get('data_uri', ''))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if not url:
+        return jsonify({'success': False, 'error': 'Неподдерживаемый формат'}), 400
+    return jsonify({'success': True, 'url': url})
+
+
 @teacher_bp.route('/tasks/<int:task_id>/delete', methods=['POST'])
 @login_required
 @teacher_required
@@ -867,7 +930,9 @@ def delete_task(task_id):
         return redirect(url_for('teacher.lessons'))
 
     lesson_id = task.lesson_id
-    db.session.delete(task)
+    delete_tasks([task_id])
+    invalidate_lessons([lesson_id])
+    mark_lessons_changed([lesson_id])
     db.session.commit()
     flash('Задание удалено', 'success')
 
@@ -885,16 +950,7 @@ def move_task(task_id):
 
     data = request.get_json()
     direction = data.get('direction', 'up')
-    tasks = Task.query.filter_by(lesson_id=task.lesson_id).order_by(Task.order).all()
-
-    idx = next((i for i, t in enumerate(tasks) if t.id == task_id), None)
-    if idx is None:
-        return jsonify({'success': False})
-
-    if direction == 'up' and idx > 0:
-        tasks[idx].order, tasks[idx - 1].order = tasks[idx - 1].order, tasks[idx].order
-    elif direction == 'down' and idx < len(tasks) - 1:
-        tasks[idx].order, tasks[idx + 1].order = tasks[idx + 1].order, tasks[idx].order
+    move_in_order(task, direction)
 
     db.session.commit()
     return jsonify({'success': True})
@@ -912,11 +968,7 @@ def reorder_tasks(lesson_id):
     data = request.get_json()
     task_ids = data.get('task_ids', [])
 
-    for order, task_id in enumerate(task_ids, 1):
-        task = Task.query.get(task_id)
-        if task and task.lesson_id == lesson_id:
-            task.order = order
-
+    set_order(Task, lesson_id, [int(task_id) for task_id in task_ids])
     db.session.commit()
     return jsonify({'success': True})
 
@@ -937,9 +989,8 @@ def create_test(task_id):
     is_hidden = request.form.get('is_hidden') == '1'
 
     if expected_output:
-        max_order = db.session.query(db.func.max(TestCase.order)).filter_by(task_id=task_id).scalar() or 0
         test = TestCase(task_id=task_id, input_data=input_data, expected_output=expected_output,
-                       is_hidden=is_hidden, order=max_order + 1)
+                       is_hidden=is_hidden, order=append_key(TestCase, task_id))
         db.session.add(test)
         db.session.commit()
         flash('Тест добавлен', 'success')
@@ -985,6 +1036,119 @@ def update_test(test_id):
     return jsonify({'success': True})
 
 
+# ==================== ПЕРЕПРОВЕРКА РЕШЕНИЙ ====================
+
+# Размер пачки при массовом обновлении прогресса
+REGRADE_BATCH_SIZE = 500
+
+
+def _regrade_payload(tasks):
+    """Собирает тесты и сданные решения для перепроверки в браузере учителя.
+
+    Берутся только выполненные задания: у невыполненных в code_hash лежит
+    черновик из автосохранения, а не сданное решение.
+    """
+    code_tasks = [t for t in tasks if t.task_type != 'quiz' and t.test_cases]
+    task_ids = [t.id for t in code_tasks]
+
+    submissions = {task_id: [] for task_id in task_ids}
+    if task_ids:
+        rows = db.session.query(StudentProgress.id, StudentProgress.task_id, CodeBlob.data, CodeBlob.compression,
+                                Student.name) \
+            .join(Student, Student.id == StudentProgress.student_id) \
+            .join(CodeBlob, CodeBlob.hash == StudentProgress.code_hash) \
+            .filter(StudentProgress.task_id.in_(task_ids), StudentProgress.is_completed == True) \
+            .order_by(Student.name).all()
+        # Одинаковые решения распаковываем один раз
+        decoded = {}
+        for progress_id, task_id, data, compression, student_name in rows:
+            if data not in decoded:
+                decoded[data] = decode_blob(data, compression)
+            submissions[task_id].append({
+                'progress_id': progress_id,
+                'student_name': student_name,
+                'code': decoded[data]
+            })
+
+    return {
+        'success': True,
+        'tasks': [{
+            'id': t.id,
+            'title': t.title,
+            'tests': [{'input': tc.input_data or '', 'output': tc.expected_output} for tc in t.test_cases],
+            'submissions': submissions[t.id]
+        } for t in code_tasks]
+    }
+
+
+@teacher_bp.route('/tasks/<int:task_id>/regrade')
+@login_required
+@teacher_required
+def regrade_task_data(task_id):
+    task = Task.query.get_or_404(task_id)
+    if task.lesson.teacher_id != current_user.id:
+        return jsonify({'success': False}), 403
+    return jsonify(_regrade_payload([task]))
+
+
+@teacher_bp.route('/lessons/<int:lesson_id>/regrade')
+@login_required
+@teacher_required
+def regrade_lesson_data(lesson_id):
+    lesson = Lesson.query.get_or_404(lesson_id)
+    if lesson.teacher_id != current_user.id:
+        return jsonify({'success': False}), 403
+    return jsonify(_regrade_payload(lesson.tasks))
+
+
+@teacher_bp.route('/regrade/apply', methods=['POST'])
+@login_required
+@teacher_required
+def regrade_apply():
+    """Применяет результаты перепроверки и возвращает список изменившихся отметок.
+
+    Непрошедшее тесты решение снимается с выполненных и помечается ошибкой.
+    Невыполненные задания не засчитываются: ученик сдаёт их сам.
+    """
+    data = request.get_json()
+    results = {r['progress_id']: bool(r['passed']) for r in data.get('results', []) if 'progress_id' in r}
+    if not results:
+        return jsonify({'success': True, 'checked': 0, 'flipped': []})
+
+    # Одним запросом проверяем доступ и получаем текущее состояние
+    rows = db.session.query(StudentProgress.id, Student.name, Task.title) \
+        .join(Student, Student.id == StudentProgress.student_id) \
+        .join(Task, Task.id == StudentProgress.task_id) \
+        .join(Lesson, Lesson.id == Task.lesson_id) \
+        .filter(StudentProgress.id.in_(list(results)), Lesson.teacher_id == current_user.id,
+                StudentProgress.is_completed == True).all()
+
+    updates = []
+    flipped = []
+    for progress_id, student_name, task_title in rows:
+        if results[progress_id]:
+            continue
+        updates.append({
+            'id': progress_id,
+            'is_completed': False,
+            'has_errors': True,
+            'completed_at': None
+        })
+        flipped.append({
+            'student_name': student_name,
+            'task_title': task_title,
+            'was_completed': True,
+            'is_completed': False
+        })
+
+    # Пачки UPDATE по первичному ключу в одной транзакции
+    for start in range(0, len(updates), REGRADE_BATCH_SIZE):
+        db.session.execute(db.update(StudentProgress), updates[start:start + REGRADE_BATCH_SIZE])
+    db.session.commit()
+
+    return jsonify({'success': True, 'checked': len(rows), 'flipped': flipped})
+
+
 # ==================== КВИЗ (ТЕСТЫ) ====================
 
 @teacher_bp.route('/tasks/<int:task_id>/quiz')
@@ -1029,8 +1193,8 @@ def quiz_add_element(task_id):
     if element_type == 'question':
         element_type = 'single_choice'
 
-    max_order = db.session.query(db.func.max(QuizElement.order)).filter_by(task_id=task_id).scalar() or 0
-    element = QuizElement(task_id=task_id, element_type=element_type, content='', order=max_order + 1)
+    element = QuizElement(task_id=task_id, element_type=element_type, content='',
+                          order=append_key(QuizElement, task_id))
     db.session.add(element)
     db.session.commit()
 
@@ -1051,7 +1215,10 @@ def quiz_element_autosave(element_id):
 
     data = request.get_json()
     if 'content' in data:
-        element.content = data['content']
+        try:
+            element.content = extract_data_images(data['content'])
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
     if 'element_type' in data and data['element_type'] in ('single_choice', 'multiple_choice', 'text_input'):
         element.element_type = data['element_type']
     if 'correct_answer' in data:
@@ -1083,16 +1250,7 @@ def quiz_element_move(element_id):
 
     data = request.get_json()
     direction = data.get('direction', 'up')
-    elements = QuizElement.query.filter_by(task_id=element.task_id).order_by(QuizElement.order).all()
-
-    idx = next((i for i, e in enumerate(elements) if e.id == element_id), None)
-    if idx is None:
-        return jsonify({'success': False})
-
-    if direction == 'up' and idx > 0:
-        elements[idx].order, elements[idx - 1].order = elements[idx - 1].order, elements[idx].order
-    elif direction == 'down' and idx < len(elements) - 1:
-        elements[idx].order, elements[idx + 1].order = elements[idx + 1].order, elements[idx].order
+    move_in_order(element, direction)
 
     db.session.commit()
     return jsonify({'success': True})
@@ -1106,8 +1264,8 @@ def quiz_option_add(element_id):
     if element.task.lesson.teacher_id != current_user.id:
         return jsonify({'success': False}), 403
 
-    max_order = db.session.query(db.func.max(QuizOption.order)).filter_by(element_id=element_id).scalar() or 0
-    option = QuizOption(element_id=element_id, text='', is_correct=False, order=max_order + 1)
+    option = QuizOption(element_id=element_id, text='', is_correct=False,
+                        order=append_key(QuizOption, element_id))
     db.session.add(option)
     db.session.commit()
     return jsonify({'success': True, 'option': {
@@ -1191,14 +1349,7 @@ def journal():
                             student_id=student.id, task_id=task.id
                         ).first()
 
-                        entry = {
-                            'completed': progress.is_completed if progress else False,
-                            'has_errors': progress.has_errors if progress else False,
-                            'paste_count': progress.paste_count if progress else 0,
-                            'has_pastes': progress.has_pastes if progress else False,
-                            'has_copies': progress.has_copies if progress else False,
-                            'has_leaves': progress.has_leaves if progress else False,
-                        }
+                        entry = cell_entry(progress)
 
                         # Детальная статистика для тестов
                         if task.task_type == 'quiz':
@@ -1209,15 +1360,7 @@ def journal():
                                     QuizAnswer.student_id == student.id,
                                     QuizAnswer.element_id.in_(question_ids)
                                 ).all()
-                                correct_clean = sum(1 for a in answers if a.is_correct and not a.had_errors)
-                                correct_errors = sum(1 for a in answers if a.is_correct and a.had_errors)
-                                not_answered = total_q - sum(1 for a in answers if a.is_correct)
-                                entry['quiz'] = {
-                                    'total': total_q,
-                                    'clean': correct_clean,
-                                    'errors': correct_errors,
-                                    'pending': not_answered
-                                }
+                                entry['quiz'] = quiz_entry(total_q, answers)
 
                         progress_matrix[student.id][task.id] = entry
             else:
@@ -1227,13 +1370,7 @@ def journal():
         stats = {'completed': 0, 'errors': 0, 'not_done': 0}
         for student in students:
             for task in all_tasks:
-                p = progress_matrix.get(student.id, {}).get(task.id, {})
-                if p.get('completed') and not p.get('has_errors'):
-                    stats['completed'] += 1
-                elif p.get('completed') and p.get('has_errors'):
-                    stats['errors'] += 1
-                else:
-                    stats['not_done'] += 1
+                stats[progress_matrix[student.id][task.id]['state']] += 1
 
         return render_template('teacher/journal.html',
                                classes=classes,
@@ -1243,11 +1380,116 @@ def journal():
                                selected_lesson_id=lesson_id,
                                all_tasks=all_tasks,
                                progress_matrix=progress_matrix,
-                               stats=stats)
+                               stats=stats,
+                               last_event_id=last_event_id(),
+                               max_batch_cells=MAX_BATCH_CELLS)
 
     return render_template('teacher/journal.html', classes=classes, selected_class=None)
 
 
+def _journal_live_scope():
+    """Класс и задания урока для живого обновления журнала или ответ с ошибкой."""
+    school_class = SchoolClass.query.get_or_404(request.args.get('class_id', type=int))
+    lesson = Lesson.query.get_or_404(request.args.get('lesson_id', type=int))
+    if school_class.teacher_id != current_user.id or lesson.teacher_id != current_user.id:
+        return None, (jsonify({'success': False, 'error': 'Нет доступа'}), 403)
+    return (school_class.id, [task.id for task in lesson.tasks]), None
+
+
+@teacher_bp.route('/journal/stream')
+@login_required
+@teacher_required
+def journal_stream():
+    """Поток изменений клеток журнала урока (server-sent events)"""
+    scope, error = _journal_live_scope()
+    if error:
+        return error
+
+    # После переподключения браузер сам присылает id последнего полученного события
+    after_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+    stream = open_stream(*scope, after_id)
+    if stream is None:
+        # Все места для потоков заняты: на 204 EventSource закрывается, журнал переходит на опрос
+        return '', 204
+    return Response(
+        stream_with_context(stream),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@teacher_bp.route('/journal/changes')
+@login_required
+@teacher_required
+def journal_changes():
+    """Изменения клеток журнала после события after (опрос вместо потока)"""
+    scope, error = _journal_live_scope()
+    if error:
+        return error
+    return jsonify({'success': True, 'events': changes_since(*scope, request.args.get('after', 0, type=int))})
+
+
+@teacher_bp.route('/journal/gradebook')
+@login_required
+@teacher_required
+def gradebook():
+    """Сводная ведомость класса по всем назначенным урокам"""
+    school_class = SchoolClass.query.get_or_404(request.args.get('class_id', type=int))
+    if school_class.teacher_id != current_user.id:
+        flash('Нет доступа', 'error')
+        return redirect(url_for('teacher.journal'))
+
+    data = class_gradebook(school_class,
+                           student_page=request.args.get('page', 1, type=int),
+                           lesson_page=request.args.get('lesson_page', 1, type=int))
+    return render_template('teacher/gradebook.html', selected_class=school_class, gradebook=data)
+
+
+@teacher_bp.route('/api/classes/<int:class_id>/gradebook')
+@login_required
+@teacher_required
+def gradebook_data(class_id):
+    school_class = SchoolClass.query.get_or_404(class_id)
+    if school_class.teacher_id != current_user.id:
+        return jsonify({'success': False, 'error': 'Нет доступа'}), 403
+
+    data = class_gradebook(school_class,
+                           student_page=request.args.get('page', 1, type=int),
+                           lesson_page=request.args.get('lesson_page', 1, type=int))
+    return jsonify({'success': True, **data})
+
+
+@teacher_bp.route('/journal/export')
+@login_required
+@teacher_required
+def export_journal():
+    """Журнал урока в CSV или XLSX (?format=xlsx)"""
+    school_class = SchoolClass.query.get_or_404(request.args.get('class_id', type=int))
+    lesson = Lesson.query.get_or_404(request.args.get('lesson_id', type=int))
+    if school_class.teacher_id != current_user.id or lesson.teacher_id != current_user.id:
+        flash('Нет доступа', 'error')
+        return redirect(url_for('teacher.journal'))
+
+    header, rows = journal_export(school_class, lesson)
+    return export_response(f'{school_class.name} — {lesson.title}', lesson.title, header, rows,
+                           request.args.get('format'))
+
+
+@teacher_bp.route('/journal/gradebook/export')
+@login_required
+@teacher_required
+def export_gradebook():
+    """Сводная ведомость класса в CSV или XLSX (?format=xlsx)"""
+    school_class = SchoolClass.query.get_or_404(request.args.get('class_id', type=int))
+    if school_class.teacher_id != current_user.id:
+        flash('Нет доступа', 'error')
+        return redirect(url_for('teacher.journal'))
+
+    header, rows = gradebook_export(school_class)
+    return export_response(f'{school_class.name} — ведомость', school_class.name, header, rows,
+                           request.args.get('format'))
+
+
 @teacher_bp.route('/students/<int:student_id>/tasks/<int:task_id>/code')
 @login_required
 @teacher_required
@@ -1285,7 +1527,7 @@ def get_student_code(student_id, task_id):
         'success': True,
         'student_name': student.name,
         'task_title': task.title,
-        'code': progress.code or '',
+        'code': load_code(progress.code_hash) or '',
         'is_completed': progress.is_completed,
         'has_errors': progress.has_errors,
         'completed_at': progress.completed_at.isoformat() if progress.completed_at else None,
@@ -1307,12 +1549,139 @@ def get_student_activity(student_id, task_id):
     events = ActivityEvent.query.filter_by(
         student_id=student_id, task_id=task_id
     ).order_by(ActivityEvent.created_at.asc()).all()
+    # Откуда, вероятно, взяты вставки (код одноклассника или повторяющийся фрагмент)
+    sources = find_paste_sources(events)
 
     return jsonify({
         'success': True,
         'events': [{
             'event_type': e.event_type,
             'text_content': e.text_content,
-            'created_at': e.created_at.isoformat() if e.created_at else None
+            'created_at': e.created_at.isoformat() if e.created_at else None,
+            'source': sources.get(e.id)
         } for e in events]
     })
+
+
+# Сколько клеток можно запросить за раз (столбец журнала — это класс целиком)
+MAX_BATCH_CELLS = 200
+
+
+@teacher_bp.route('/journal/cells', methods=['POST'])
+@login_required
+@teacher_required
+def get_cell_details():
+    """Код, флаги, хронология и версии для многих клеток журнала сразу.
+
+    Тело: {"cells": [[student_id, task_id], ...]}. Число запросов не зависит от
+    числа клеток; клетки чужих учеников и тестов пропускаются.
+    """
+    data = request.get_json(silent=True) or {}
+    cells = data.get('cells', []) if isinstance(data, dict) else None
+    if not isinstance(cells, list):
+        return jsonify({'success': False, 'error': 'Неверный формат'}), 400
+    try:
+        pairs = {(int(student_id), int(task_id)) for student_id, task_id in cells}
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Неверный формат'}), 400
+    if len(pairs) > MAX_BATCH_CELLS:
+        return jsonify({'success': False, 'error': f'Не больше {MAX_BATCH_CELLS} клеток за раз'}), 400
+
+    student_ids = {student_id for student_id, _ in pairs}
+    task_ids = {task_id for _, task_id in pairs}
+    students = {row.id: row for row in db.session.query(Student.id, Student.name).join(
+        SchoolClass, SchoolClass.id == Student.class_id
+    ).filter(Student.id.in_(student_ids), SchoolClass.teacher_id == current_user.id)}
+    tasks = {row.id: row for row in db.session.query(Task.id, Task.title).filter(
+        Task.id.in_(task_ids), Task.task_type != 'quiz'
+    )}
+    pairs = {(s, t) for s, t in pairs if s in students and t in tasks}
+    if not pairs:
+        return jsonify({'success': True, 'cells': []})
+    student_ids = {s for s, _ in pairs}
+    task_ids = {t for _, t in pairs}
+
+    progress = {(p.student_id, p.task_id): p for p in StudentProgress.query.filter(
+        StudentProgress.student_id.in_(student_ids), StudentProgress.task_id.in_(task_ids)
+    )}
+    codes = load_codes(p.code_hash for key, p in progress.items() if key in pairs)
+    all_events = [e for e in ActivityEvent.query.filter(
+        ActivityEvent.student_id.in_(student_ids), ActivityEvent.task_id.in_(task_ids)
+    ).order_by(ActivityEvent.created_at.asc()) if (e.student_id, e.task_id) in pairs]
+    events = {}
+    for e in all_events:
+        events.setdefault((e.student_id, e.task_id), []).append(e)
+    sources = find_paste_sources(all_events)
+    revisions = revision_lists(student_ids, task_ids)
+
+    cells = []
+    for student_id, task_id in sorted(pairs):
+        p = progress.get((student_id, task_id))
+        cells.append({
+            'student_id': student_id,
+            'task_id': task_id,
+            'student_name': students[student_id].name,
+            'task_title': tasks[task_id].title,
+            'code': (codes.get(p.code_hash) or '') if p else None,
+            'is_completed': p.is_completed if p else False,
+            'has_errors': p.has_errors if p else False,
+            'completed_at': p.completed_at.isoformat() if p and p.completed_at else None,
+            'has_pastes': (p.has_pastes or False) if p else False,
+            'has_copies': (p.has_copies or False) if p else False,
+            'has_leaves': (p.has_leaves or False) if p else False,
+            'events': [{
+                'event_type': e.event_type,
+                'text_content': e.text_content,
+                'created_at': e.created_at.isoformat() if e.created_at else None,
+                'source': sources.get(e.id)
+            } for e in events.get((student_id, task_id), [])],
+            'revisions': [{
+                'number': number,
+                'created_at': created_at.isoformat() if created_at else None
+            } for number, created_at in revisions.get((student_id, task_id), [])],
+        })
+    return jsonify({'success': True, 'cells': cells})
+
+
+@teacher_bp.route('/students/<int:student_id>/tasks/<int:task_id>/revisions')
+@login_required
+@teacher_required
+def get_student_revisions(student_id, task_id):
+    """Список сохранённых версий кода ученика для задания"""
+    student = Student.query.get_or_404(student_id)
+    if student.school_class.teacher_id != current_user.id:
+        return jsonify({'success': False, 'error': 'Нет доступа'}), 403
+
+    return jsonify({
+        'success': True,
+        'revisions': [{
+            'number': number,
+            'created_at': created_at.isoformat() if created_at else None
+        } for number, created_at in revision_list(student_id, task_id)]
+    })
+
+
+@teacher_bp.route('/students/<int:student_id>/tasks/<int:task_id>/revisions/<int:number>')
+@login_required
+@teacher_required
+def get_student_revision(student_id, task_id, number):
+    """Код ученика в версии number"""
+    student = Student.query.get_or_404(student_id)
+    if student.school_class.teacher_id != current_user.id:
+        return jsonify({'success': False, 'error': 'Нет доступа'}), 403
+
+    code = reconstruct(student_id, task_id, number)
+    if code is None:
+        return jsonify({'success': False, 'error': 'Версия не найдена'}), 404
+    return jsonify({'success': True, 'number': number, 'code': code})
+
+
+@teacher_bp.route('/tasks/<int:task_id>/similarity')
+@login_required
+@teacher_required
+def task_similarity(task_id):
+    """Группы похожих решений задания по всем классам"""
+    task = Task.query.get_or_404(task_id)
+    if task.lesson.teacher_id != current_user.id:
+        return jsonify({'success': False, 'error': 'Нет доступа'}), 403
+    return jsonify({'success': True, 'clusters': similar_clusters(task_id)})
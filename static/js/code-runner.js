@@ -72,6 +72,12 @@ function pythonHint(cm) {
     };
 }
 
+// Выполнено ли задание (приходит из /student/task/<id>/progress)
+let isCompleted = false;
+// Пока сохранённый код не загружен, редактор только для чтения и ничего не
+// сохраняется: иначе автосохранение затрёт решение ученика шаблоном
+let progressLoaded = false;
+
 // Инициализация редактора CodeMirror
 const editor = CodeMirror.fromTextArea(document.getElementById('code'), {
     mode: 'python',
@@ -88,7 +94,7 @@ const editor = CodeMirror.fromTextArea(document.getElementById('code'), {
         },
         'Ctrl-Space': 'autocomplete'
     },
-    readOnly: isCompleted
+    readOnly: true
 });
 
 // Автоматически показывать подсказки при вводе
@@ -134,45 +140,87 @@ const checkBtn = document.getElementById('checkBtn');
 // Web Worker для выполнения Python
 let pyodideWorker = null;
 let pyodideReady = false;
-let workerResolve = null; // Callback для результата от воркера
+let activeWorker = null; // { worker, ready, interruptBuffer } — текущий интерпретатор
+let standbyWorker = null; // Запасной, заранее загруженный интерпретатор
+let batchHandler = null; // Обработчик сообщений текущего пакетного запуска
+let batchCounter = 0;
+let interruptBuffer = null; // Общий буфер для прерывания без перезагрузки Python
 let inputResolve = null; // Для асинхронного ввода
 
 // Таймаут для выполнения кода (в миллисекундах)
 const EXECUTION_TIMEOUT = 5000;
+// Сколько ждать ответа воркера после KeyboardInterrupt: голый except
+// в цикле перехватывает прерывание, и тогда воркер пересоздаётся
+const INTERRUPT_GRACE = 1500;
+const TIMEOUT_MESSAGE = 'Превышено время выполнения (5 секунд). Программа была прервана.\nВозможно, она зациклилась. Проверьте условия циклов while и for.';
+
+// Запуск воркера и загрузка в нём Pyodide
+function spawnWorker() {
+    // SharedArrayBuffer доступен только при cross-origin isolation (заголовки COOP/COEP)
+    const buffer = (window.crossOriginIsolated && typeof SharedArrayBuffer !== 'undefined')
+        ? new Uint8Array(new SharedArrayBuffer(1))
+        : null;
+    const handle = {
+        worker: new Worker('/static/js/pyodide-worker.js'),
+        ready: false,
+        interruptBuffer: buffer
+    };
 
-// Создание нового воркера
-function createWorker() {
-    if (pyodideWorker) {
-        pyodideWorker.terminate();
-    }
-
-    pyodideWorker = new Worker('/static/js/pyodide-worker.js');
-    pyodideReady = false;
-
-    pyodideWorker.onmessage = function(e) {
-        const { type, output, error } = e.data;
-
-        if (type === 'ready') {
-            pyodideReady = true;
-            consoleLog('Python готов к работе!', 'success');
-        } else if (type === 'result' || type === 'error') {
-            if (workerResolve) {
-                workerResolve({ output: output || '', error: error || null });
-                workerResolve = null;
-            }
+    handle.worker.onmessage = function(e) {
+        if (e.data.type === 'ready') {
+            handle.ready = true;
+            if (!e.data.interruptible) handle.interruptBuffer = null;
+            onWorkerReady(handle);
+        } else if (handle === activeWorker && batchHandler) {
+            batchHandler(e.data);
         }
     };
 
-    pyodideWorker.onerror = function(e) {
+    handle.worker.onerror = function(e) {
         console.error('Worker error:', e);
-        if (workerResolve) {
-            workerResolve({ output: '', error: 'Ошибка выполнения' });
-            workerResolve = null;
+        if (handle === activeWorker && batchHandler) {
+            batchHandler({ type: 'worker_error' });
         }
     };
 
     // Инициализируем Pyodide в воркере
-    pyodideWorker.postMessage({ type: 'init' });
+    handle.worker.postMessage({
+        type: 'init',
+        indexURL: pyodideIndexUrl,
+        interruptBuffer: buffer ? buffer.buffer : null
+    });
+    return handle;
+}
+
+function onWorkerReady(handle) {
+    if (handle !== activeWorker) return; // Запасной просто ждёт своей очереди
+
+    pyodideReady = true;
+    interruptBuffer = handle.interruptBuffer;
+    consoleLog('Python готов к работе!', 'success');
+
+    // Запасной интерпретатор грузим в фоне, когда основной уже готов,
+    // чтобы не отнимать у него канал при первой загрузке
+    if (!standbyWorker) {
+        standbyWorker = spawnWorker();
+    }
+}
+
+// Создание нового воркера: переключаемся на прогретый запасной, если он есть
+function createWorker() {
+    if (activeWorker) {
+        activeWorker.worker.terminate();
+    }
+
+    activeWorker = standbyWorker || spawnWorker();
+    standbyWorker = null;
+    pyodideWorker = activeWorker.worker;
+    interruptBuffer = activeWorker.interruptBuffer;
+    pyodideReady = false;
+
+    if (activeWorker.ready) {
+        onWorkerReady(activeWorker);
+    }
 }
 
 // Вывод в консоль
@@ -254,50 +302,90 @@ function countInputCalls(code) {
     return count;
 }
 
-// Запуск Python кода с заданными входными данными (через Web Worker)
-async function runPythonCode(code, inputs = [], timeout = EXECUTION_TIMEOUT) {
+// Пакетный запуск тестов (через Web Worker): все тесты одним сообщением,
+// воркер присылает результаты по одному. onResult(index, result) может
+// вернуть false, чтобы не запускать оставшиеся тесты.
+function runPythonBatch(code, inputsList, onResult, timeout = EXECUTION_TIMEOUT) {
     if (!pyodideReady) {
-        return { output: '', error: 'Python ещё загружается...' };
+        onResult(0, { output: '', error: 'Python ещё загружается...' });
+        return Promise.resolve();
     }
 
     return new Promise((resolve) => {
-        let timeoutId;
-        let resolved = false;
-
-        // Устанавливаем callback для результата
-        workerResolve = (result) => {
-            if (!resolved) {
-                resolved = true;
-                clearTimeout(timeoutId);
-                resolve(result);
-            }
-        };
+        const id = ++batchCounter;
+        let timeoutId = null;
+        let graceId = null;
+
+        function clearTimers() {
+            clearTimeout(timeoutId);
+            clearTimeout(graceId);
+            timeoutId = graceId = null;
+        }
+
+        function finish() {
+            clearTimers();
+            batchHandler = null;
+            resolve();
+        }
+
+        function stop() {
+            pyodideWorker.postMessage({ type: 'cancel', id });
+            finish();
+        }
 
-        // Таймаут - прерываем воркер и создаём новый
-        timeoutId = setTimeout(() => {
-            if (!resolved) {
-                resolved = true;
-                workerResolve = null;
-
-                // Прерываем зависший воркер
-                consoleLog('Прерывание выполнения...', 'info');
-                createWorker(); // Это terminate() старый и создаст новый
-
-                resolve({
-                    output: '',
-                    error: 'Превышено время выполнения (5 секунд). Программа была прервана.\nВозможно, она зациклилась. Проверьте условия циклов while и for.',
-                    timeout: true
-                });
+        batchHandler = (msg) => {
+            if (msg.type === 'worker_error') {
+                onResult(0, { output: '', error: 'Ошибка выполнения' });
+                finish();
+                return;
             }
-        }, timeout);
+            if (msg.id !== id) return;
+
+            if (msg.type === 'test_start') {
+                // Бюджет времени на каждый тест отдельно
+                timeoutId = setTimeout(() => {
+                    consoleLog('Прерывание выполнения...', 'info');
+                    const kill = () => {
+                        // Прервать не удалось — пересоздаём воркер
+                        createWorker();
+                        onResult(msg.index, { output: '', error: TIMEOUT_MESSAGE, timeout: true });
+                        finish();
+                    };
+                    if (interruptBuffer) {
+                        // KeyboardInterrupt в Python: обычно воркер сам сообщит о таймауте
+                        Atomics.store(interruptBuffer, 0, 2);
+                        graceId = setTimeout(kill, INTERRUPT_GRACE);
+                    } else {
+                        kill();
+                    }
+                }, timeout);
+            } else if (msg.type === 'test_result') {
+                clearTimers();
+                const result = msg.timeout
+                    ? { output: '', error: TIMEOUT_MESSAGE, timeout: true }
+                    : { output: msg.output || '', error: msg.error || null };
+                if (onResult(msg.index, result) === false) {
+                    stop();
+                }
+            } else if (msg.type === 'batch_done') {
+                finish();
+            }
+        };
 
-        // Отправляем код на выполнение
-        pyodideWorker.postMessage({ type: 'run', code, inputs });
+        pyodideWorker.postMessage({ type: 'run_batch', id, code, tests: inputsList });
     });
 }
 
+// Запуск Python кода с заданными входными данными
+async function runPythonCode(code, inputs = [], timeout = EXECUTION_TIMEOUT) {
+    let result = null;
+    await runPythonBatch(code, [inputs], (index, r) => { result = r; }, timeout);
+    return result;
+}
+
 // Сохранение кода на сервер
 async function saveCode() {
+    if (!progressLoaded || isCompleted) return;
     const code = editor.getValue();
     try {
         await fetch(`/student/task/${taskId}/save`, {
@@ -349,6 +437,83 @@ async function waitForPyodide() {
     });
 }
 
+// ===== Кэш результатов проверки =====
+// Ключ: хэш нормализованного кода + хэш набора тестов задания.
+// Изменение тестов учителем (создание, правка, удаление) меняет хэш набора,
+// поэтому устаревшие результаты просто перестают находиться.
+// v2: ключи без отбрасывания пробелов в конце строк; старый кэш удаляется
+const GRADE_CACHE_KEY = 'gradeCache.v2';
+localStorage.removeItem('gradeCache');
+const GRADE_CACHE_LIMIT = 200;
+
+// 53-битный строковый хэш (cyrb53) — синхронный и работает без HTTPS
+function hashString(str, seed = 0) {
+    let h1 = 0xdeadbeef ^ seed, h2 = 0x41c6ce57 ^ seed;
+    for (let i = 0; i < str.length; i++) {
+        const ch = str.charCodeAt(i);
+        h1 = Math.imul(h1 ^ ch, 2654435761);
+        h2 = Math.imul(h2 ^ ch, 1597334677);
+    }
+    h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+    h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+    return (4294967296 * (2097151 & h2) + (h1 >>> 0)).toString(36);
+}
+
+// Нормализация не меняет смысл программы: только переводы строк и пустые
+// строки в конце файла. Пробелы в конце строк значимы (строки в тройных
+// кавычках, пробел после \ в конце строки), их не трогаем
+function normalizeCode(code) {
+    return code
+        .replace(/\r\n?/g, '\n')
+        .replace(/\n+$/, '');
+}
+
+// Программы со случайностью или временем не кэшируем — их вывод может меняться
+function isCacheable(code) {
+    return !/\b(random|time|datetime|secrets)\b/.test(code);
+}
+
+const testsHash = hashString(JSON.stringify(tests), 1) + hashString(JSON.stringify(tests), 2);
+
+function gradeCacheKey(code) {
+    const normalized = normalizeCode(code);
+    return hashString(normalized, 1) + hashString(normalized, 2) + ':' + testsHash;
+}
+
+// LRU: Map хранит порядок вставки, последний использованный ключ — в конце
+const gradeCache = (() => {
+    try {
+        return new Map(JSON.parse(localStorage.getItem(GRADE_CACHE_KEY) || '[]'));
+    } catch (e) {
+        return new Map();
+    }
+})();
+
+function persistGradeCache() {
+    try {
+        localStorage.setItem(GRADE_CACHE_KEY, JSON.stringify([...gradeCache]));
+    } catch (e) {
+        // Хранилище переполнено — оставляем кэш только в памяти
+    }
+}
+
+function gradeCacheGet(key) {
+    if (!gradeCache.has(key)) return null;
+    const value = gradeCache.get(key);
+    gradeCache.delete(key);
+    gradeCache.set(key, value);
+    return value;
+}
+
+function gradeCacheSet(key, results) {
+    gradeCache.delete(key);
+    gradeCache.set(key, results);
+    while (gradeCache.size > GRADE_CACHE_LIMIT) {
+        gradeCache.delete(gradeCache.keys().next().value);
+    }
+    persistGradeCache();
+}
+
 // Кнопка "Запустить"
 runBtn.addEventListener('click', async () => {
     clearConsole();
@@ -381,9 +546,11 @@ runBtn.addEventListener('click', async () => {
     if (result.timeout) {
         clearConsole();
         consoleLog(result.error, 'error');
-        consoleLog('\nПерезагрузка Python...', 'info');
-        await waitForPyodide();
-        consoleLog('Python готов. Исправьте код и попробуйте снова.', 'success');
+        if (!pyodideReady) {
+            consoleLog('\nПерезагрузка Python...', 'info');
+            await waitForPyodide();
+            consoleLog('Python готов. Исправьте код и попробуйте снова.', 'success');
+        }
     } else if (result.error) {
         // Убираем "Выполнение..." перед выводом ошибки
         if (consoleEl.lastChild) consoleEl.lastChild.remove();
@@ -423,29 +590,32 @@ checkBtn.addEventListener('click', async () => {
     const isCopied = lastPastedText && code.trim() === lastPastedText.trim();
     if (isCopied) {
         showCheatingWarning();
-        showSnake('stressed.png');
+        showSnake('stressed');
     }
 
     await saveCode();
 
     let allPassed = true;
 
-    for (let i = 0; i < tests.length; i++) {
+    // Повторная проверка того же кода на тех же тестах — без запуска Python
+    const cacheKey = isCacheable(code) ? gradeCacheKey(code) : null;
+    const cachedResults = cacheKey ? gradeCacheGet(cacheKey) : null;
+    const results = [];
+    let timedOut = false;
+
+    // Показ результата одного теста; false — остальные тесты не запускаются
+    function reportTest(i, result) {
         const test = tests[i];
         const isHidden = test.hidden;
-        const testInputs = test.input ? test.input.split('\n') : [];
+        results.push({ output: result.output, error: result.error });
 
         consoleLog(`\nТест ${i + 1}${isHidden ? ' (скрытый)' : ''}:`, 'info');
 
-        const result = await runPythonCode(code, testInputs);
-
-        // Если был таймаут, прерываем проверку и ждём перезагрузки
         if (result.timeout) {
             consoleLog(result.error, 'error');
-            consoleLog('\nПерезагрузка Python...', 'info');
-            await waitForPyodide();
-            consoleLog('Python готов. Исправьте код и попробуйте снова.', 'success');
-            return;
+            timedOut = true;
+            allPassed = false;
+            return false;
         }
 
         if (result.error) {
@@ -455,43 +625,54 @@ checkBtn.addEventListener('click', async () => {
                 consoleLog('Ошибка: ' + result.error, 'error');
             }
             allPassed = false;
-            break;
+            return false;
         }
 
-        const expected = (test.output || '').trim();
-        // Убираем echo ввода из результата для сравнения
-        let actual = result.output.trim();
+        const { passed, actual, expected } = compareOutput(result.output, test.output);
 
-        // Для сравнения нам нужен только финальный вывод без echo входных данных
-        // Разбиваем по строкам и берём последние строки
-        const actualLines = actual.split('\n');
-        const expectedLines = expected.split('\n');
+        if (passed) {
+            consoleLog('Пройден!', 'success');
+            return true;
+        }
 
-        // Сравниваем последние N строк, где N = количество строк в expected
-        const relevantLines = actualLines.slice(-expectedLines.length);
-        actual = relevantLines.join('\n');
+        consoleLog('Не пройден!', 'error');
+        if (!isHidden) {
+            consoleLog('Ожидалось: ' + expected);
+            consoleLog('Получено: ' + actual);
+        }
+        allPassed = false;
+        return false;
+    }
 
-        if (actual === expected) {
-            consoleLog('Пройден!', 'success');
-        } else {
-            consoleLog('Не пройден!', 'error');
-            if (!isHidden) {
-                consoleLog('Ожидалось: ' + expected);
-                consoleLog('Получено: ' + actual);
-            }
-            allPassed = false;
-            break;
+    if (cachedResults) {
+        for (let i = 0; i < cachedResults.length && reportTest(i, cachedResults[i]); i++);
+    } else {
+        const inputsList = tests.map(test => test.input ? test.input.split('\n') : []);
+        await runPythonBatch(code, inputsList, reportTest);
+    }
+
+    // Если был таймаут, прерываем проверку (и ждём перезагрузки, если она понадобилась)
+    if (timedOut) {
+        if (!pyodideReady) {
+            consoleLog('\nПерезагрузка Python...', 'info');
+            await waitForPyodide();
+            consoleLog('Python готов. Исправьте код и попробуйте снова.', 'success');
         }
+        return;
+    }
+
+    if (cacheKey && !cachedResults) {
+        gradeCacheSet(cacheKey, results);
     }
 
     if (!allPassed) {
-        showSnake('thinking.png');
+        showSnake('thinking');
     }
 
     if (allPassed) {
         consoleLog('\n=== Все тесты пройдены! ===', 'success');
         if (!isCopied) {
-            showSnake('happy.png');
+            showSnake('happy');
         }
 
         // Отмечаем задание как выполненное
@@ -503,28 +684,12 @@ checkBtn.addEventListener('click', async () => {
             });
 
             if (response.ok) {
-                // Блокируем редактор
-                editor.setOption('readOnly', true);
-                runBtn.disabled = true;
-                checkBtn.disabled = true;
-
-                // Показываем уведомление
-                const alert = document.createElement('div');
-                alert.className = 'position-fixed bottom-0 start-50 translate-middle-x mb-3';
+                lockCompletedTask();
                 if (isCopied) {
-                    alert.innerHTML = `
-                        <div class="alert alert-warning shadow">
-                            <i class="bi bi-exclamation-triangle-fill"></i> Задача выполнена копированием
-                        </div>
-                    `;
+                    showCompletionAlert('Задача выполнена копированием', 'warning', 'exclamation-triangle-fill');
                 } else {
-                    alert.innerHTML = `
-                        <div class="alert alert-success shadow">
-                            <i class="bi bi-check-circle-fill"></i> Задание выполнено!
-                        </div>
-                    `;
+                    showCompletionAlert('Задание выполнено!');
                 }
-                document.body.appendChild(alert);
             }
         } catch (error) {
             console.error('Ошибка:', error);
@@ -532,21 +697,61 @@ checkBtn.addEventListener('click', async () => {
     }
 });
 
+// Блокировка выполненного задания
+function lockCompletedTask() {
+    isCompleted = true;
+    editor.setOption('readOnly', true);
+    runBtn.disabled = true;
+    checkBtn.disabled = true;
+    consoleInput.disabled = true;
+}
+
 // Автосохранение при изменении
 let saveTimeout;
+let editorTouched = false;
+let restoringCode = false;
 editor.on('change', () => {
+    if (restoringCode || !progressLoaded) return;
+    editorTouched = true;
     clearTimeout(saveTimeout);
     saveTimeout = setTimeout(saveCode, 2000);
 });
 
-// ===== Змейка-маскот =====
-function showSnake(imageName) {
-    const img = document.createElement('img');
-    img.src = `/static/imgs/snakes/${imageName}`;
-    img.className = 'snake-bounce';
-    img.alt = '';
-    document.body.appendChild(img);
-    img.addEventListener('animationend', () => img.remove());
+// Повтор загрузки прогресса при ошибке: 1, 2, 4... до 30 секунд
+const PROGRESS_RETRY_MAX = 30000;
+let progressRetryDelay = 1000;
+
+// Сохранённый код и отметка о выполнении
+async function loadTaskProgress() {
+    const progress = await fetchStudentProgress(`/student/task/${taskId}/progress`);
+    if (!progress) {
+        if (!progressLoaded) {
+            showCompletionAlert('Не удалось загрузить сохранённый код. Повторяем попытку...', 'danger', 'wifi-off');
+            setTimeout(loadTaskProgress, progressRetryDelay);
+            progressRetryDelay = Math.min(progressRetryDelay * 2, PROGRESS_RETRY_MAX);
+        }
+        return;
+    }
+
+    // При возврате на страницу кнопкой «Назад» набранный код не трогаем
+    if (progress.code && !editorTouched && progress.code !== editor.getValue()) {
+        restoringCode = true;
+        editor.setValue(progress.code);
+        editor.clearHistory();
+        restoringCode = false;
+    }
+    if (progress.is_completed) {
+        lockCompletedTask();
+        showCompletionAlert('Задание выполнено!');
+    } else if (!progressLoaded) {
+        const alert = document.getElementById('completionAlert');
+        if (alert) alert.remove();
+        editor.setOption('readOnly', false);
+        runBtn.disabled = false;
+        checkBtn.disabled = false;
+    }
+    progressLoaded = true;
+    setNextTaskAvailable(progress.next_task_available);
 }
 
 // ===== Отслеживание активности ученика =====
@@ -638,5 +843,7 @@ document.addEventListener('visibilitychange', () => {
     }
 });
 
+onStudentPageShow(loadTaskProgress);
+
 // Загрузка Pyodide при старте
 loadPyodideAndPackages();
@@ -0,0 +1,12 @@
+// Общая логика проверки вывода программы (ученик и перепроверка учителем)
+
+// Сравнение вывода программы с ожидаемым.
+// Вывод содержит echo введённых данных, поэтому сравниваем
+// только последние N строк, где N = количество строк в expected
+function compareOutput(output, expectedOutput) {
+    const expected = (expectedOutput || '').trim();
+    const actualLines = (output || '').trim().split('\n');
+    const expectedLines = expected.split('\n');
+    const actual = actualLines.slice(-expectedLines.length).join('\n');
+    return { passed: actual === expected, actual, expected };
+}
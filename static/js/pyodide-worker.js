@@ -1,76 +1,166 @@
 // Web Worker для выполнения Python кода через Pyodide
 // Этот файл выполняется в отдельном потоке, что позволяет прерывать зацикленные программы
 
-importScripts('https://cdn.jsdelivr.net/pyodide/v0.24.1/full/pyodide.js');
+const DEFAULT_INDEX_URL = 'https://cdn.jsdelivr.net/pyodide/v0.24.1/full/';
 
 let pyodide = null;
+let runTest = null;
+let interruptBuffer = null;
+let cancelledBatch = null;
 
-// Инициализация Pyodide
-async function initPyodide() {
-    pyodide = await loadPyodide();
-    self.postMessage({ type: 'ready' });
-}
-
-// Выполнение Python кода
-async function runPython(code, inputs) {
-    if (!pyodide) {
-        self.postMessage({ type: 'error', error: 'Python ещё загружается...' });
-        return;
-    }
-
-    // Перехват stdout
-    pyodide.runPython(`
+// Перехват stdout и функция input устанавливаются один раз при загрузке.
+// Каждый тест выполняется в новом пространстве имён со своим буфером вывода,
+// а состояние интерпретатора перед тестом сбрасывается к снимку.
+const RUNNER_SETUP = `
 import sys
+import builtins
+import traceback
+
 
 class MockStdout:
     def __init__(self):
         self.data = []
     def write(self, text):
         self.data.append(text)
+        return len(text)
     def flush(self):
         pass
 
-sys.stdout = MockStdout()
-sys.stderr = MockStdout()
-    `);
-
-    // Установка функции input
-    pyodide.globals.set('__inputs__', inputs);
-    pyodide.globals.set('__input_index__', 0);
-
-    pyodide.runPython(`
-def input(prompt=''):
-    global __input_index__
-    if prompt:
-        sys.stdout.write(str(prompt))
-    if __input_index__ < len(__inputs__):
-        val = __inputs__[__input_index__]
-        __input_index__ += 1
-        sys.stdout.write(str(val) + '\\n')
-        return val
-    return ''
 
-import builtins
-builtins.input = input
-    `);
+# Снимок состояния интерпретатора после загрузки (заполняется в конце)
+__snapshot__ = {}
+
+
+def __reset__():
+    # Дешёвый сброс вместо нового интерпретатора: убираем модули,
+    # импортированные программой, и возвращаем builtins и __main__
+    snapshot = __snapshot__
+    main_dict = sys.modules['__main__'].__dict__
+    for name in set(sys.modules) - snapshot['modules']:
+        del sys.modules[name]
+    builtins.__dict__.clear()
+    builtins.__dict__.update(snapshot['builtins'])
+    main_dict.clear()
+    main_dict.update(snapshot['main'])
+    sys.path[:] = snapshot['path']
+    sys.setrecursionlimit(snapshot['recursion_limit'])
+
+
+def __run_test__(code, inputs):
+    __reset__()
+    stdout = MockStdout()
+    inputs = list(inputs)
+    input_index = 0
+
+    def input(prompt=''):
+        nonlocal input_index
+        if prompt:
+            stdout.write(str(prompt))
+        if input_index < len(inputs):
+            val = inputs[input_index]
+            input_index += 1
+            stdout.write(str(val) + '\\n')
+            return val
+        return ''
+
+    builtins.input = input
+    sys.stdout = stdout
+    sys.stderr = stdout
+    namespace = {'__name__': '__main__', '__builtins__': builtins}
+    try:
+        exec(compile(code, '<exec>', 'exec'), namespace)
+    except KeyboardInterrupt:
+        return ('', None, True)
+    except BaseException as e:
+        # Первый кадр — сам __run_test__, ученику он не нужен
+        error = ''.join(traceback.format_exception(type(e), e, e.__traceback__.tb_next))
+        return ('', error, False)
+    finally:
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
+    return (''.join(stdout.data).strip(), None, False)
+
+
+__snapshot__.update(
+    modules=set(sys.modules),
+    builtins=dict(builtins.__dict__),
+    main=dict(sys.modules['__main__'].__dict__),
+    path=list(sys.path),
+    recursion_limit=sys.getrecursionlimit(),
+)
+`;
+
+// Инициализация Pyodide
+async function initPyodide(indexURL, buffer) {
+    // Адрес дистрибутива передаёт страница: локальная копия или CDN
+    indexURL = indexURL || DEFAULT_INDEX_URL;
+    importScripts(indexURL + 'pyodide.js');
+    pyodide = await loadPyodide({ indexURL });
+    pyodide.runPython(RUNNER_SETUP);
+    runTest = pyodide.globals.get('__run_test__');
+
+    // Общий буфер прерывания: основной поток пишет в него SIGINT по таймауту
+    if (buffer) {
+        interruptBuffer = new Uint8Array(buffer);
+        pyodide.setInterruptBuffer(interruptBuffer);
+    }
+    self.postMessage({ type: 'ready', interruptible: !!buffer });
+}
+
+// Выполнение одного теста
+function executeTest(code, inputs) {
+    if (interruptBuffer) interruptBuffer[0] = 0;
+    const result = runTest(code, pyodide.toPy(inputs));
+    const [output, error, timeout] = result.toJs();
+    result.destroy();
+    return { output, error, timeout };
+}
+
+// Выполнение Python кода (одиночный запуск)
+function runPython(code, inputs) {
+    if (!pyodide) {
+        self.postMessage({ type: 'error', error: 'Python ещё загружается...' });
+        return;
+    }
 
     try {
-        pyodide.runPython(code);
-        const stdout = pyodide.runPython('sys.stdout.data');
-        const output = stdout.toJs().join('');
-        self.postMessage({ type: 'result', output: output.trim(), error: null });
+        const { output, error, timeout } = executeTest(code, inputs);
+        self.postMessage({ type: 'result', output, error, timeout });
     } catch (error) {
         self.postMessage({ type: 'result', output: '', error: error.message });
     }
 }
 
+// Пакетный запуск: все тесты одним сообщением, результаты отправляются по мере готовности
+async function runBatch(id, code, tests) {
+    for (let index = 0; index < tests.length; index++) {
+        // Даём основному потоку шанс отменить оставшиеся тесты
+        await new Promise(resolve => setTimeout(resolve, 0));
+        if (cancelledBatch === id) break;
+
+        self.postMessage({ type: 'test_start', id, index });
+        let result;
+        try {
+            result = executeTest(code, tests[index] || []);
+        } catch (error) {
+            result = { output: '', error: error.message, timeout: false };
+        }
+        self.postMessage({ type: 'test_result', id, index, ...result });
+    }
+    self.postMessage({ type: 'batch_done', id });
+}
+
 // Обработка сообщений от основного потока
 self.onmessage = async function(e) {
     const { type, code, inputs } = e.data;
 
     if (type === 'init') {
-        await initPyodide();
+        await initPyodide(e.data.indexURL, e.data.interruptBuffer);
     } else if (type === 'run') {
-        await runPython(code, inputs || []);
+        runPython(code, inputs || []);
+    } else if (type === 'run_batch') {
+        await runBatch(e.data.id, code, e.data.tests || []);
+    } else if (type === 'cancel') {
+        cancelledBatch = e.data.id;
     }
 };
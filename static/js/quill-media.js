@@ -0,0 +1,25 @@
+// Картинки, вставленные в Quill, приходят как data URI. Загружаем их на сервер
+// и заменяем ссылками, чтобы автосохранение не пересылало их каждый раз.
+
+const uploadingImages = new WeakSet();
+
+function uploadInlineImages(quill, onUploaded) {
+    quill.root.querySelectorAll('img[src^="data:"]').forEach(img => {
+        if (uploadingImages.has(img)) return;
+        uploadingImages.add(img);
+
+        fetch('/teacher/media/upload', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ data_uri: img.getAttribute('src') })
+        })
+        .then(r => r.json())
+        .then(res => {
+            if (res.success) {
+                img.setAttribute('src', res.url);
+                if (onUploaded) onUploaded();
+            }
+        })
+        .catch(() => uploadingImages.delete(img));
+    });
+}
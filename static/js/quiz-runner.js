@@ -1,15 +1,5 @@
-// Множество правильно отвеченных вопросов
-const answeredCorrectly = new Set(answeredIds || []);
-
-// Змейка-маскот
-function showSnake(imageName) {
-    const img = document.createElement('img');
-    img.src = `/static/imgs/snakes/${imageName}`;
-    img.className = 'snake-bounce';
-    img.alt = '';
-    document.body.appendChild(img);
-    img.addEventListener('animationend', () => img.remove());
-}
+// Множество правильно отвеченных вопросов (заполняется из /student/task/<id>/progress)
+const answeredCorrectly = new Set();
 
 // Отключить inputs для вопроса
 function disableQuestion(elementId) {
@@ -20,6 +10,19 @@ function disableQuestion(elementId) {
     if (btn) btn.disabled = true;
 }
 
+function showCorrectFeedback(elementId) {
+    const feedbackEl = document.getElementById('feedback-' + elementId);
+    if (feedbackEl) {
+        feedbackEl.innerHTML = '<span class="text-success"><i class="bi bi-check-circle-fill"></i> Правильно!</span>';
+    }
+}
+
+// Блокировка всех вопросов пройденного теста
+function lockQuiz() {
+    document.querySelectorAll('.check-answer-btn').forEach(b => b.disabled = true);
+    document.querySelectorAll('.quiz-question-card input').forEach(i => i.disabled = true);
+}
+
 // Обработчик кнопок "Ответить"
 document.querySelectorAll('.check-answer-btn').forEach(btn => {
     btn.addEventListener('click', async function() {
@@ -51,18 +54,18 @@ document.querySelectorAll('.check-answer-btn').forEach(btn => {
             const feedbackEl = document.getElementById('feedback-' + elementId);
 
             if (result.correct) {
-                feedbackEl.innerHTML = '<span class="text-success"><i class="bi bi-check-circle-fill"></i> Правильно!</span>';
+                showCorrectFeedback(elementId);
                 disableQuestion(elementId);
                 answeredCorrectly.add(elementId);
 
                 // Проверяем, все ли вопросы отвечены
                 if (answeredCorrectly.size === totalQuestions) {
                     await completeQuiz();
-                    showSnake('happy.png');
+                    showSnake('happy');
                 }
             } else {
                 feedbackEl.innerHTML = '<span class="text-danger"><i class="bi bi-x-circle-fill"></i> Неправильно. Попробуйте ещё раз.</span>';
-                showSnake('thinking.png');
+                showSnake('thinking');
             }
         } catch (error) {
             console.error('Ошибка:', error);
@@ -79,17 +82,27 @@ async function completeQuiz() {
         });
 
         if (response.ok) {
-            // Блокируем все оставшиеся inputs
-            document.querySelectorAll('.check-answer-btn').forEach(b => b.disabled = true);
-            document.querySelectorAll('.quiz-question-card input').forEach(i => i.disabled = true);
-
-            // Показываем уведомление
-            const alert = document.createElement('div');
-            alert.className = 'position-fixed bottom-0 start-50 translate-middle-x mb-3';
-            alert.innerHTML = '<div class="alert alert-success shadow"><i class="bi bi-check-circle-fill"></i> Тест пройден!</div>';
-            document.body.appendChild(alert);
+            lockQuiz();
+            showCompletionAlert('Тест пройден!');
         }
     } catch (error) {
         console.error('Ошибка:', error);
     }
 }
+
+// Уже отвеченные вопросы и отметка о прохождении
+onStudentPageShow(async () => {
+    const progress = await fetchStudentProgress('/student/task/' + taskId + '/progress');
+    if (!progress) return;
+
+    progress.answered_ids.forEach(elementId => {
+        answeredCorrectly.add(elementId);
+        showCorrectFeedback(elementId);
+        disableQuestion(elementId);
+    });
+    if (progress.is_completed) {
+        lockQuiz();
+        showCompletionAlert('Тест пройден!');
+    }
+    setNextTaskAvailable(progress.next_task_available);
+});
@@ -0,0 +1,191 @@
+// Перепроверка сохранённых решений учеников после изменения тестов.
+// Решения выполняются в браузере учителя пулом Web Worker'ов с Pyodide,
+// результаты отправляются на сервер одним запросом.
+
+// Таймаут одного теста (в миллисекундах)
+const REGRADE_TIMEOUT = 5000;
+// Размер пула: не больше 4 интерпретаторов, и оставляем одно ядро странице
+const REGRADE_POOL_SIZE = Math.max(1, Math.min(4, (navigator.hardwareConcurrency || 2) - 1));
+
+// Один слот пула — воркер с загруженным Pyodide
+function createRegradeSlot() {
+    const slot = { worker: null, ready: null, resolve: null };
+
+    slot.start = function() {
+        if (slot.worker) slot.worker.terminate();
+        slot.worker = new Worker('/static/js/pyodide-worker.js');
+        slot.ready = new Promise((resolveReady) => {
+            slot.worker.onmessage = function(e) {
+                const { type, output, error } = e.data;
+                if (type === 'ready') {
+                    resolveReady();
+                } else if ((type === 'result' || type === 'error') && slot.resolve) {
+                    slot.resolve({ output: output || '', error: error || null });
+                    slot.resolve = null;
+                }
+            };
+        });
+        slot.worker.onerror = function() {
+            if (slot.resolve) {
+                slot.resolve({ output: '', error: 'Ошибка выполнения' });
+                slot.resolve = null;
+            }
+        };
+        slot.worker.postMessage({ type: 'init', indexURL: pyodideIndexUrl });
+    };
+
+    // Запуск кода; при зацикливании воркер пересоздаётся
+    slot.run = async function(code, inputs) {
+        await slot.ready;
+        return new Promise((resolve) => {
+            const timeoutId = setTimeout(() => {
+                slot.resolve = null;
+                slot.start();
+                resolve({ output: '', error: 'timeout', timeout: true });
+            }, REGRADE_TIMEOUT);
+            slot.resolve = (result) => {
+                clearTimeout(timeoutId);
+                resolve(result);
+            };
+            slot.worker.postMessage({ type: 'run', code, inputs });
+        });
+    };
+
+    slot.start();
+    return slot;
+}
+
+// Решение проходит, если все тесты пройдены (останавливаемся на первом провале)
+async function gradeSubmission(slot, code, tests) {
+    for (const test of tests) {
+        const inputs = test.input ? test.input.split('\n') : [];
+        const result = await slot.run(code, inputs);
+        if (result.error || !compareOutput(result.output, test.output).passed) {
+            return false;
+        }
+    }
+    return true;
+}
+
+async function runRegrade(dataUrl, onProgress) {
+    const response = await fetch(dataUrl);
+    const data = await response.json();
+    if (!data.success) throw new Error('Нет доступа');
+
+    const jobs = [];
+    for (const task of data.tasks) {
+        for (const submission of task.submissions) {
+            jobs.push({ progress_id: submission.progress_id, code: submission.code, tests: task.tests });
+        }
+    }
+
+    const results = [];
+    let done = 0;
+    onProgress(done, jobs.length);
+
+    if (jobs.length > 0) {
+        const slots = Array.from({ length: Math.min(REGRADE_POOL_SIZE, jobs.length) }, createRegradeSlot);
+        let next = 0;
+
+        // Каждый слот забирает следующее решение из общей очереди
+        await Promise.all(slots.map(async (slot) => {
+            while (next < jobs.length) {
+                const job = jobs[next++];
+                const passed = await gradeSubmission(slot, job.code, job.tests);
+                results.push({ progress_id: job.progress_id, passed });
+                onProgress(++done, jobs.length);
+            }
+            slot.worker.terminate();
+        }));
+    }
+
+    const applyResponse = await fetch('/teacher/regrade/apply', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ results })
+    });
+    return applyResponse.json();
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+function showRegradeModal() {
+    let modalEl = document.getElementById('regradeModal');
+    if (!modalEl) {
+        modalEl = document.createElement('div');
+        modalEl.className = 'modal fade';
+        modalEl.id = 'regradeModal';
+        modalEl.tabIndex = -1;
+        modalEl.innerHTML = `
+            <div class="modal-dialog modal-lg">
+                <div class="modal-content">
+                    <div class="modal-header">
+                        <h5 class="modal-title"><i class="bi bi-arrow-repeat"></i> Перепроверка решений</h5>
+                        <button type="button" class="btn-close" data-bs-dismiss="modal"></button>
+                    </div>
+                    <div class="modal-body" id="regradeBody"></div>
+                </div>
+            </div>
+        `;
+        document.body.appendChild(modalEl);
+    }
+    bootstrap.Modal.getOrCreateInstance(modalEl).show();
+    return document.getElementById('regradeBody');
+}
+
+function renderRegradeReport(body, report) {
+    if (!report.success) {
+        body.innerHTML = '<div class="alert alert-danger mb-0">Не удалось сохранить результаты</div>';
+        return;
+    }
+    if (report.flipped.length === 0) {
+        body.innerHTML = `<div class="alert alert-success mb-0">Проверено решений: ${report.checked}. Изменений нет.</div>`;
+        return;
+    }
+    const rows = report.flipped.map(f => `
+        <tr>
+            <td>${escapeHtml(f.student_name)}</td>
+            <td>${escapeHtml(f.task_title)}</td>
+            <td>${f.is_completed
+                ? '<span class="text-success"><i class="bi bi-check-circle-fill"></i> теперь выполнено</span>'
+                : '<span class="text-danger"><i class="bi bi-x-circle-fill"></i> больше не выполнено</span>'}</td>
+        </tr>
+    `).join('');
+    body.innerHTML = `
+        <p>Проверено решений: ${report.checked}. Изменилось отметок: ${report.flipped.length}.</p>
+        <table class="table table-sm mb-0">
+            <thead><tr><th>Ученик</th><th>Задание</th><th>Результат</th></tr></thead>
+            <tbody>${rows}</tbody>
+        </table>
+    `;
+}
+
+document.querySelectorAll('.regrade-btn').forEach(btn => {
+    btn.addEventListener('click', async () => {
+        if (!confirm('Перепроверить сданные решения учеников по текущим тестам?')) return;
+        btn.disabled = true;
+        const body = showRegradeModal();
+        body.innerHTML = `
+            <p class="mb-2">Загрузка Python и решений...</p>
+            <div class="progress"><div class="progress-bar" id="regradeProgress" style="width: 0%"></div></div>
+        `;
+        try {
+            const report = await runRegrade(btn.dataset.url, (done, total) => {
+                const bar = document.getElementById('regradeProgress');
+                if (bar) {
+                    bar.style.width = (total ? Math.round(done * 100 / total) : 100) + '%';
+                    bar.textContent = `${done} / ${total}`;
+                }
+            });
+            renderRegradeReport(body, report);
+        } catch (error) {
+            body.innerHTML = `<div class="alert alert-danger mb-0">Ошибка: ${escapeHtml(error.message)}</div>`;
+        } finally {
+            btn.disabled = false;
+        }
+    });
+});
@@ -0,0 +1,57 @@
+// Змейка-маскот на страницах задания и квиза.
+// Варианты картинок (AVIF/WebP/PNG разной ширины) страница передаёт в snakeImages;
+// без сборки статики там только исходные PNG.
+
+const SNAKE_MOODS = ['happy', 'stressed', 'thinking', 'study'];
+// Ширина змейки на экране (см. .snake-bounce в style.css)
+const SNAKE_SIZES = '150px';
+
+function createSnakePicture(mood) {
+    const images = (typeof snakeImages !== 'undefined' && snakeImages[mood])
+        || { src: `/static/imgs/snakes/${mood}.png`, srcset: '', sources: [] };
+
+    const picture = document.createElement('picture');
+    images.sources.forEach(({ type, srcset }) => {
+        const source = document.createElement('source');
+        source.type = type;
+        source.srcset = srcset;
+        source.sizes = SNAKE_SIZES;
+        picture.appendChild(source);
+    });
+
+    // Картинку вставляем в <picture> до установки src, чтобы браузер
+    // сразу выбрал подходящий формат и не загрузил запасной PNG
+    const img = document.createElement('img');
+    picture.appendChild(img);
+    if (images.srcset) {
+        img.srcset = images.srcset;
+        img.sizes = SNAKE_SIZES;
+    }
+    img.src = images.src;
+    img.alt = '';
+    return { picture, img };
+}
+
+function showSnake(mood) {
+    const { picture, img } = createSnakePicture(mood);
+    img.className = 'snake-bounce';
+    document.body.appendChild(picture);
+    img.addEventListener('animationend', () => picture.remove());
+}
+
+// Загружаем все настроения заранее, один раз за сессию: дальше они берутся
+// из кэша браузера, и змейка появляется сразу после проверки
+function preloadSnakes() {
+    if (sessionStorage.getItem('snakesPreloaded')) return;
+    const load = () => {
+        SNAKE_MOODS.forEach(mood => createSnakePicture(mood));
+        sessionStorage.setItem('snakesPreloaded', '1');
+    };
+    if ('requestIdleCallback' in window) {
+        requestIdleCallback(load);
+    } else {
+        setTimeout(load, 1000);
+    }
+}
+
+preloadSnakes();
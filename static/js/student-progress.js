@@ -0,0 +1,68 @@
+// Личные данные ученика на страницах урока и задания.
+// Сами страницы кэшируются браузером и сверяются с сервером по ETag,
+// а выполненные задания, сохранённый код и ответы квиза приходят
+// отдельным небольшим JSON-запросом.
+
+async function fetchStudentProgress(url) {
+    try {
+        const response = await fetch(url);
+        if (!response.ok) return null;
+        const data = await response.json();
+        return data.success ? data : null;
+    } catch (error) {
+        console.error('Ошибка загрузки прогресса:', error);
+        return null;
+    }
+}
+
+// Запуск при загрузке и при возврате на страницу кнопкой «Назад»
+function onStudentPageShow(callback) {
+    callback();
+    window.addEventListener('pageshow', (e) => {
+        if (e.persisted) callback();
+    });
+}
+
+// Ссылки на следующее задание (бонусное открывается после основных)
+function setNextTaskAvailable(available) {
+    document.querySelectorAll('.next-task-link').forEach(link => {
+        link.classList.toggle('disabled', !available);
+        if (available) link.removeAttribute('title');
+    });
+}
+
+function showCompletionAlert(text, variant = 'success', icon = 'check-circle-fill') {
+    const existing = document.getElementById('completionAlert');
+    if (existing) existing.remove();
+
+    const alert = document.createElement('div');
+    alert.id = 'completionAlert';
+    alert.className = 'position-fixed bottom-0 start-50 translate-middle-x mb-3';
+    alert.innerHTML = `
+        <div class="alert alert-${variant} shadow">
+            <i class="bi bi-${icon}"></i> ${text}
+        </div>
+    `;
+    document.body.appendChild(alert);
+}
+
+// Страница урока: отметки о выполнении и дополнительные задания
+function loadLessonProgress(lessonId) {
+    onStudentPageShow(async () => {
+        const data = await fetchStudentProgress(`/student/lesson/${lessonId}/progress`);
+        if (!data) return;
+
+        const completed = new Set(data.completed);
+        document.querySelectorAll('.task-card').forEach(card => {
+            const done = completed.has(parseInt(card.dataset.taskId));
+            card.classList.toggle('border-success', done);
+            card.querySelector('.task-done-icon').classList.toggle('d-none', !done);
+            card.querySelector('.task-todo-icon').classList.toggle('d-none', done);
+        });
+
+        const bonusTasks = document.getElementById('bonusTasks');
+        const bonusLocked = document.getElementById('bonusLocked');
+        if (bonusTasks) bonusTasks.classList.toggle('d-none', !data.show_bonus);
+        if (bonusLocked) bonusLocked.classList.toggle('d-none', data.show_bonus);
+    });
+}
@@ -0,0 +1,44 @@
+// Service worker: хранит дистрибутив Pyodide в Cache Storage, чтобы повторная
+// загрузка страницы и перезапуск воркера после таймаута не ходили в сеть
+
+const PYODIDE_INDEX_URL = new URL(
+    new URL(self.location).searchParams.get('pyodide') || '/static/vendor/pyodide/',
+    self.location.origin
+).href;
+const PYODIDE_FILES = ['pyodide.js', 'pyodide.asm.js', 'pyodide.asm.wasm', 'python_stdlib.zip', 'pyodide-lock.json'];
+const CACHE_PREFIX = 'pyodide-';
+const CACHE_NAME = CACHE_PREFIX + PYODIDE_INDEX_URL;
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then(cache => cache.addAll(PYODIDE_FILES.map(name => new Request(PYODIDE_INDEX_URL + name, { mode: 'cors' }))))
+            .then(() => self.skipWaiting())
+    );
+});
+
+// Удаляем кэши прежних версий Pyodide
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys
+                .filter(key => key.startsWith(CACHE_PREFIX) && key !== CACHE_NAME)
+                .map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+// Файлы Pyodide — сначала из кэша, остальные запросы не трогаем
+self.addEventListener('fetch', (event) => {
+    if (event.request.method !== 'GET' || !event.request.url.startsWith(PYODIDE_INDEX_URL)) return;
+
+    event.respondWith(
+        caches.open(CACHE_NAME).then(async (cache) => {
+            const cached = await cache.match(event.request.url);
+            if (cached) return cached;
+            const response = await fetch(event.request.url, { mode: 'cors' });
+            if (response.ok) cache.put(event.request.url, response.clone());
+            return response;
+        })
+    );
+});
@@ -0,0 +1,248 @@
+"""Сборка статики: локальные копии библиотек, бандлы, отпечатки и сжатие.
+
+`flask build-assets` скачивает Bootstrap, Bootstrap Icons, CodeMirror и Quill
+в static/vendor, склеивает файлы в бандлы для страниц, при наличии rcssmin/rjsmin
+минифицирует наши файлы и пишет результат в static/dist под именами с хэшем
+содержимого. Рядом кладутся .gz и (если установлен brotli) .br варианты.
+Картинки змейки пережимаются в WebP/AVIF (см. utils/images.py).
+Соответствие исходных имён собранным хранится в static/dist/manifest.json.
+
+Пока сборки нет, страницы подключают файлы по отдельности: из static/vendor,
+если библиотеки скачаны, иначе с CDN.
+"""
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+import urllib.request
+
+from flask import current_app, url_for
+from markupsafe import Markup, escape
+
+from utils.images import build_image_variants
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+BOOTSTRAP_CDN = 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/'
+ICONS_CDN = 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.1/font/'
+CODEMIRROR_CDN = 'https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.65.15/'
+QUILL_CDN = 'https://cdn.quilljs.com/1.3.7/'
+
+# Путь в static → адрес на CDN. Версия в пути: файлы в папке никогда не меняются
+VENDOR_FILES = {
+    'vendor/bootstrap/5.3.2/bootstrap.min.css': BOOTSTRAP_CDN + 'css/bootstrap.min.css',
+    'vendor/bootstrap/5.3.2/bootstrap.bundle.min.js': BOOTSTRAP_CDN + 'js/bootstrap.bundle.min.js',
+    'vendor/bootstrap-icons/1.11.1/bootstrap-icons.css': ICONS_CDN + 'bootstrap-icons.css',
+    'vendor/bootstrap-icons/1.11.1/fonts/bootstrap-icons.woff2': ICONS_CDN + 'fonts/bootstrap-icons.woff2',
+    'vendor/bootstrap-icons/1.11.1/fonts/bootstrap-icons.woff': ICONS_CDN + 'fonts/bootstrap-icons.woff',
+    'vendor/codemirror/5.65.15/codemirror.min.css': CODEMIRROR_CDN + 'codemirror.min.css',
+    'vendor/codemirror/5.65.15/codemirror.min.js': CODEMIRROR_CDN + 'codemirror.min.js',
+    'vendor/codemirror/5.65.15/theme/monokai.min.css': CODEMIRROR_CDN + 'theme/monokai.min.css',
+    'vendor/codemirror/5.65.15/mode/python/python.min.js': CODEMIRROR_CDN + 'mode/python/python.min.js',
+    'vendor/codemirror/5.65.15/addon/edit/closebrackets.min.js': CODEMIRROR_CDN + 'addon/edit/closebrackets.min.js',
+    'vendor/codemirror/5.65.15/addon/hint/show-hint.min.css': CODEMIRROR_CDN + 'addon/hint/show-hint.min.css',
+    'vendor/codemirror/5.65.15/addon/hint/show-hint.min.js': CODEMIRROR_CDN + 'addon/hint/show-hint.min.js',
+    'vendor/quill/1.3.7/quill.snow.css': QUILL_CDN + 'quill.snow.css',
+    'vendor/quill/1.3.7/quill.min.js': QUILL_CDN + 'quill.min.js',
+}
+
+# Бандлы для страниц: порядок файлов сохраняется
+BUNDLES = {
+    'base.css': [
+        'vendor/bootstrap/5.3.2/bootstrap.min.css',
+        'vendor/bootstrap-icons/1.11.1/bootstrap-icons.css',
+        'css/style.css',
+    ],
+    'base.js': ['vendor/bootstrap/5.3.2/bootstrap.bundle.min.js'],
+    'editor.css': [
+        'vendor/codemirror/5.65.15/codemirror.min.css',
+        'vendor/codemirror/5.65.15/theme/monokai.min.css',
+        'vendor/codemirror/5.65.15/addon/hint/show-hint.min.css',
+    ],
+    'editor.js': [
+        'vendor/codemirror/5.65.15/codemirror.min.js',
+        'vendor/codemirror/5.65.15/mode/python/python.min.js',
+        'vendor/codemirror/5.65.15/addon/edit/closebrackets.min.js',
+        'vendor/codemirror/5.65.15/addon/hint/show-hint.min.js',
+    ],
+    'quill.css': ['vendor/quill/1.3.7/quill.snow.css'],
+    'quill.js': ['vendor/quill/1.3.7/quill.min.js'],
+    'student-task.js': ['js/student-progress.js', 'js/snake.js', 'js/grading.js', 'js/code-runner.js'],
+    'student-quiz.js': ['js/student-progress.js', 'js/snake.js', 'js/quiz-runner.js'],
+}
+
+# Эти файлы должны оставаться по постоянному адресу: воркер и service worker
+# создаются по имени, а заголовки изоляции привязаны к пути воркера
+UNVERSIONED_FILES = {'js/pyodide-worker.js', 'js/sw.js'}
+
+# Сжимаем только текст: шрифты woff/woff2 уже сжаты
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.svg'}
+
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def dist_dir(static_folder):
+    return os.path.join(static_folder, 'dist')
+
+
+def load_manifest(static_folder):
+    """Манифест последней сборки или пустой, если сборки нет."""
+    path = os.path.join(dist_dir(static_folder), 'manifest.json')
+    if not os.path.exists(path):
+        return {'files': {}, 'bundles': {}, 'images': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def download_vendor_files(static_folder):
+    """Скачивает библиотеки с CDN. Уже скачанные файлы пропускаются."""
+    downloaded = []
+    for rel_path, cdn_url in VENDOR_FILES.items():
+        path = os.path.join(static_folder, rel_path)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.part'
+        with urllib.request.urlopen(cdn_url) as response, open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(response, f)
+        os.replace(tmp_path, path)
+        downloaded.append(rel_path)
+    return downloaded
+
+
+def _minify(rel_path, text):
+    # Библиотеки уже минифицированы; свои файлы — если есть минификатор
+    if rel_path.startswith('vendor/'):
+        return text
+    if rel_path.endswith('.css') and rcssmin:
+        return rcssmin.cssmin(text)
+    if rel_path.endswith('.js') and rjsmin:
+        return rjsmin.jsmin(text)
+    return text
+
+
+def _absolute_css_urls(rel_path, text):
+    """Относительные url() в CSS → абсолютные /static/..., чтобы CSS работал из бандла."""
+    base = posixpath.dirname(rel_path)
+
+    def replace(match):
+        url = match.group(2)
+        if url.startswith(('/', 'data:', 'http:', 'https:', '#')):
+            return match.group(0)
+        path, _, query = url.partition('?')
+        target = posixpath.normpath(posixpath.join(base, path))
+        return f'url("/static/{target}{"?" + query if query else ""}")'
+
+    return CSS_URL_RE.sub(replace, text)
+
+
+def _write_fingerprinted(folder, rel_name, data):
+    """Пишет файл с хэшем в имени и сжатые варианты. Возвращает путь относительно dist."""
+    stem, ext = posixpath.splitext(rel_name)
+    name = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+    path = os.path.join(folder, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if ext in COMPRESSIBLE_EXTENSIONS:
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+    return name
+
+
+def _read_source(static_folder, rel_path):
+    with open(os.path.join(static_folder, rel_path), encoding='utf-8') as f:
+        text = f.read()
+    if rel_path.endswith('.css'):
+        text = _absolute_css_urls(rel_path, text)
+    return _minify(rel_path, text)
+
+
+def build_assets(static_folder):
+    """Собирает static/dist и манифест. Возвращает манифест."""
+    missing = [p for p in VENDOR_FILES if not os.path.exists(os.path.join(static_folder, p))]
+    if missing:
+        raise FileNotFoundError(f'Нет локальных копий библиотек: {", ".join(missing)}')
+
+    folder = dist_dir(static_folder)
+    # Собираем во временную папку и подменяем целиком, чтобы сервер не видел полсборки
+    tmp_folder = folder + '.tmp'
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    os.makedirs(tmp_folder)
+    manifest = {'files': {}, 'bundles': {}}
+
+    # Наши файлы по отдельности: url_for('static', ...) отдаёт их версию с хэшем
+    for subdir in ('css', 'js'):
+        for name in sorted(os.listdir(os.path.join(static_folder, subdir))):
+            rel_path = f'{subdir}/{name}'
+            if rel_path in UNVERSIONED_FILES or not name.endswith(('.css', '.js')):
+                continue
+            data = _read_source(static_folder, rel_path).encode('utf-8')
+            manifest['files'][rel_path] = 'dist/' + _write_fingerprinted(tmp_folder, rel_path, data)
+
+    for bundle_name, sources in BUNDLES.items():
+        separator = '\n' if bundle_name.endswith('.css') else ';\n'
+        data = separator.join(_read_source(static_folder, p) for p in sources).encode('utf-8')
+        manifest['bundles'][bundle_name] = 'dist/' + _write_fingerprinted(tmp_folder, bundle_name, data)
+
+    # Картинки змейки: WebP/AVIF и уменьшенные копии (нужен Pillow)
+    manifest['images'] = build_image_variants(
+        static_folder, lambda name, data: _write_fingerprinted(tmp_folder, name, data)
+    )
+
+    with open(os.path.join(tmp_folder, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    old_folder = folder + '.old'
+    shutil.rmtree(old_folder, ignore_errors=True)
+    if os.path.exists(folder):
+        os.replace(folder, old_folder)
+    os.replace(tmp_folder, folder)
+    shutil.rmtree(old_folder, ignore_errors=True)
+    return manifest
+
+
+def fingerprinted_filename(filename):
+    """Имя файла с хэшем из манифеста (для url_for('static', ...))."""
+    return current_app.config['ASSET_MANIFEST']['files'].get(filename, filename)
+
+
+def asset_tags(bundle_name):
+    """Теги <link>/<script> бандла: собранный файл или, без сборки, исходные файлы."""
+    manifest = current_app.config['ASSET_MANIFEST']
+    built = manifest['bundles'].get(bundle_name)
+    if built:
+        urls = [url_for('static', filename=built)]
+    else:
+        urls = []
+        for rel_path in BUNDLES[bundle_name]:
+            local = os.path.join(current_app.static_folder, rel_path)
+            if rel_path in VENDOR_FILES and not os.path.exists(local):
+                urls.append(VENDOR_FILES[rel_path])
+            else:
+                urls.append(url_for('static', filename=rel_path))
+
+    if bundle_name.endswith('.css'):
+        tags = [f'<link href="{escape(url)}" rel="stylesheet">' for url in urls]
+    else:
+        tags = [f'<script src="{escape(url)}"></script>' for url in urls]
+    return Markup('\n'.join(tags))
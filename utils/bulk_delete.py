@@ -0,0 +1,67 @@
+"""Удаление класса, ученика, урока или задания со всеми зависимыми строками.
+
+ORM-каскад (cascade='all, delete-orphan') перед удалением загружает в память
+каждого ученика, каждую запись прогресса, ответ и событие. Для класса в конце
+года это сотни тысяч объектов. Здесь то же самое делается несколькими
+DELETE ... WHERE ... IN (SELECT ...) — от листьев к корню, чтобы не нарушать
+внешние ключи (PRAGMA foreign_keys=ON). Строки в память не загружаются.
+
+Всё выполняется в текущей транзакции; commit делает вызывающий код.
+"""
+from models import (db, SchoolClass, Student, Topic, Lesson, LessonSnapshot, Task, TestCase,
+                    LessonAssignment, StudentProgress, CodeRevision, SubmissionSignature,
+                    SimilarityBucket, PasteSource, QuizElement, QuizOption, QuizAnswer, ActivityEvent)
+from utils.lesson_snapshot import invalidate_lessons
+from utils.topic_tree import bump_tree_versions
+from utils.paste_index import delete_sources as delete_paste_sources
+from utils.search import mark_lessons_changed
+
+
+def _delete(model, condition):
+    db.session.execute(
+        db.delete(model).where(condition).execution_options(synchronize_session=False)
+    )
+
+
+def delete_students(student_ids):
+    """student_ids — список или подзапрос (select) id учеников."""
+    delete_paste_sources(PasteSource.student_id.in_(student_ids))
+    for model in (StudentProgress, CodeRevision, SubmissionSignature, SimilarityBucket, QuizAnswer, ActivityEvent):
+        _delete(model, model.student_id.in_(student_ids))
+    _delete(Student, Student.id.in_(student_ids))
+
+
+def delete_tasks(task_ids):
+    """task_ids — список или подзапрос id заданий. Снимки уроков сбрасывает вызывающий."""
+    delete_paste_sources(PasteSource.task_id.in_(task_ids))
+    element_ids = db.select(QuizElement.id).where(QuizElement.task_id.in_(task_ids))
+    _delete(QuizOption, QuizOption.element_id.in_(element_ids))
+    _delete(QuizAnswer, QuizAnswer.element_id.in_(element_ids))
+    for model in (QuizElement, TestCase, StudentProgress, CodeRevision, SubmissionSignature, SimilarityBucket,
+                  ActivityEvent):
+        _delete(model, model.task_id.in_(task_ids))
+    _delete(Task, Task.id.in_(task_ids))
+
+
+def delete_lessons(lesson_ids, teacher_id):
+    """Удаляет уроки учителя teacher_id вместе с заданиями, назначениями и снимками."""
+    lesson_ids = list(lesson_ids)
+    delete_tasks(db.select(Task.id).where(Task.lesson_id.in_(lesson_ids)))
+    _delete(LessonAssignment, LessonAssignment.lesson_id.in_(lesson_ids))
+    _delete(LessonSnapshot, LessonSnapshot.lesson_id.in_(lesson_ids))
+    _delete(Lesson, Lesson.id.in_(lesson_ids))
+    invalidate_lessons(lesson_ids)
+    mark_lessons_changed(lesson_ids)
+    # Число уроков в папках изменилось
+    bump_tree_versions(db.session, {teacher_id})
+
+
+def delete_class(class_id):
+    delete_students(db.select(Student.id).where(Student.class_id == class_id))
+    _delete(LessonAssignment, LessonAssignment.class_id == class_id)
+    # Папки класса остаются, но без привязки (как ondelete='SET NULL' в модели)
+    db.session.execute(
+        db.update(Topic).where(Topic.class_id == class_id).values(class_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    _delete(SchoolClass, SchoolClass.id == class_id)
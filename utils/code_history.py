@@ -0,0 +1,130 @@
+"""История правок кода ученика.
+
+Каждое автосохранение, изменившее код, добавляет ревизию в code_revisions.
+Каждая KEYFRAME_INTERVAL-я ревизия (и первая) — опорная: ссылка на полный
+текст в code_blobs. Остальные хранят только разницу с предыдущей ревизией
+по строкам: список операций, где положительное число — скопировать столько
+строк, отрицательное — пропустить столько строк, строка — вставить текст.
+Чтобы восстановить ревизию N, берётся ближайшая опорная не позже N и к ней
+применяется не больше KEYFRAME_INTERVAL - 1 разниц.
+
+Запись дешёвая: предыдущий текст уже лежит в прогрессе, номер следующей
+ревизии — в StudentProgress.revision_count, так что это один INSERT
+небольшой сжатой разницы. Хранится не больше MAX_REVISIONS последних
+ревизий: старые удаляются целыми блоками до очередной опорной.
+"""
+import difflib
+import json
+
+from models import db, CodeRevision
+from utils.code_store import store_code, load_code, encode_text, decode_blob
+
+KEYFRAME_INTERVAL = 20
+# Кратно KEYFRAME_INTERVAL: после очистки первой остаётся опорная ревизия
+MAX_REVISIONS = 1000
+
+
+def make_delta(old, new):
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append(''.join(b[j1:j2]))
+    return ops
+
+
+def apply_delta(old, ops):
+    a = old.splitlines(keepends=True)
+    position = 0
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.extend(a[position:position + op])
+            position += op
+        else:
+            position -= op
+    return ''.join(parts)
+
+
+def _is_keyframe(number):
+    return (number - 1) % KEYFRAME_INTERVAL == 0
+
+
+def record_revision(progress, old_code, new_code):
+    """Добавляет ревизию, если код изменился. Вызывать до commit."""
+    if new_code is None or new_code == old_code:
+        return
+    number = (progress.revision_count or 0) + 1
+    revision = CodeRevision(student_id=progress.student_id, task_id=progress.task_id, number=number)
+    # Без предыдущего текста разницу считать не от чего
+    if _is_keyframe(number) or old_code is None:
+        revision.code_hash = store_code(new_code)
+    else:
+        revision.delta, revision.compression = encode_text(
+            json.dumps(make_delta(old_code, new_code), ensure_ascii=False, separators=(',', ':'))
+        )
+    progress.revision_count = number
+    db.session.add(revision)
+
+    if _is_keyframe(number) and number > MAX_REVISIONS:
+        db.session.execute(
+            db.delete(CodeRevision).where(
+                CodeRevision.student_id == progress.student_id,
+                CodeRevision.task_id == progress.task_id,
+                CodeRevision.number < number - MAX_REVISIONS,
+            ).execution_options(synchronize_session=False)
+        )
+
+
+def revision_list(student_id, task_id):
+    """[(номер, время)] всех сохранённых ревизий по порядку."""
+    return db.session.execute(
+        db.select(CodeRevision.number, CodeRevision.created_at).where(
+            CodeRevision.student_id == student_id, CodeRevision.task_id == task_id
+        ).order_by(CodeRevision.number)
+    ).all()
+
+
+def revision_lists(student_ids, task_ids):
+    """{(student_id, task_id): [(номер, время)]} для многих пар одним запросом."""
+    result = {}
+    for student_id, task_id, number, created_at in db.session.execute(
+        db.select(CodeRevision.student_id, CodeRevision.task_id, CodeRevision.number, CodeRevision.created_at).where(
+            CodeRevision.student_id.in_(student_ids), CodeRevision.task_id.in_(task_ids)
+        ).order_by(CodeRevision.number)
+    ):
+        result.setdefault((student_id, task_id), []).append((number, created_at))
+    return result
+
+
+def reconstruct(student_id, task_id, number):
+    """Текст ревизии number или None, если её нет (или она уже удалена)."""
+    pair = (CodeRevision.student_id == student_id, CodeRevision.task_id == task_id)
+    keyframe = db.session.execute(
+        db.select(CodeRevision.number, CodeRevision.code_hash).where(
+            *pair, CodeRevision.number <= number, CodeRevision.code_hash.isnot(None)
+        ).order_by(CodeRevision.number.desc()).limit(1)
+    ).first()
+    if keyframe is None:
+        return None
+
+    deltas = db.session.execute(
+        db.select(CodeRevision.number, CodeRevision.delta, CodeRevision.compression).where(
+            *pair, CodeRevision.number > keyframe.number, CodeRevision.number <= number
+        ).order_by(CodeRevision.number)
+    ).all()
+    if keyframe.number + len(deltas) != number:
+        return None
+
+    text = load_code(keyframe.code_hash)
+    for row in deltas:
+        text = apply_delta(text, json.loads(decode_blob(row.delta, row.compression)))
+    return text
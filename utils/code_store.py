@@ -0,0 +1,100 @@
+"""Хранилище кода учеников без повторов.
+
+Каждый различный текст программы хранится один раз в code_blobs под своим
+sha256; StudentProgress ссылается на него через code_hash. Нетронутый
+шаблон задания или одинаковые короткие решения у всего класса занимают одну
+строку. Тексты длиннее COMPRESS_THRESHOLD байт сжимаются: zstd, если
+установлен zstandard, иначе zlib. Способ сжатия записан в самой строке,
+так что старые записи читаются после смены библиотеки.
+
+Записи, на которые больше никто не ссылается (ни прогресс, ни история правок
+из utils/code_history.py), удаляет `flask purge-code-blobs`.
+"""
+import hashlib
+import zlib
+
+from sqlalchemy.dialects.sqlite import insert
+
+from models import db, CodeBlob, CodeRevision, StudentProgress
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Короткий код не сжимаем: выигрыш меньше накладных расходов
+COMPRESS_THRESHOLD = 256
+
+
+def code_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _compress(raw):
+    """(данные, способ сжатия) для байтов."""
+    if len(raw) < COMPRESS_THRESHOLD:
+        return raw, 'none'
+    if zstandard:
+        return zstandard.ZstdCompressor(level=10).compress(raw), 'zstd'
+    return zlib.compress(raw, 9), 'zlib'
+
+
+def encode_text(text):
+    """Текст → (данные, способ сжатия) для хранения; обратно — decode_blob."""
+    return _compress(text.encode('utf-8'))
+
+
+def decode_blob(data, compression):
+    if compression == 'zstd':
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    elif compression == 'zlib':
+        raw = zlib.decompress(data)
+    else:
+        raw = data
+    return raw.decode('utf-8')
+
+
+def store_code(text):
+    """Сохраняет текст (если такого ещё нет) и возвращает его хэш. None → None."""
+    if text is None:
+        return None
+    digest = code_hash(text)
+    raw = text.encode('utf-8')
+    data, compression = _compress(raw)
+    db.session.execute(
+        insert(CodeBlob).values(hash=digest, data=data, compression=compression, size=len(raw))
+        .on_conflict_do_nothing(index_elements=['hash'])
+    )
+    return digest
+
+
+def load_code(digest):
+    """Текст по хэшу или None."""
+    if digest is None:
+        return None
+    row = db.session.execute(
+        db.select(CodeBlob.data, CodeBlob.compression).where(CodeBlob.hash == digest)
+    ).first()
+    return decode_blob(row.data, row.compression) if row else None
+
+
+def load_codes(digests):
+    """{хэш: текст} для многих записей одним запросом."""
+    digests = {d for d in digests if d is not None}
+    if not digests:
+        return {}
+    rows = db.session.execute(
+        db.select(CodeBlob.hash, CodeBlob.data, CodeBlob.compression).where(CodeBlob.hash.in_(digests))
+    )
+    return {row.hash: decode_blob(row.data, row.compression) for row in rows}
+
+
+def purge_unused_blobs():
+    """Удаляет тексты, на которые не ссылаются ни прогресс, ни история правок. Возвращает их число."""
+    used = db.select(StudentProgress.code_hash).where(StudentProgress.code_hash.isnot(None))
+    used_by_history = db.select(CodeRevision.code_hash).where(CodeRevision.code_hash.isnot(None))
+    result = db.session.execute(
+        db.delete(CodeBlob).where(CodeBlob.hash.not_in(used), CodeBlob.hash.not_in(used_by_history))
+    )
+    db.session.commit()
+    return result.rowcount
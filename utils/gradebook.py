@@ -0,0 +1,327 @@
+"""Сводная ведомость класса по всем назначенным урокам.
+
+Журнал строит таблицу урока запросом на каждую клетку (ученик × задание).
+Здесь вся ведомость считается несколькими запросами с GROUP BY: число
+заданий и вопросов в уроках, выполненные задания и ответы на вопросы
+каждого ученика по каждому уроку. Получаются матрицы ученик × урок; итоги
+по ученикам и средние по урокам считаются по всему классу — через NumPy,
+если он установлен, иначе обычными циклами. Клетки отдаются страницами
+(STUDENTS_PER_PAGE × LESSONS_PER_PAGE) вместе с итогами своих учеников и
+уроков.
+
+Для выгрузки (journal_export, gradebook_export) те же счётчики читаются
+курсором, упорядоченным по ученикам: строки таблицы отдаются по одному
+ученику, не собирая весь класс в памяти (см. utils/table_export.py).
+"""
+from itertools import groupby
+
+from sqlalchemy import case, func
+
+from models import db, Student, Lesson, Task, LessonAssignment, StudentProgress, QuizElement, QuizAnswer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+STUDENTS_PER_PAGE = 50
+LESSONS_PER_PAGE = 20
+# Сколько строк курсор выбирает за раз при выгрузке
+EXPORT_BATCH = 500
+
+
+def _count_if(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+def _page(items, page, per_page):
+    pages = max((len(items) + per_page - 1) // per_page, 1)
+    page = min(max(page, 1), pages)
+    return items[(page - 1) * per_page:page * per_page], {'page': page, 'pages': pages, 'total': len(items)}
+
+
+def _aggregate(class_id, lesson_ids):
+    """Сгруппированные счётчики {имя: {(student_id, lesson_id): n}}, число заданий и вопросов уроков."""
+    students = db.select(Student.id).where(Student.class_id == class_id)
+
+    tasks = dict(db.session.query(Task.lesson_id, func.count(Task.id))
+                 .filter(Task.lesson_id.in_(lesson_ids)).group_by(Task.lesson_id))
+    questions = dict(db.session.query(Task.lesson_id, func.count(QuizElement.id))
+                     .join(QuizElement, QuizElement.task_id == Task.id)
+                     .filter(Task.lesson_id.in_(lesson_ids), QuizElement.element_type != 'text')
+                     .group_by(Task.lesson_id))
+
+    done, errors = {}, {}
+    for student_id, lesson_id, n_done, n_errors in db.session.query(
+        StudentProgress.student_id, Task.lesson_id,
+        _count_if(StudentProgress.is_completed == True),
+        _count_if(db.and_(StudentProgress.is_completed == True, StudentProgress.has_errors == True)),
+    ).join(Task, Task.id == StudentProgress.task_id).filter(
+        Task.lesson_id.in_(lesson_ids), StudentProgress.student_id.in_(students)
+    ).group_by(StudentProgress.student_id, Task.lesson_id):
+        done[(student_id, lesson_id)] = n_done or 0
+        errors[(student_id, lesson_id)] = n_errors or 0
+
+    quiz_clean, quiz_errors = {}, {}
+    for student_id, lesson_id, n_clean, n_errors in db.session.query(
+        QuizAnswer.student_id, Task.lesson_id,
+        _count_if(db.and_(QuizAnswer.is_correct == True, QuizAnswer.had_errors == False)),
+        _count_if(db.and_(QuizAnswer.is_correct == True, QuizAnswer.had_errors == True)),
+    ).join(QuizElement, QuizElement.id == QuizAnswer.element_id).join(Task, Task.id == QuizElement.task_id).filter(
+        Task.lesson_id.in_(lesson_ids), QuizAnswer.student_id.in_(students), QuizElement.element_type != 'text'
+    ).group_by(QuizAnswer.student_id, Task.lesson_id):
+        quiz_clean[(student_id, lesson_id)] = n_clean or 0
+        quiz_errors[(student_id, lesson_id)] = n_errors or 0
+
+    cells = {'done': done, 'errors': errors, 'quiz_clean': quiz_clean, 'quiz_errors': quiz_errors}
+    return cells, tasks, questions
+
+
+def _ratio(part, whole):
+    return round(part / whole, 3) if whole else None
+
+
+def _rollups_numpy(cells, tasks, questions, student_ids, lesson_ids):
+    s_index = {student_id: i for i, student_id in enumerate(student_ids)}
+    l_index = {lesson_id: j for j, lesson_id in enumerate(lesson_ids)}
+    matrices = {}
+    for name, values in cells.items():
+        matrix = numpy.zeros((len(student_ids), len(lesson_ids)), dtype=numpy.int64)
+        if values:
+            keys = list(values)
+            rows = numpy.fromiter((s_index[s] for s, _ in keys), dtype=numpy.intp, count=len(keys))
+            cols = numpy.fromiter((l_index[l] for _, l in keys), dtype=numpy.intp, count=len(keys))
+            matrix[rows, cols] = numpy.fromiter(values.values(), dtype=numpy.int64, count=len(keys))
+        matrices[name] = matrix
+    task_counts = numpy.array([tasks.get(l, 0) for l in lesson_ids], dtype=numpy.int64)
+    question_counts = numpy.array([questions.get(l, 0) for l in lesson_ids], dtype=numpy.int64)
+    correct = matrices['quiz_clean'] + matrices['quiz_errors']
+
+    total_tasks = int(task_counts.sum())
+    total_questions = int(question_counts.sum())
+    student_done = matrices['done'].sum(axis=1)
+    student_errors = matrices['errors'].sum(axis=1)
+    student_correct = correct.sum(axis=1)
+    by_student = {
+        student_id: {
+            'done': int(student_done[i]),
+            'errors': int(student_errors[i]),
+            'tasks': total_tasks,
+            'completion': _ratio(int(student_done[i]), total_tasks),
+            'quiz_score': _ratio(int(student_correct[i]), total_questions),
+        }
+        for student_id, i in s_index.items()
+    }
+
+    # Средняя по классу доля выполненного: сумма по столбцу / (ученики × задания урока)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        completion = matrices['done'].sum(axis=0) / (task_counts * len(student_ids))
+        quiz_score = correct.sum(axis=0) / (question_counts * len(student_ids))
+    by_lesson = {
+        lesson_id: {
+            'tasks': int(task_counts[j]),
+            'questions': int(question_counts[j]),
+            'completion': round(float(completion[j]), 3) if task_counts[j] and student_ids else None,
+            'quiz_score': round(float(quiz_score[j]), 3) if question_counts[j] and student_ids else None,
+        }
+        for lesson_id, j in l_index.items()
+    }
+    return by_student, by_lesson
+
+
+def _rollups_python(cells, tasks, questions, student_ids, lesson_ids):
+    total_tasks = sum(tasks.get(l, 0) for l in lesson_ids)
+    total_questions = sum(questions.get(l, 0) for l in lesson_ids)
+    by_student = {
+        student_id: {'done': 0, 'errors': 0, 'correct': 0} for student_id in student_ids
+    }
+    by_lesson = {lesson_id: {'done': 0, 'correct': 0} for lesson_id in lesson_ids}
+    for (student_id, lesson_id), n in cells['done'].items():
+        by_student[student_id]['done'] += n
+        by_lesson[lesson_id]['done'] += n
+    for (student_id, _), n in cells['errors'].items():
+        by_student[student_id]['errors'] += n
+    for name in ('quiz_clean', 'quiz_errors'):
+        for (student_id, lesson_id), n in cells[name].items():
+            by_student[student_id]['correct'] += n
+            by_lesson[lesson_id]['correct'] += n
+
+    for totals in by_student.values():
+        correct = totals.pop('correct')
+        totals.update(tasks=total_tasks, completion=_ratio(totals['done'], total_tasks),
+                      quiz_score=_ratio(correct, total_questions))
+    for lesson_id, totals in by_lesson.items():
+        n_tasks = tasks.get(lesson_id, 0)
+        n_questions = questions.get(lesson_id, 0)
+        by_lesson[lesson_id] = {
+            'tasks': n_tasks,
+            'questions': n_questions,
+            'completion': _ratio(totals['done'], n_tasks * len(student_ids)),
+            'quiz_score': _ratio(totals['correct'], n_questions * len(student_ids)),
+        }
+    return by_student, by_lesson
+
+
+def _assigned_lessons(class_id):
+    return db.session.query(Lesson.id, Lesson.title) \
+        .join(LessonAssignment, LessonAssignment.lesson_id == Lesson.id) \
+        .filter(LessonAssignment.class_id == class_id) \
+        .order_by(LessonAssignment.assigned_at, Lesson.id).all()
+
+
+def gradebook(school_class, student_page=1, lesson_page=1):
+    """Страница ведомости класса.
+
+    {'students': [{'id', 'name', 'totals'}], 'lessons': [{'id', 'title', 'totals'}],
+     'cells': {student_id: {lesson_id: {'done', 'errors', 'tasks', 'quiz_clean', 'quiz_errors', 'questions'}}},
+     'student_pages': {...}, 'lesson_pages': {...}}
+    """
+    all_students = db.session.query(Student.id, Student.name) \
+        .filter(Student.class_id == school_class.id).order_by(Student.name, Student.id).all()
+    all_lessons = _assigned_lessons(school_class.id)
+    student_ids = [row.id for row in all_students]
+    lesson_ids = [row.id for row in all_lessons]
+
+    cells, tasks, questions = _aggregate(school_class.id, lesson_ids) if student_ids and lesson_ids else ({
+        'done': {}, 'errors': {}, 'quiz_clean': {}, 'quiz_errors': {}
+    }, {}, {})
+    rollups = _rollups_numpy if numpy is not None else _rollups_python
+    by_student, by_lesson = rollups(cells, tasks, questions, student_ids, lesson_ids)
+
+    students, student_pages = _page(all_students, student_page, STUDENTS_PER_PAGE)
+    lessons, lesson_pages = _page(all_lessons, lesson_page, LESSONS_PER_PAGE)
+    return {
+        'students': [{'id': s.id, 'name': s.name, 'totals': by_student[s.id]} for s in students],
+        'lessons': [{'id': l.id, 'title': l.title, 'totals': by_lesson[l.id]} for l in lessons],
+        'cells': {
+            s.id: {
+                l.id: {
+                    'done': cells['done'].get((s.id, l.id), 0),
+                    'errors': cells['errors'].get((s.id, l.id), 0),
+                    'tasks': tasks.get(l.id, 0),
+                    'quiz_clean': cells['quiz_clean'].get((s.id, l.id), 0),
+                    'quiz_errors': cells['quiz_errors'].get((s.id, l.id), 0),
+                    'questions': questions.get(l.id, 0),
+                }
+                for l in lessons
+            }
+            for s in students
+        },
+        'student_pages': student_pages,
+        'lesson_pages': lesson_pages,
+    }
+
+
+# ==================== Выгрузка ====================
+
+def _by_student(query, class_id):
+    """Строки запроса (первый столбец — Student.id) по ученикам класса, в порядке имён.
+
+    Запрос строится от Student через outer join, поэтому у каждого ученика есть
+    хотя бы одна строка — группы разных запросов идут парами.
+    """
+    query = query.filter(Student.class_id == class_id).order_by(Student.name, Student.id)
+    for _, rows in groupby(query.yield_per(EXPORT_BATCH), key=lambda row: row[0]):
+        yield list(rows)
+
+
+def journal_export(school_class, lesson):
+    """(заголовок, строки) журнала урока для utils.table_export."""
+    tasks = lesson.tasks
+    quiz_task_ids = [task.id for task in tasks if task.task_type == 'quiz']
+    questions = dict(db.session.query(QuizElement.task_id, func.count(QuizElement.id)).filter(
+        QuizElement.task_id.in_(quiz_task_ids), QuizElement.element_type != 'text'
+    ).group_by(QuizElement.task_id))
+    header = ['Ученик', *(task.title for task in tasks), 'Выполнено']
+
+    progress = db.session.query(
+        Student.id, Student.name, StudentProgress.task_id, StudentProgress.is_completed, StudentProgress.has_errors
+    ).select_from(Student).outerjoin(StudentProgress, db.and_(
+        StudentProgress.student_id == Student.id, StudentProgress.task_id.in_([task.id for task in tasks])
+    ))
+    answers = db.session.query(
+        Student.id, QuizElement.task_id,
+        _count_if(QuizAnswer.had_errors == False), _count_if(QuizAnswer.had_errors == True),
+    ).select_from(Student).outerjoin(QuizAnswer, db.and_(
+        QuizAnswer.student_id == Student.id, QuizAnswer.is_correct == True
+    )).outerjoin(QuizElement, db.and_(
+        QuizElement.id == QuizAnswer.element_id, QuizElement.task_id.in_(quiz_task_ids),
+        QuizElement.element_type != 'text'
+    )).group_by(Student.id, QuizElement.task_id)
+
+    def rows():
+        for progress_rows, answer_rows in zip(_by_student(progress, school_class.id),
+                                              _by_student(answers, school_class.id)):
+            status = {row.task_id: row for row in progress_rows if row.task_id}
+            correct = {task_id: (clean, errors) for _, task_id, clean, errors in answer_rows if task_id}
+            cells = []
+            for task in tasks:
+                if task.task_type == 'quiz' and questions.get(task.id):
+                    clean, errors = correct.get(task.id, (0, 0))
+                    cells.append(f'{clean + errors} из {questions[task.id]}' + (f' ({errors} с ош.)' if errors else ''))
+                elif task.id in status and status[task.id].is_completed:
+                    cells.append('с ошибками' if status[task.id].has_errors else 'выполнено')
+                else:
+                    cells.append('')
+            done = sum(1 for row in status.values() if row.is_completed)
+            yield [progress_rows[0].name, *cells, done]
+
+    return header, rows()
+
+
+def gradebook_export(school_class):
+    """(заголовок, строки) сводной ведомости: выполненные задания по урокам, итоги, средние."""
+    lessons = _assigned_lessons(school_class.id)
+    lesson_ids = [lesson.id for lesson in lessons]
+    tasks = dict(db.session.query(Task.lesson_id, func.count(Task.id))
+                 .filter(Task.lesson_id.in_(lesson_ids)).group_by(Task.lesson_id))
+    questions = dict(db.session.query(Task.lesson_id, func.count(QuizElement.id))
+                     .join(QuizElement, QuizElement.task_id == Task.id)
+                     .filter(Task.lesson_id.in_(lesson_ids), QuizElement.element_type != 'text')
+                     .group_by(Task.lesson_id))
+    total_tasks = sum(tasks.values())
+    total_questions = sum(questions.values())
+    header = ['Ученик', *(f'{lesson.title} ({tasks.get(lesson.id, 0)} зад.)' for lesson in lessons),
+              'Выполнено, %', 'Тесты, %']
+
+    progress = db.session.query(
+        Student.id, Student.name, Task.lesson_id, func.count(Task.id),
+    ).select_from(Student).outerjoin(StudentProgress, db.and_(
+        StudentProgress.student_id == Student.id, StudentProgress.is_completed == True
+    )).outerjoin(Task, db.and_(
+        Task.id == StudentProgress.task_id, Task.lesson_id.in_(lesson_ids)
+    )).group_by(Student.id, Task.lesson_id)
+    answers = db.session.query(
+        Student.id, func.count(Task.id),
+    ).select_from(Student).outerjoin(QuizAnswer, db.and_(
+        QuizAnswer.student_id == Student.id, QuizAnswer.is_correct == True
+    )).outerjoin(QuizElement, db.and_(
+        QuizElement.id == QuizAnswer.element_id, QuizElement.element_type != 'text'
+    )).outerjoin(Task, db.and_(
+        Task.id == QuizElement.task_id, Task.lesson_id.in_(lesson_ids)
+    )).group_by(Student.id)
+
+    def percent(part, whole):
+        return round(100 * part / whole) if whole else None
+
+    def rows():
+        column_sums = [0] * len(lessons)
+        sum_completion = sum_quiz = students = 0
+        for progress_rows, answer_rows in zip(_by_student(progress, school_class.id),
+                                              _by_student(answers, school_class.id)):
+            done = {lesson_id: n for _, _, lesson_id, n in progress_rows if lesson_id}
+            cells = [done.get(lesson_id, 0) for lesson_id in lesson_ids]
+            completion = percent(sum(cells), total_tasks)
+            quiz = percent(answer_rows[0][1], total_questions)
+            for i, n in enumerate(cells):
+                column_sums[i] += n
+            sum_completion += completion or 0
+            sum_quiz += quiz or 0
+            students += 1
+            yield [progress_rows[0].name, *cells, completion, quiz]
+        if students:
+            yield ['Среднее по классу', *(round(n / students, 1) for n in column_sums),
+                   round(sum_completion / students) if total_tasks else None,
+                   round(sum_quiz / students) if total_questions else None]
+
+    return header, rows()
@@ -0,0 +1,105 @@
+"""Обработка HTML из редактора Quill: очистка перед показом ученикам и извлечение текста."""
+from html import escape
+from html.parser import HTMLParser
+
+# Теги и атрибуты, которые создаёт Quill
+ALLOWED_TAGS = {
+    'p', 'br', 'div', 'span', 'strong', 'b', 'em', 'i', 'u', 's', 'sub', 'sup',
+    'code', 'pre', 'blockquote', 'h1', 'h2', 'h3', 'h4', 'ol', 'ul', 'li', 'a', 'img',
+}
+ALLOWED_ATTRS = {'class', 'style', 'href', 'src', 'alt', 'target', 'rel', 'spellcheck'}
+VOID_TAGS = {'br', 'img'}
+# Содержимое этих тегов выбрасывается целиком
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+# После этих тегов в тексте ставится разрыв
+BLOCK_TAGS = {'p', 'br', 'div', 'pre', 'blockquote', 'h1', 'h2', 'h3', 'h4', 'li'}
+
+
+def _safe_attr(name, value):
+    if name not in ALLOWED_ATTRS or value is None:
+        return False
+    lowered = ''.join(value.split()).lower()
+    if name in ('href', 'src') and lowered.startswith(('javascript:', 'vbscript:', 'data:text')):
+        return False
+    if name == 'style' and ('expression(' in lowered or 'url(' in lowered):
+        return False
+    return True
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.drop_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.drop_depth += 1
+            return
+        if self.drop_depth or tag not in ALLOWED_TAGS:
+            return
+        attrs_html = ''.join(
+            f' {name}="{escape(value, quote=True)}"' for name, value in attrs if _safe_attr(name, value)
+        )
+        self.parts.append(f'<{tag}{attrs_html}>')
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.drop_depth = max(0, self.drop_depth - 1)
+            return
+        if self.drop_depth or tag not in ALLOWED_TAGS or tag in VOID_TAGS:
+            return
+        self.parts.append(f'</{tag}>')
+
+    def handle_data(self, data):
+        if not self.drop_depth:
+            self.parts.append(escape(data, quote=False))
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.drop_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.drop_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.drop_depth = max(0, self.drop_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self.drop_depth:
+            self.parts.append(data)
+
+
+def sanitize_html(html):
+    """Оставляет только разметку Quill: без скриптов, обработчиков событий и javascript: ссылок."""
+    if not html:
+        return ''
+    parser = _Sanitizer()
+    parser.feed(html)
+    parser.close()
+    return ''.join(parser.parts)
+
+
+def html_to_text(html):
+    """Текст без разметки (для поиска и сравнения)."""
+    if not html:
+        return ''
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    lines = (' '.join(line.split()) for line in ''.join(parser.parts).split('\n'))
+    return '\n'.join(line for line in lines if line)
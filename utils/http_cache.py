@@ -0,0 +1,74 @@
+"""Условные ответы (ETag / 304) для страниц, содержимое которых редко меняется.
+
+Браузер хранит страницу у себя (Cache-Control: private) и при каждом
+переходе переспрашивает сервер с If-None-Match. Если версия содержимого
+не изменилась, сервер отвечает 304 без рендеринга шаблона.
+"""
+import hashlib
+import json
+import os
+
+from flask import current_app, request, session, make_response, jsonify
+
+_templates_fingerprint = None
+
+
+def templates_fingerprint():
+    """Отпечаток шаблонов и собранной статики: после выкладки новой вёрстки
+    или пересборки (ссылки на файлы с хэшем меняются) старые ETag перестают совпадать."""
+    global _templates_fingerprint
+    if _templates_fingerprint is None:
+        digest = hashlib.sha256()
+        manifest = current_app.config.get('ASSET_MANIFEST', {})
+        digest.update(json.dumps(manifest, sort_keys=True).encode())
+        for root, _, files in sorted(os.walk(current_app.template_folder)):
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                digest.update(f'{name}:{stat.st_size}:{int(stat.st_mtime)};'.encode())
+        _templates_fingerprint = digest.hexdigest()[:16]
+    return _templates_fingerprint
+
+
+def content_etag(*parts):
+    raw = '|'.join(str(part) for part in (templates_fingerprint(), *parts))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def conditional_page(etag, render):
+    """Ответ 304, если у браузера уже есть эта версия, иначе render().
+
+    Пока в сессии есть непоказанные flash-сообщения, страница рендерится
+    заново: иначе сообщение не попадёт на экран.
+    """
+    if session.get('_flashes'):
+        response = make_response(render())
+        response.headers['Cache-Control'] = 'private, no-store'
+        return response
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    # Хранить только в браузере и каждый раз сверять версию
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def private_json(data):
+    """JSON с данными ученика: тоже сверяется по ETag, но только в браузере."""
+    response = jsonify(data)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def conditional_json(etag, build):
+    """JSON по известной заранее версии: при совпадении ETag build() не вызывается."""
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
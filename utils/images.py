@@ -0,0 +1,109 @@
+"""Сжатые варианты картинок змейки-маскота.
+
+При `flask build-assets` (Pillow есть в requirements.txt) из исходных PNG
+делаются уменьшенные копии в WebP, AVIF (если Pillow умеет его писать) и PNG. Они
+попадают в static/dist под именами с хэшем, а в манифест — список вариантов
+с шириной для srcset. Без Pillow или без сборки используются исходные PNG.
+"""
+import io
+import os
+import posixpath
+
+from flask import current_app, url_for
+from markupsafe import Markup, escape
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+SNAKE_MOODS = ('happy', 'stressed', 'thinking', 'study')
+IMAGE_FILES = [f'imgs/snakes/{mood}.png' for mood in SNAKE_MOODS]
+
+# Змейка показывается шириной 150px (анимация) и 200px (главная ученика); x2 для плотных экранов
+IMAGE_WIDTHS = (150, 200, 300, 400)
+
+SAVE_OPTIONS = {
+    'avif': {'quality': 60},
+    'webp': {'quality': 80, 'method': 6},
+    'png': {'optimize': True},
+}
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'png': 'image/png'}
+
+
+def _output_formats():
+    formats = ['webp', 'png']
+    try:
+        # Плагин AVIF для версий Pillow без встроенной поддержки
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+    Image.init()
+    if 'AVIF' in Image.SAVE:
+        formats.insert(0, 'avif')
+    return formats
+
+
+def build_image_variants(static_folder, write):
+    """Пишет варианты картинок через write(имя, данные) и возвращает раздел манифеста."""
+    if Image is None:
+        return {}
+    formats = _output_formats()
+    images = {}
+    for rel_path in IMAGE_FILES:
+        stem = posixpath.splitext(rel_path)[0]
+        with Image.open(os.path.join(static_folder, rel_path)) as source:
+            source.load()
+            widths = sorted({min(width, source.width) for width in IMAGE_WIDTHS})
+            entry = {'width': source.width, 'height': source.height}
+            for fmt in formats:
+                variants = []
+                for width in widths:
+                    height = round(source.height * width / source.width)
+                    resized = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+                    buffer = io.BytesIO()
+                    resized.save(buffer, format=fmt.upper(), **SAVE_OPTIONS[fmt])
+                    variants.append(['dist/' + write(f'{stem}-{width}.{fmt}', buffer.getvalue()), width])
+                entry[fmt] = variants
+        images[rel_path] = entry
+    return images
+
+
+def _srcset(variants):
+    return ', '.join(f"{url_for('static', filename=path)} {width}w" for path, width in variants)
+
+
+def image_set(rel_path):
+    """Данные для <picture>: src/srcset запасного PNG и <source> для WebP/AVIF."""
+    entry = current_app.config['ASSET_MANIFEST'].get('images', {}).get(rel_path)
+    if not entry:
+        return {'src': url_for('static', filename=rel_path), 'srcset': '', 'sources': []}
+    return {
+        'src': url_for('static', filename=entry['png'][0][0]),
+        'srcset': _srcset(entry['png']),
+        'sources': [
+            {'type': MIME_TYPES[fmt], 'srcset': _srcset(entry[fmt])}
+            for fmt in ('avif', 'webp') if fmt in entry
+        ],
+    }
+
+
+def snake_images():
+    """Картинки всех настроений змейки для showSnake() в snake.js."""
+    return {mood: image_set(f'imgs/snakes/{mood}.png') for mood in SNAKE_MOODS}
+
+
+def picture_tag(rel_path, alt, sizes, **attrs):
+    """<picture> с WebP/AVIF и уменьшенными копиями. attrs — атрибуты <img> (class_ → class)."""
+    images = image_set(rel_path)
+    img_attrs = {'src': images['src'], 'alt': alt}
+    if images['srcset']:
+        img_attrs.update(srcset=images['srcset'], sizes=sizes)
+    img_attrs.update({name.rstrip('_'): value for name, value in attrs.items()})
+
+    parts = ['<picture>']
+    for source in images['sources']:
+        parts.append(f'<source type="{source["type"]}" srcset="{escape(source["srcset"])}" sizes="{escape(sizes)}">')
+    parts.append('<img ' + ' '.join(f'{name}="{escape(value)}"' for name, value in img_attrs.items()) + '>')
+    parts.append('</picture>')
+    return Markup(''.join(parts))
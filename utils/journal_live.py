@@ -0,0 +1,173 @@
+"""Живое обновление журнала: изменения клеток через server-sent events.
+
+Когда ученик выполняет задание, отвечает на вопрос квиза или у него
+записывается событие активности, publish_cell() в той же транзакции
+добавляет в journal_events готовую клетку: её HTML (тот же макрос, что и
+в журнале) и состояние для счётчиков. Открытый журнал держит поток
+/teacher/journal/stream и получает только новые строки этой таблицы для
+своего класса и заданий урока.
+
+Таблица в общей базе заменяет брокер сообщений: её видят все процессы
+gunicorn на сервере, а номер строки служит id события — после переподключения
+EventSource присылает Last-Event-ID, и пропущенные изменения досылаются.
+Поток опрашивает таблицу раз в POLL_INTERVAL секунд по индексу (class_id, id)
+и между опросами не держит соединение с базой.
+
+Каждый открытый поток занимает поток gunicorn на STREAM_LIFETIME секунд,
+поэтому одновременно в процессе открыто не больше MAX_STREAMS потоков —
+остальные нужны запросам учеников. Сверх этого журнал получает 204 и
+переходит на опрос changes_since() раз в несколько секунд.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import get_template_attribute
+
+from models import db, StudentProgress, QuizAnswer, JournalEvent
+
+POLL_INTERVAL = 1.0
+# Комментарий-пинг, чтобы прокси не закрывали молчащее соединение
+HEARTBEAT_INTERVAL = 15
+# Поток завершается сам, браузер переподключается (и освобождается поток сервера)
+STREAM_LIFETIME = 300
+RETRY_MS = 3000
+# Потоков журнала на процесс (из --threads в Procfile)
+MAX_STREAMS = 4
+# Сколько хранить события; чистка — при каждой PRUNE_EVERY-й записи
+EVENT_TTL = timedelta(hours=2)
+PRUNE_EVERY = 200
+
+
+def cell_entry(progress):
+    """Клетка журнала по записи прогресса (или None, если ученик не начинал)."""
+    completed = progress.is_completed if progress else False
+    has_errors = progress.has_errors if progress else False
+    return {
+        'completed': completed,
+        'has_errors': has_errors,
+        'paste_count': progress.paste_count if progress else 0,
+        'has_pastes': progress.has_pastes if progress else False,
+        'has_copies': progress.has_copies if progress else False,
+        'has_leaves': progress.has_leaves if progress else False,
+        # Для счётчиков под таблицей
+        'state': ('errors' if has_errors else 'completed') if completed else 'not_done',
+    }
+
+
+def quiz_entry(total, answers):
+    """Сводка ответов ученика на total вопросов квиза."""
+    correct = [a for a in answers if a.is_correct]
+    clean = sum(1 for a in correct if not a.had_errors)
+    return {
+        'total': total,
+        'clean': clean,
+        'errors': len(correct) - clean,
+        'pending': total - len(correct),
+    }
+
+
+def publish_cell(student, task):
+    """Записывает новое состояние клетки (ученик, задание). Вызывать до commit."""
+    db.session.flush()
+    progress = StudentProgress.query.filter_by(student_id=student.id, task_id=task.id).first()
+    entry = cell_entry(progress)
+    if task.task_type == 'quiz':
+        question_ids = [e.id for e in task.quiz_elements if e.element_type != 'text']
+        if question_ids:
+            answers = QuizAnswer.query.filter(
+                QuizAnswer.student_id == student.id, QuizAnswer.element_id.in_(question_ids)
+            ).all()
+            entry['quiz'] = quiz_entry(len(question_ids), answers)
+
+    render_cell = get_template_attribute('teacher/_journal_cell.html', 'journal_cell')
+    event = JournalEvent(
+        class_id=student.class_id,
+        student_id=student.id,
+        task_id=task.id,
+        payload=json.dumps({
+            'student_id': student.id,
+            'task_id': task.id,
+            'state': entry['state'],
+            'code_cell': task.task_type != 'quiz' and entry['completed'],
+            'html': str(render_cell(entry)),
+        }, ensure_ascii=False),
+    )
+    db.session.add(event)
+    db.session.flush()
+    if event.id % PRUNE_EVERY == 0:
+        db.session.execute(db.delete(JournalEvent).where(JournalEvent.created_at < datetime.utcnow() - EVENT_TTL))
+
+
+def last_event_id():
+    """Id последнего события: с него журнал подписывается после отрисовки."""
+    return db.session.query(db.func.max(JournalEvent.id)).scalar() or 0
+
+
+def _new_events(class_id, task_ids, after_id):
+    return db.session.query(JournalEvent.id, JournalEvent.payload).filter(
+        JournalEvent.class_id == class_id,
+        JournalEvent.id > after_id,
+        JournalEvent.task_id.in_(task_ids),
+    ).order_by(JournalEvent.id).all()
+
+
+_streams_lock = threading.Lock()
+# Открытые потоки: метка → время открытия. Поток живёт не дольше STREAM_LIFETIME,
+# поэтому метку, которую по какой-то причине не освободили, убирает следующий вызов
+_open_streams = {}
+
+
+def _take_stream_slot():
+    now = time.monotonic()
+    with _streams_lock:
+        for slot, opened in list(_open_streams.items()):
+            if now - opened > STREAM_LIFETIME + HEARTBEAT_INTERVAL:
+                del _open_streams[slot]
+        if len(_open_streams) >= MAX_STREAMS:
+            return None
+        slot = object()
+        _open_streams[slot] = now
+        return slot
+
+
+def _release_stream_slot(slot):
+    with _streams_lock:
+        _open_streams.pop(slot, None)
+
+
+def open_stream(class_id, task_ids, after_id):
+    """Генератор потока событий или None, если в процессе уже MAX_STREAMS потоков."""
+    slot = _take_stream_slot()
+    if slot is None:
+        return None
+    return event_stream(class_id, task_ids, after_id, slot)
+
+
+def changes_since(class_id, task_ids, after_id):
+    """Изменения клеток после события after_id — для журнала, которому не хватило потока."""
+    return [dict(json.loads(payload), id=event_id)
+            for event_id, payload in _new_events(class_id, task_ids, after_id)]
+
+
+def event_stream(class_id, task_ids, after_id, slot):
+    """Генератор text/event-stream с изменениями клеток после события after_id."""
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        started = last_sent = time.monotonic()
+        while time.monotonic() - started < STREAM_LIFETIME:
+            events = _new_events(class_id, task_ids, after_id)
+            # Закрываем транзакцию: иначе следующий опрос увидит тот же снимок базы,
+            # а соединение вернётся в пул на время сна
+            db.session.close()
+            for event_id, payload in events:
+                yield f'id: {event_id}\ndata: {payload}\n\n'
+                after_id = event_id
+                last_sent = time.monotonic()
+            if time.monotonic() - last_sent >= HEARTBEAT_INTERVAL:
+                yield ': ping\n\n'
+                last_sent = time.monotonic()
+            time.sleep(POLL_INTERVAL)
+    finally:
+        _release_stream_slot(slot)
@@ -0,0 +1,180 @@
+"""Опубликованные снимки уроков.
+
+Страницы ученика строятся не по графу ORM (урок → задания → тесты → элементы
+квиза → варианты), а по снимку: урок компилируется одним запросом в словарь
+с упорядоченными заданиями, очищенными описаниями, тестами и структурой квиза
+(без правильных ответов). Снимок хранится в таблице lesson_snapshots с версией —
+хэшем содержимого — и кэшируется в памяти процесса.
+
+Любое изменение урока, заданий, тестов или квиза через сессию удаляет снимок
+в той же транзакции; при следующем открытии урока учеником публикуется новая
+версия. Актуальность кэша в памяти проверяется одним запросом версии по ключу,
+поэтому несколько процессов gunicorn видят правки друг друга.
+"""
+import hashlib
+import json
+import threading
+
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+
+from models import db, Lesson, LessonSnapshot, Task, TestCase, QuizElement, QuizOption
+from utils.html_text import sanitize_html
+
+# lesson_id → (версия, данные)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def compile_lesson(lesson_id):
+    """Собирает содержимое урока в словарь. Возвращает None, если урока нет."""
+    lesson = Lesson.query.options(
+        selectinload(Lesson.tasks).selectinload(Task.test_cases),
+        selectinload(Lesson.tasks).selectinload(Task.quiz_elements).selectinload(QuizElement.options),
+    ).filter_by(id=lesson_id).first()
+    if lesson is None:
+        return None
+
+    tasks = []
+    for task in lesson.tasks:
+        tasks.append({
+            'id': task.id,
+            'title': task.title,
+            'task_type': task.task_type or 'code',
+            'is_bonus': bool(task.is_bonus),
+            'description': sanitize_html(task.description),
+            'default_code': task.default_code or '',
+            # Скрытые тесты тоже нужны: проверка выполняется в браузере
+            'tests': [
+                {'input': tc.input_data, 'output': tc.expected_output, 'hidden': bool(tc.is_hidden)}
+                for tc in task.test_cases
+            ],
+            'quiz_elements': [
+                {
+                    'id': element.id,
+                    'element_type': element.element_type,
+                    'content': sanitize_html(element.content),
+                    'options': [{'id': option.id, 'text': option.text} for option in element.options],
+                }
+                for element in task.quiz_elements
+            ],
+        })
+
+    return {'id': lesson.id, 'title': lesson.title, 'tasks': tasks}
+
+
+def snapshot_version(data):
+    canonical = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def publish_lesson(lesson_id):
+    """Компилирует урок и сохраняет снимок. Возвращает (версия, данные) или None."""
+    data = compile_lesson(lesson_id)
+    if data is None:
+        return None
+    version = snapshot_version(data)
+    db.session.merge(LessonSnapshot(lesson_id=lesson_id, version=version,
+                                    data=json.dumps(data, ensure_ascii=False)))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Снимок одновременно опубликовал другой процесс
+        db.session.rollback()
+    with _cache_lock:
+        _cache[lesson_id] = (version, data)
+    return version, data
+
+
+def get_lesson_snapshot(lesson_id):
+    """Актуальный снимок урока: (версия, данные) или None, если урока нет."""
+    version = db.session.execute(
+        db.select(LessonSnapshot.version).filter_by(lesson_id=lesson_id)
+    ).scalar()
+    if version is None:
+        return publish_lesson(lesson_id)
+
+    cached = _cache.get(lesson_id)
+    if cached and cached[0] == version:
+        return cached
+
+    raw = db.session.execute(
+        db.select(LessonSnapshot.data).filter_by(lesson_id=lesson_id)
+    ).scalar()
+    if raw is None:
+        return publish_lesson(lesson_id)
+    data = json.loads(raw)
+    with _cache_lock:
+        _cache[lesson_id] = (version, data)
+    return version, data
+
+
+def find_task(snapshot_data, task_id):
+    """Индекс и словарь задания в снимке."""
+    for index, task in enumerate(snapshot_data['tasks']):
+        if task['id'] == task_id:
+            return index, task
+    return None, None
+
+
+def invalidate_lessons(lesson_ids):
+    """Удаляет снимки уроков. Нужна там, где урок меняется в обход сессии (bulk UPDATE)."""
+    lesson_ids = {lesson_id for lesson_id in lesson_ids if lesson_id is not None}
+    if lesson_ids:
+        db.session.execute(db.delete(LessonSnapshot).where(LessonSnapshot.lesson_id.in_(lesson_ids)))
+    with _cache_lock:
+        for lesson_id in lesson_ids:
+            _cache.pop(lesson_id, None)
+
+
+# ==================== Сброс снимков при изменениях ====================
+
+def _old_values(obj, attr):
+    history = inspect(obj).attrs[attr].history
+    return list(history.deleted or ())
+
+
+def _task_lesson_ids(task):
+    if task is None:
+        return set()
+    ids = {task.lesson_id, *_old_values(task, 'lesson_id')}
+    if task.lesson_id is None and task.lesson is not None:
+        ids.add(task.lesson.id)
+    return ids
+
+
+def affected_lesson_ids(obj):
+    """Уроки, содержимое которых меняет изменение obj (урок, задание, тест, элемент квиза)."""
+    if isinstance(obj, Lesson):
+        return {obj.id}
+    if isinstance(obj, Task):
+        return _task_lesson_ids(obj)
+    if isinstance(obj, (TestCase, QuizElement)):
+        return _task_lesson_ids(obj.task)
+    if isinstance(obj, QuizOption):
+        return _task_lesson_ids(obj.element.task) if obj.element else set()
+    return set()
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changed_lessons(session, flush_context, instances):
+    changed = session.info.setdefault('changed_lessons', set())
+    with session.no_autoflush:
+        for obj in (*session.new, *session.deleted):
+            changed |= affected_lesson_ids(obj)
+        # Новый ответ ученика тоже помечает задание изменённым (через backref),
+        # поэтому для изменённых объектов учитываем только столбцы
+        for obj in session.dirty:
+            if session.is_modified(obj, include_collections=False):
+                changed |= affected_lesson_ids(obj)
+    changed.discard(None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _drop_changed_snapshots(session, flush_context):
+    changed = session.info.pop('changed_lessons', None)
+    if changed:
+        session.connection().execute(
+            db.delete(LessonSnapshot).where(LessonSnapshot.lesson_id.in_(changed))
+        )
@@ -0,0 +1,109 @@
+"""Картинки из описаний заданий и тестов.
+
+Вставленные в Quill картинки приходят как data URI внутри HTML. Они
+сохраняются в файлы, имя которых — SHA-256 содержимого, а в HTML остаётся
+ссылка /media/<хэш>.<расширение>. Одинаковые картинки хранятся один раз,
+а содержимое файла по ссылке никогда не меняется.
+"""
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+
+from flask import current_app
+
+# Ограничение на размер одной картинки
+MAX_MEDIA_SIZE = 10 * 1024 * 1024
+
+EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'jpg': 'jpg', 'gif': 'gif', 'webp': 'webp'}
+
+DATA_URI_RE = re.compile(r'data:image/(png|jpeg|jpg|gif|webp);base64,([A-Za-z0-9+/=\s]+)')
+MEDIA_URL_RE = re.compile(r'/media/([0-9a-f]{64}\.(?:png|jpg|gif|webp))')
+MEDIA_FILENAME_RE = re.compile(r'^([0-9a-f]{64})\.(png|jpg|gif|webp)$')
+
+
+def media_folder():
+    folder = current_app.config['MEDIA_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def media_url(filename):
+    return f'/media/{filename}'
+
+
+def save_media(data, ext):
+    """Сохраняет картинку и возвращает имя файла. Повторное сохранение — без записи."""
+    if len(data) > MAX_MEDIA_SIZE:
+        raise ValueError('Картинка слишком большая')
+    filename = f'{hashlib.sha256(data).hexdigest()}.{EXTENSIONS[ext]}'
+    folder = media_folder()
+    path = os.path.join(folder, filename)
+    if not os.path.exists(path):
+        # Свой временный файл на каждую запись: ту же картинку могут
+        # одновременно сохранять несколько потоков и процессов
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=f'{filename}.', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # mkstemp создаёт файл с правами 0600
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return filename
+
+
+def save_data_uri(data_uri):
+    """Сохраняет картинку из data URI. Возвращает URL или None, если это не картинка."""
+    match = DATA_URI_RE.fullmatch(data_uri.strip())
+    if not match:
+        return None
+    try:
+        data = base64.b64decode(match.group(2), validate=False)
+    except binascii.Error:
+        return None
+    return media_url(save_media(data, match.group(1)))
+
+
+def extract_data_images(html):
+    """Заменяет все data URI картинок в HTML ссылками на файлы хранилища."""
+    if not html or 'data:image/' not in html:
+        return html
+
+    def replace(match):
+        url = save_data_uri(match.group(0))
+        return url or match.group(0)
+
+    return DATA_URI_RE.sub(replace, html)
+
+
+def collect_media(text):
+    """Картинки, на которые ссылается текст (например, JSON экспорта): имя файла → base64.
+
+    Каждая картинка попадает в результат один раз, сколько бы раз она ни встречалась.
+    """
+    media = {}
+    for filename in set(MEDIA_URL_RE.findall(text)):
+        path = os.path.join(media_folder(), filename)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                media[filename] = base64.b64encode(f.read()).decode('ascii')
+    return media
+
+
+def restore_media(media):
+    """Сохраняет картинки из файла импорта. Файлы с неверным хэшем пропускаются."""
+    for filename, encoded in (media or {}).items():
+        match = MEDIA_FILENAME_RE.match(filename)
+        if not match or not isinstance(encoded, str):
+            continue
+        try:
+            data = base64.b64decode(encoded)
+        except binascii.Error:
+            continue
+        if hashlib.sha256(data).hexdigest() == match.group(1):
+            save_media(data, match.group(2))
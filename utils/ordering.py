@@ -0,0 +1,119 @@
+"""Порядок заданий, тестов, элементов квиза и вариантов ответа.
+
+Ключи порядка разреженные: соседи стоят через ORDER_GAP. Новый элемент
+встаёт в конец с ключом «последний + ORDER_GAP» (последний ключ берётся
+по составному индексу (родитель, order) без агрегата), а перемещение
+меняет ключ только у перемещаемой строки — он выбирается посередине между
+новыми соседями. Когда места между соседями не осталось, ключи всех
+элементов родителя переписываются заново одним UPDATE (rebalance).
+"""
+from sqlalchemy import case
+
+from models import db, Task, TestCase, QuizElement, QuizOption
+from utils.lesson_snapshot import invalidate_lessons
+
+ORDER_GAP = 1024
+
+# Модель → столбец родителя
+PARENT_COLUMNS = {
+    Task: Task.lesson_id,
+    TestCase: TestCase.task_id,
+    QuizElement: QuizElement.task_id,
+    QuizOption: QuizOption.element_id,
+}
+
+# Составные индексы (родитель, order): по ним ищутся соседи и конец списка
+ORDER_INDEXES = {
+    'ix_tasks_lesson_order': ('tasks', 'lesson_id'),
+    'ix_test_cases_task_order': ('test_cases', 'task_id'),
+    'ix_quiz_elements_task_order': ('quiz_elements', 'task_id'),
+    'ix_quiz_options_element_order': ('quiz_options', 'element_id'),
+}
+
+
+def _siblings(model, parent_id):
+    return model.query.filter(PARENT_COLUMNS[model] == parent_id)
+
+
+def append_key(model, parent_id):
+    """Ключ для нового элемента в конце списка."""
+    last = db.session.query(model.order).filter(
+        PARENT_COLUMNS[model] == parent_id
+    ).order_by(model.order.desc()).limit(1).scalar()
+    return (last or 0) + ORDER_GAP
+
+
+def rebalance(model, parent_id):
+    """Заново раскладывает ключи родителя через ORDER_GAP, сохраняя порядок."""
+    ids = [row.id for row in db.session.query(model.id).filter(
+        PARENT_COLUMNS[model] == parent_id
+    ).order_by(model.order, model.id)]
+    set_order(model, parent_id, ids)
+
+
+def _lesson_id(model, parent_id):
+    if model is Task:
+        return parent_id
+    if model is QuizOption:
+        return db.session.query(Task.lesson_id).join(QuizElement, QuizElement.task_id == Task.id).filter(
+            QuizElement.id == parent_id
+        ).scalar()
+    return db.session.query(Task.lesson_id).filter(Task.id == parent_id).scalar()
+
+
+def set_order(model, parent_id, ids):
+    """Ставит элементы родителя в порядке ids одним UPDATE. Чужие id пропускаются."""
+    if not ids:
+        return
+    keys = {item_id: position * ORDER_GAP for position, item_id in enumerate(ids, 1)}
+    db.session.execute(
+        db.update(model)
+        .where(model.id.in_(list(keys)), PARENT_COLUMNS[model] == parent_id)
+        .values(order=case(keys, value=model.id))
+        .execution_options(synchronize_session=False)
+    )
+    # UPDATE в обход сессии: снимок урока сбрасываем сами
+    invalidate_lessons([_lesson_id(model, parent_id)])
+    db.session.expire_all()
+
+
+def _key_between(low, high):
+    """Ключ строго между low и high или None, если места нет."""
+    key = (low + high) // 2
+    return key if low < key < high else None
+
+
+def move(item, direction):
+    """Сдвигает item на одну позицию вверх или вниз. Меняется одна строка,
+    если между соседями есть место. Возвращает False, если двигать некуда."""
+    model = type(item)
+    parent_id = getattr(item, PARENT_COLUMNS[model].key)
+
+    for attempt in range(2):
+        siblings = _siblings(model, parent_id).filter(model.id != item.id)
+        if direction == 'up':
+            # Два ближайших соседа сверху: встаём между ними
+            neighbours = siblings.filter(
+                db.or_(model.order < item.order, db.and_(model.order == item.order, model.id < item.id))
+            ).order_by(model.order.desc(), model.id.desc()).limit(2).all()
+        else:
+            neighbours = siblings.filter(
+                db.or_(model.order > item.order, db.and_(model.order == item.order, model.id > item.id))
+            ).order_by(model.order, model.id).limit(2).all()
+        if not neighbours:
+            return False
+
+        nearest = neighbours[0].order
+        if len(neighbours) == 2:
+            key = _key_between(*sorted((nearest, neighbours[1].order)))
+        elif direction == 'up':
+            key = nearest - ORDER_GAP
+        else:
+            key = nearest + ORDER_GAP
+
+        if key is not None:
+            item.order = key
+            return True
+        # Места не осталось: раскладываем ключи заново и пробуем ещё раз
+        rebalance(model, parent_id)
+    return False
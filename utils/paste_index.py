@@ -0,0 +1,213 @@
+"""Откуда вставлен текст: n-граммный индекс по вставкам и коду учеников.
+
+Текст режется на токены (слова и знаки), из каждых NGRAM_SIZE токенов подряд
+получается хэш. Чтобы индекс был небольшим, из каждого окна WINDOW соседних
+хэшей сохраняется только минимальный (winnowing): у двух текстов с общим
+фрагментом длиной от NGRAM_SIZE + WINDOW - 1 токенов обязательно найдётся
+общий сохранённый хэш.
+
+Источники — текущий код каждого ученика по каждому заданию и каждая вставка.
+Код переиндексируется при сохранении, если изменился, вставка — при записи
+события. Поиск по вставкам — запрос с GROUP BY к индексу paste_grams (gram)
+на пачку вставок; база возвращает только подходящие источники:
+  * если фрагмент почти целиком есть в коде одноклассника — источник этот код;
+  * если тот же фрагмент вставляли несколько других учеников — это
+    повторяющийся внешний фрагмент (ГДЗ, сайт, чат).
+"""
+import hashlib
+import re
+
+from models import db, Student, Task, StudentProgress, ActivityEvent, PasteSource, PasteGram
+from utils.code_store import load_codes
+
+NGRAM_SIZE = 6
+WINDOW = 4
+# Какая доля отпечатков вставки должна найтись в источнике
+MIN_MATCH = 0.5
+# Со скольких других учеников вставка считается повторяющимся фрагментом
+RECURRING_STUDENTS = 2
+# Отпечатков в одном запросе при поиске: по 4 параметра, с запасом до лимита SQLite (32766)
+GRAM_BATCH = 5000
+
+TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+
+def _hash(tokens):
+    data = '\x00'.join(tokens).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little', signed=True)
+
+
+def fingerprints(text):
+    """Отпечатки текста (winnowing по хэшам n-грамм токенов)."""
+    tokens = TOKEN_RE.findall(text or '')
+    if len(tokens) < NGRAM_SIZE:
+        # Короткую вставку ищем целиком
+        return {_hash(tokens)} if len(tokens) >= 3 else set()
+    hashes = [_hash(tokens[i:i + NGRAM_SIZE]) for i in range(len(tokens) - NGRAM_SIZE + 1)]
+    if len(hashes) <= WINDOW:
+        return {min(hashes)}
+    return {min(hashes[i:i + WINDOW]) for i in range(len(hashes) - WINDOW + 1)}
+
+
+def _add_source(source, text):
+    db.session.add(source)
+    db.session.flush()
+    grams = fingerprints(text)
+    if grams:
+        db.session.execute(db.insert(PasteGram), [{'gram': gram, 'source_id': source.id} for gram in grams])
+
+
+def delete_sources(condition):
+    """Удаляет источники по условию на PasteSource вместе с их отпечатками."""
+    source_ids = db.select(PasteSource.id).where(condition)
+    db.session.execute(db.delete(PasteGram).where(PasteGram.source_id.in_(source_ids))
+                       .execution_options(synchronize_session=False))
+    db.session.execute(db.delete(PasteSource).where(condition).execution_options(synchronize_session=False))
+
+
+def index_code(student_id, task_id, code_hash, code):
+    """Переиндексирует код ученика по заданию, если он изменился. Вызывать до commit."""
+    current = db.session.execute(
+        db.select(PasteSource.code_hash).where(
+            PasteSource.kind == 'code', PasteSource.student_id == student_id, PasteSource.task_id == task_id
+        )
+    ).first()
+    if current is not None and current.code_hash == code_hash:
+        return
+    delete_sources(db.and_(PasteSource.kind == 'code', PasteSource.student_id == student_id,
+                            PasteSource.task_id == task_id))
+    if code:
+        _add_source(PasteSource(kind='code', student_id=student_id, task_id=task_id, code_hash=code_hash), code)
+
+
+def index_paste(event):
+    """Добавляет вставку в индекс. event уже добавлен в сессию."""
+    if event.event_type != 'paste' or not event.text_content:
+        return
+    db.session.flush()
+    _add_source(PasteSource(kind='paste', student_id=event.student_id, task_id=event.task_id, event_id=event.id),
+                event.text_content)
+
+
+def rebuild_index():
+    """Индексирует весь сохранённый код и все вставки заново. Возвращает число источников."""
+    delete_sources(PasteSource.id.isnot(None))
+    count = 0
+    rows = db.session.query(StudentProgress.student_id, StudentProgress.task_id, StudentProgress.code_hash) \
+        .filter(StudentProgress.code_hash.isnot(None)).all()
+    codes = load_codes(code_hash for _, _, code_hash in rows)
+    for student_id, task_id, code_hash in rows:
+        index_code(student_id, task_id, code_hash, codes.get(code_hash))
+        count += 1
+    for event in ActivityEvent.query.filter(ActivityEvent.event_type == 'paste',
+                                            ActivityEvent.text_content.isnot(None)).all():
+        index_paste(event)
+        count += 1
+    db.session.commit()
+    return count
+
+
+# Совпадения вставок с источниками: отпечатки всех вставок пачки — в VALUES,
+# по индексу paste_grams (gram) считаются общие отпечатки с каждым источником,
+# и наружу выходят только источники с долей совпадения от MIN_MATCH
+_MATCH_SQL = """
+    WITH wanted(event_id, student_id, grams, gram) AS (VALUES {wanted})
+    SELECT wanted.event_id, paste_sources.kind, paste_sources.student_id, paste_sources.task_id,
+           count(*) * 1.0 / wanted.grams
+    FROM wanted
+    JOIN paste_grams ON paste_grams.gram = wanted.gram
+    JOIN paste_sources ON paste_sources.id = paste_grams.source_id
+    WHERE paste_sources.student_id != wanted.student_id
+    GROUP BY wanted.event_id, wanted.grams, paste_sources.id
+    HAVING count(*) >= :min_match * wanted.grams
+"""
+
+
+def _match_batch(batch):
+    """[(event_id, kind, student_id, task_id, доля)] для пачки [(event_id, student_id, grams)]."""
+    params = {'min_match': MIN_MATCH}
+    wanted = []
+    for i, (event_id, student_id, grams) in enumerate(batch):
+        params[f'e{i}'], params[f's{i}'], params[f'n{i}'] = event_id, student_id, len(grams)
+        for j, gram in enumerate(grams):
+            params[f'g{i}_{j}'] = gram
+            wanted.append(f'(:e{i}, :s{i}, :n{i}, :g{i}_{j})')
+    sql = _MATCH_SQL.format(wanted=', '.join(wanted))
+    return db.session.execute(db.text(sql), params).all()
+
+
+def find_paste_sources(events):
+    """{event_id: источник или None} для вставок (любых учеников) — несколько запросов на все события.
+
+    Источник: {'kind': 'student', 'student_name', 'task_title', 'match'} или
+    {'kind': 'external', 'students': число учеников, 'match'}.
+    """
+    results = {}
+    pastes = []
+    for event in events:
+        if event.event_type != 'paste' or not event.text_content:
+            continue
+        # У очень длинной вставки берём GRAM_BATCH наименьших отпечатков
+        grams = sorted(fingerprints(event.text_content))[:GRAM_BATCH]
+        if grams:
+            pastes.append((event.id, event.student_id, grams))
+        else:
+            results[event.id] = None
+    if not pastes:
+        return results
+
+    # Вставки пачками не больше GRAM_BATCH отпечатков на запрос
+    batches, batch, batch_size = [], [], 0
+    for paste in pastes:
+        if batch and batch_size + len(paste[2]) > GRAM_BATCH:
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append(paste)
+        batch_size += len(paste[2])
+    batches.append(batch)
+
+    event_matches = {event_id: [] for event_id, _, _ in pastes}
+    for batch in batches:
+        for event_id, kind, student_id, task_id, match in _match_batch(batch):
+            event_matches[event_id].append((kind, student_id, task_id, match))
+
+    # Классы авторов вставок и учеников-источников кода
+    authors = {event_id: student_id for event_id, student_id, _ in pastes}
+    student_ids = set(authors.values())
+    student_ids |= {m[1] for matches in event_matches.values() for m in matches if m[0] == 'code'}
+    students = {row.id: row for row in db.session.query(Student.id, Student.name, Student.class_id)
+                .filter(Student.id.in_(student_ids))}
+
+    for event_id, matches in event_matches.items():
+        author = students.get(authors[event_id])
+        results[event_id] = _best_source(matches, students, author.class_id if author else None)
+
+    task_ids = {source['task_id'] for source in results.values() if source and source['kind'] == 'student'}
+    titles = dict(db.session.query(Task.id, Task.title).filter(Task.id.in_(task_ids))) if task_ids else {}
+    for source in results.values():
+        if source and source['kind'] == 'student':
+            source['task_title'] = titles.get(source.pop('task_id'))
+    return results
+
+
+def _best_source(matches, students, class_id):
+    code_matches = [m for m in matches if m[0] == 'code'
+                    and m[1] in students and students[m[1]].class_id == class_id]
+    if code_matches:
+        _, student_id, task_id, match = max(code_matches, key=lambda m: m[3])
+        return {
+            'kind': 'student',
+            'student_name': students[student_id].name,
+            'task_id': task_id,
+            'match': round(match, 2),
+        }
+
+    paste_matches = [m for m in matches if m[0] == 'paste']
+    pasted_by = {m[1] for m in paste_matches}
+    if len(pasted_by) >= RECURRING_STUDENTS:
+        return {
+            'kind': 'external',
+            'students': len(pasted_by),
+            'match': round(max(m[3] for m in paste_matches), 2),
+        }
+    return None
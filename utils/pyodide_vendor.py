@@ -0,0 +1,54 @@
+"""Локальная копия дистрибутива Pyodide, чтобы не зависеть от CDN."""
+import os
+import urllib.request
+
+PYODIDE_VERSION = '0.24.1'
+PYODIDE_CDN_URL = f'https://cdn.jsdelivr.net/pyodide/v{PYODIDE_VERSION}/full/'
+
+# Минимальный набор для запуска интерпретатора
+PYODIDE_FILES = [
+    'pyodide.js',
+    'pyodide.asm.js',
+    'pyodide.asm.wasm',
+    'python_stdlib.zip',
+    'pyodide-lock.json',
+]
+
+
+def vendor_dir(static_folder):
+    """Папка с копией. Версия в пути служит отпечатком: файлы в ней никогда не меняются."""
+    return os.path.join(static_folder, 'vendor', 'pyodide', f'v{PYODIDE_VERSION}')
+
+
+def is_vendored(static_folder):
+    folder = vendor_dir(static_folder)
+    return all(os.path.exists(os.path.join(folder, name)) for name in PYODIDE_FILES)
+
+
+def pyodide_index_url(static_folder):
+    """URL, откуда воркер загружает Pyodide: локальная копия, если она скачана, иначе CDN."""
+    if is_vendored(static_folder):
+        return f'/static/vendor/pyodide/v{PYODIDE_VERSION}/'
+    return PYODIDE_CDN_URL
+
+
+def download_pyodide(static_folder):
+    """Скачивает файлы Pyodide с CDN. Уже скачанные файлы пропускаются."""
+    folder = vendor_dir(static_folder)
+    os.makedirs(folder, exist_ok=True)
+    downloaded = []
+    for name in PYODIDE_FILES:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            continue
+        # Пишем во временный файл, чтобы прерванная загрузка не оставила битую копию
+        tmp_path = path + '.part'
+        with urllib.request.urlopen(PYODIDE_CDN_URL + name) as response, open(tmp_path, 'wb') as f:
+            while True:
+                chunk = response.read(1 << 20)
+                if not chunk:
+                    break
+                f.write(chunk)
+        os.replace(tmp_path, path)
+        downloaded.append(name)
+    return downloaded
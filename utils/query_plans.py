@@ -0,0 +1,75 @@
+"""Проверка планов частых запросов: `flask check-query-plans`.
+
+Для каждого запроса с горячих путей (routes/) выполняется EXPLAIN QUERY PLAN.
+Если SQLite собирается читать таблицу целиком (SCAN), а не искать по индексу
+(SEARCH), команда печатает план и завершается с ошибкой — так пропавший или
+неподходящий индекс заметен до выкладки.
+"""
+from sqlalchemy.dialects import sqlite
+
+from models import (db, Student, Topic, Lesson, Task, TestCase, LessonAssignment, StudentProgress,
+                    QuizElement, QuizOption, QuizAnswer, ActivityEvent)
+
+# Имя → запрос в том виде, в каком его строят маршруты (значения параметров не важны)
+HOT_QUERIES = {
+    'уроки класса (главная ученика, журнал)':
+        db.select(LessonAssignment).where(LessonAssignment.class_id == 1),
+    'доступ ученика к уроку':
+        db.select(LessonAssignment).where(LessonAssignment.lesson_id == 1, LessonAssignment.class_id == 1),
+    'ученики класса':
+        db.select(Student).where(Student.class_id == 1),
+    'корневые папки учителя':
+        db.select(Topic).where(Topic.teacher_id == 1, Topic.parent_id.is_(None)),
+    'подпапки':
+        db.select(Topic).where(Topic.parent_id == 1),
+    'поддерево папки':
+        db.select(Topic).where(Topic.path >= '/1/', Topic.path < '/10'),
+    'уроки вне папок':
+        db.select(Lesson).where(Lesson.teacher_id == 1, Lesson.topic_id.is_(None)),
+    'уроки папки':
+        db.select(Lesson).where(Lesson.topic_id == 1),
+    'задания урока':
+        db.select(Task).where(Task.lesson_id == 1).order_by(Task.order),
+    'тесты задания':
+        db.select(TestCase).where(TestCase.task_id == 1).order_by(TestCase.order),
+    'элементы квиза':
+        db.select(QuizElement).where(QuizElement.task_id == 1).order_by(QuizElement.order),
+    'варианты ответа':
+        db.select(QuizOption).where(QuizOption.element_id == 1).order_by(QuizOption.order),
+    'прогресс ученика по заданию':
+        db.select(StudentProgress).where(StudentProgress.student_id == 1, StudentProgress.task_id == 1),
+    'прогресс по заданию (журнал, удаление)':
+        db.select(StudentProgress).where(StudentProgress.task_id == 1),
+    'ответы ученика на квиз':
+        db.select(QuizAnswer).where(QuizAnswer.student_id == 1, QuizAnswer.element_id.in_([1, 2])),
+    'ответы на элемент квиза (удаление)':
+        db.select(QuizAnswer).where(QuizAnswer.element_id == 1),
+    'хронология активности':
+        db.select(ActivityEvent).where(
+            ActivityEvent.student_id == 1, ActivityEvent.task_id == 1
+        ).order_by(ActivityEvent.created_at),
+    'активность по заданию (удаление)':
+        db.select(ActivityEvent).where(ActivityEvent.task_id == 1),
+}
+
+
+def explain(statement):
+    """Строки плана SQLite для запроса."""
+    sql = str(statement.compile(dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True}))
+    rows = db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}')).all()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan):
+    """Шаги плана, читающие таблицу (или весь индекс) целиком."""
+    return [detail for detail in plan if detail.startswith('SCAN ')]
+
+
+def check_query_plans():
+    """[(имя запроса, план)] для запросов со сканированием таблицы."""
+    failures = []
+    for name, statement in HOT_QUERIES.items():
+        plan = explain(statement)
+        if full_scans(plan):
+            failures.append((name, plan))
+    return failures
@@ -0,0 +1,203 @@
+"""Полнотекстовый поиск учителя по урокам, заданиям и квизам (SQLite FTS5).
+
+В виртуальной таблице search_index одна строка на урок (название) и одна
+на задание: название и текст — описание без разметки, содержимое элементов
+квиза, варианты ответов и данные тестов. Поиск — MATCH по индексу с
+ранжированием bm25 (совпадение в названии весит больше) и фильтром по учителю.
+
+Индекс обновляется лениво: при изменении урока или его содержимого
+(обработчики сессии ниже, как для снимков в utils/lesson_snapshot.py) id урока
+попадает в search_pending, а перед поиском такие уроки переиндексируются.
+Автосохранение описания раз в пару секунд стоит одного INSERT OR IGNORE.
+"""
+import re
+
+from markupsafe import escape
+from sqlalchemy import event, text, bindparam
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, selectinload
+
+from models import db, Lesson, Task, QuizElement, SearchPending
+from utils.html_text import html_to_text
+from utils.lesson_snapshot import affected_lesson_ids
+
+PAGE_SIZE = 20
+# Вес столбцов для bm25: title, body
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+# Маркеры совпадений в snippet(): после экранирования заменяются на <mark>
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+CREATE_INDEX_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, body,
+        teacher_id UNINDEXED, lesson_id UNINDEXED, task_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+
+def create_index():
+    """Создаёт таблицу индекса. False, если SQLite собран без FTS5."""
+    try:
+        db.session.execute(text(CREATE_INDEX_SQL))
+        db.session.commit()
+        return True
+    except OperationalError:
+        db.session.rollback()
+        return False
+
+
+def mark_lessons_changed(lesson_ids):
+    """Ставит уроки в очередь на переиндексацию (для изменений в обход сессии)."""
+    lesson_ids = {lesson_id for lesson_id in lesson_ids if lesson_id is not None}
+    if lesson_ids:
+        db.session.execute(
+            insert(SearchPending).values([{'lesson_id': lesson_id} for lesson_id in lesson_ids])
+            .on_conflict_do_nothing(index_elements=['lesson_id'])
+        )
+
+
+def _task_body(task):
+    parts = [html_to_text(task.description)]
+    for element in task.quiz_elements:
+        parts.append(html_to_text(element.content))
+        parts.extend(option.text or '' for option in element.options)
+        if element.correct_answer:
+            parts.append(element.correct_answer)
+    for test in task.test_cases:
+        parts.append(test.input_data or '')
+        parts.append(test.expected_output or '')
+    return '\n'.join(part for part in parts if part)
+
+
+def reindex_lessons(lesson_ids):
+    """Перестраивает строки индекса для уроков (удалённые уроки просто исчезают)."""
+    lesson_ids = list(lesson_ids)
+    if not lesson_ids:
+        return
+    db.session.execute(
+        text('DELETE FROM search_index WHERE lesson_id IN :ids').bindparams(bindparam('ids', expanding=True)),
+        {'ids': lesson_ids}
+    )
+    lessons = Lesson.query.filter(Lesson.id.in_(lesson_ids)).options(
+        selectinload(Lesson.tasks).selectinload(Task.test_cases),
+        selectinload(Lesson.tasks).selectinload(Task.quiz_elements).selectinload(QuizElement.options),
+    ).all()
+    rows = []
+    for lesson in lessons:
+        rows.append({'title': lesson.title, 'body': '', 'teacher_id': lesson.teacher_id,
+                     'lesson_id': lesson.id, 'task_id': None})
+        for task in lesson.tasks:
+            rows.append({'title': task.title, 'body': _task_body(task), 'teacher_id': lesson.teacher_id,
+                         'lesson_id': lesson.id, 'task_id': task.id})
+    if rows:
+        db.session.execute(text(
+            'INSERT INTO search_index (title, body, teacher_id, lesson_id, task_id) '
+            'VALUES (:title, :body, :teacher_id, :lesson_id, :task_id)'
+        ), rows)
+
+
+def rebuild_index():
+    """Индексирует все уроки заново. Возвращает их число."""
+    db.session.execute(text('DELETE FROM search_index'))
+    db.session.execute(db.delete(SearchPending))
+    lesson_ids = [row.id for row in db.session.query(Lesson.id)]
+    for i in range(0, len(lesson_ids), 200):
+        reindex_lessons(lesson_ids[i:i + 200])
+    db.session.commit()
+    return len(lesson_ids)
+
+
+def _refresh_pending():
+    pending = [row.lesson_id for row in db.session.query(SearchPending.lesson_id)]
+    if pending:
+        reindex_lessons(pending)
+        db.session.execute(db.delete(SearchPending).where(SearchPending.lesson_id.in_(pending)))
+        db.session.commit()
+
+
+def _match_query(query):
+    """Запрос пользователя → выражение FTS5: все слова, каждое как префикс."""
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{word}"*' for word in words[:10])
+
+
+def _highlight(snippet):
+    return str(escape(snippet)).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def search(teacher_id, query, page=1):
+    """Страница результатов: {'results': [...], 'page', 'has_next'}.
+
+    Результат: lesson_id, lesson_title, task_id, task_title, task_type, snippet (HTML).
+    """
+    match = _match_query(query)
+    if not match:
+        return {'results': [], 'page': page, 'has_next': False}
+    _refresh_pending()
+
+    rows = db.session.execute(text(f"""
+        SELECT lesson_id, task_id, title,
+               snippet(search_index, -1, '{_MARK_START}', '{_MARK_END}', '…', 16) AS snippet
+        FROM search_index
+        WHERE search_index MATCH :match AND teacher_id = :teacher_id
+        ORDER BY bm25(search_index, {TITLE_WEIGHT}, {BODY_WEIGHT})
+        LIMIT :limit OFFSET :offset
+    """), {'match': match, 'teacher_id': teacher_id,
+           'limit': PAGE_SIZE + 1, 'offset': (page - 1) * PAGE_SIZE}).all()
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+
+    lesson_titles = dict(db.session.query(Lesson.id, Lesson.title).filter(
+        Lesson.id.in_({row.lesson_id for row in rows})
+    ).all()) if rows else {}
+    task_types = dict(db.session.query(Task.id, Task.task_type).filter(
+        Task.id.in_({row.task_id for row in rows if row.task_id})
+    ).all()) if rows else {}
+
+    return {
+        'results': [{
+            'lesson_id': row.lesson_id,
+            'lesson_title': lesson_titles.get(row.lesson_id, row.title),
+            'task_id': row.task_id,
+            'task_title': row.title if row.task_id else None,
+            'task_type': task_types.get(row.task_id),
+            'snippet': _highlight(row.snippet or ''),
+        } for row in rows],
+        'page': page,
+        'has_next': has_next,
+    }
+
+
+# ==================== Очередь переиндексации ====================
+
+@event.listens_for(Session, 'before_flush')
+def _collect_search_changes(session, flush_context, instances):
+    changed = session.info.setdefault('search_changed_lessons', set())
+    # У новых уроков id появится только после вставки
+    session.info.setdefault('search_new_lessons', []).extend(
+        obj for obj in session.new if isinstance(obj, Lesson)
+    )
+    with session.no_autoflush:
+        for obj in (*session.new, *session.deleted):
+            changed |= affected_lesson_ids(obj)
+        for obj in session.dirty:
+            if session.is_modified(obj, include_collections=False):
+                changed |= affected_lesson_ids(obj)
+    changed.discard(None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _queue_search_changes(session, flush_context):
+    changed = session.info.pop('search_changed_lessons', set())
+    changed |= {lesson.id for lesson in session.info.pop('search_new_lessons', [])}
+    changed.discard(None)
+    if changed:
+        session.connection().execute(
+            insert(SearchPending).values([{'lesson_id': lesson_id} for lesson_id in changed])
+            .on_conflict_do_nothing(index_elements=['lesson_id'])
+        )
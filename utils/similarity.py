@@ -0,0 +1,244 @@
+"""Поиск похожих решений: MinHash-подписи и LSH-индекс.
+
+Код разбирается модулем tokenize; имена переменных и функций, числа и строки
+заменяются на ID, NUM и STR, поэтому переименование переменных не прячет
+списанное решение. Из последовательности токенов берутся пятёрки подряд
+(шинглы), по ним считается MinHash-подпись из NUM_HASHES чисел: доля
+совпавших чисел у двух подписей оценивает сходство (Жаккара) наборов шинглов.
+
+Подпись режется на BANDS полос по ROWS чисел, у каждой полосы считается
+корзина. Пары, совпавшие хотя бы в одной корзине, — кандидаты; только они
+сравниваются точно. Так отчёт по заданию строится почти за линейное время,
+а не перебором всех пар. При BANDS=16, ROWS=4 пары со сходством от ~0.8
+почти наверняка попадают в кандидаты, а ниже ~0.4 — почти никогда.
+
+Подписи и корзины пересчитываются при выполнении задания (index_submission);
+решения, ещё не попавшие в индекс, добавляются при построении отчёта.
+"""
+import hashlib
+import io
+import keyword
+import random
+import tokenize
+from array import array
+
+from models import db, Student, SchoolClass, StudentProgress, SubmissionSignature, SimilarityBucket
+from utils.code_store import load_codes
+
+SHINGLE_SIZE = 5
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+# С какого сходства решения попадают в отчёт
+SIMILARITY_THRESHOLD = 0.8
+# Слишком короткие решения у всех одинаковые (print(input())) — их не сравниваем
+MIN_TOKENS = 20
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240901)
+# Хэш-функции вида (a * x + b) mod p; коэффициенты фиксированы, чтобы подписи
+# из разных процессов и дней были сравнимы
+_HASH_PARAMS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_HASHES)]
+
+_SKIP_TOKENS = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER}
+
+
+def normalize_tokens(code):
+    """Токены кода с заменой имён, чисел и строк на ID, NUM, STR."""
+    result = []
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(code).readline):
+            if tok.type in _SKIP_TOKENS:
+                continue
+            if tok.type == tokenize.NAME:
+                result.append(tok.string if keyword.iskeyword(tok.string) else 'ID')
+            elif tok.type == tokenize.NUMBER:
+                result.append('NUM')
+            elif tok.type == tokenize.STRING:
+                result.append('STR')
+            elif tok.type in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT):
+                result.append(tokenize.tok_name[tok.type])
+            else:
+                result.append(tok.string)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # Недописанный код: берём то, что успели разобрать
+        pass
+    return result
+
+
+def _shingle_hashes(tokens):
+    hashes = set()
+    for i in range(len(tokens) - SHINGLE_SIZE + 1):
+        shingle = '\x00'.join(tokens[i:i + SHINGLE_SIZE]).encode('utf-8')
+        hashes.add(int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'little'))
+    return hashes
+
+
+def minhash(code):
+    """MinHash-подпись кода (array из NUM_HASHES чисел) или None для слишком короткого кода."""
+    tokens = normalize_tokens(code)
+    if len(tokens) < MIN_TOKENS:
+        return None
+    shingles = _shingle_hashes(tokens)
+    return array('Q', (
+        min((a * x + b) % _MERSENNE_PRIME for x in shingles)
+        for a, b in _HASH_PARAMS
+    ))
+
+
+def band_buckets(signature):
+    """Номер корзины для каждой полосы подписи (знаковое 64-битное, как хранит SQLite)."""
+    buckets = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        buckets.append(int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), 'little', signed=True))
+    return buckets
+
+
+def similarity(sig_a, sig_b):
+    """Оценка сходства по доле совпавших чисел подписей."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_HASHES
+
+
+def _load_signature(data):
+    signature = array('Q')
+    signature.frombytes(data)
+    return signature
+
+
+def index_submissions(task_id, rows):
+    """Пересчитывает подписи и корзины для [(student_id, code_hash, code)] задания."""
+    if not rows:
+        return
+    student_ids = [student_id for student_id, _, _ in rows]
+    db.session.execute(db.delete(SimilarityBucket).where(
+        SimilarityBucket.task_id == task_id, SimilarityBucket.student_id.in_(student_ids)
+    ).execution_options(synchronize_session=False))
+    db.session.execute(db.delete(SubmissionSignature).where(
+        SubmissionSignature.task_id == task_id, SubmissionSignature.student_id.in_(student_ids)
+    ).execution_options(synchronize_session=False))
+
+    signatures = []
+    buckets = []
+    for student_id, code_hash, code in rows:
+        signature = minhash(code or '')
+        signatures.append({
+            'student_id': student_id, 'task_id': task_id, 'code_hash': code_hash,
+            'signature': signature.tobytes() if signature is not None else None,
+        })
+        if signature is not None:
+            buckets.extend(
+                {'task_id': task_id, 'band': band, 'bucket': bucket, 'student_id': student_id}
+                for band, bucket in enumerate(band_buckets(signature))
+            )
+    db.session.execute(db.insert(SubmissionSignature), signatures)
+    if buckets:
+        db.session.execute(db.insert(SimilarityBucket), buckets)
+
+
+def index_submission(progress, code):
+    """Обновляет индекс для одного решения (после выполнения задания). Вызывать до commit."""
+    index_submissions(progress.task_id, [(progress.student_id, progress.code_hash, code)])
+
+
+def _refresh_stale(task_id):
+    """Добавляет в индекс выполненные решения, которых там нет или которые изменились."""
+    stale = db.session.query(StudentProgress.student_id, StudentProgress.code_hash).outerjoin(
+        SubmissionSignature, db.and_(
+            SubmissionSignature.task_id == StudentProgress.task_id,
+            SubmissionSignature.student_id == StudentProgress.student_id,
+        )
+    ).filter(
+        StudentProgress.task_id == task_id,
+        StudentProgress.is_completed == True,
+        StudentProgress.code_hash.isnot(None),
+        db.or_(SubmissionSignature.id.is_(None), SubmissionSignature.code_hash != StudentProgress.code_hash),
+    ).all()
+    if stale:
+        codes = load_codes(code_hash for _, code_hash in stale)
+        index_submissions(task_id, [(student_id, code_hash, codes.get(code_hash)) for student_id, code_hash in stale])
+        db.session.commit()
+
+
+def similar_clusters(task_id, threshold=SIMILARITY_THRESHOLD):
+    """Группы похожих решений задания: [{'similarity': мин. сходство в паре, 'students': [...]}]."""
+    _refresh_stale(task_id)
+
+    signatures = {
+        student_id: data
+        for student_id, data in db.session.query(SubmissionSignature.student_id, SubmissionSignature.signature)
+        .filter(SubmissionSignature.task_id == task_id, SubmissionSignature.signature.isnot(None))
+    }
+
+    # Объединяем похожие пары в группы (система непересекающихся множеств)
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    # Одинаковые подписи сразу в одну группу: дальше сравниваем только по одному представителю,
+    # иначе сотня одинаковых решений дала бы тысячи пар
+    representative = {}
+    by_signature = {}
+    pair_scores = {}
+    for student_id, data in signatures.items():
+        first = by_signature.setdefault(data, student_id)
+        representative[student_id] = first
+        if first != student_id:
+            parent[find(student_id)] = find(first)
+            pair_scores[(first, student_id)] = 1.0
+
+    # Кандидаты: представители, попавшие в одну корзину хотя бы одной полосы
+    buckets = {}
+    for band, bucket, student_id in db.session.query(
+        SimilarityBucket.band, SimilarityBucket.bucket, SimilarityBucket.student_id
+    ).filter(SimilarityBucket.task_id == task_id):
+        if student_id in representative:
+            buckets.setdefault((band, bucket), set()).add(representative[student_id])
+    candidates = set()
+    for members in buckets.values():
+        if len(members) > 1:
+            members = sorted(members)
+            candidates.update((a, b) for i, a in enumerate(members) for b in members[i + 1:])
+
+    loaded = {}
+    for a, b in candidates:
+        for student_id in (a, b):
+            if student_id not in loaded:
+                loaded[student_id] = _load_signature(signatures[student_id])
+        score = similarity(loaded[a], loaded[b])
+        if score >= threshold:
+            pair_scores[(a, b)] = score
+            parent[find(a)] = find(b)
+    if not pair_scores:
+        return []
+
+    groups = {}
+    for student_id in parent:
+        groups.setdefault(find(student_id), set()).add(student_id)
+    min_scores = {}
+    for (a, b), score in pair_scores.items():
+        root = find(a)
+        min_scores[root] = min(min_scores.get(root, 1.0), score)
+
+    names = {
+        row.id: (row.name, row.class_name) for row in db.session.query(
+            Student.id, Student.name, SchoolClass.name.label('class_name')
+        ).join(SchoolClass, SchoolClass.id == Student.class_id).filter(Student.id.in_(list(parent)))
+    }
+    clusters = []
+    for root, members in groups.items():
+        clusters.append({
+            'similarity': round(min_scores[root], 2),
+            'students': sorted(
+                ({'id': student_id, 'name': names[student_id][0], 'class_name': names[student_id][1]}
+                 for student_id in members if student_id in names),
+                key=lambda s: (s['class_name'], s['name'])
+            ),
+        })
+    clusters.sort(key=lambda c: (-len(c['students']), -c['similarity']))
+    return clusters
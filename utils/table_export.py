@@ -0,0 +1,161 @@
+"""Потоковая выгрузка таблиц в CSV и XLSX.
+
+Строки приходят генератором (обычно прямо из курсора базы) и сразу уходят
+клиенту: в памяти держится одна строка и буфер сжатия, поэтому выгрузка
+большой ведомости начинает скачиваться сразу и не растёт по памяти.
+
+XLSX — zip-архив с XML-листом. Его пишет zipfile в поток без перемотки
+(как Response отдаёт данные): каждый файл сжимается по мере записи, размеры
+записываются после данных. Ячейки — числа или встроенные строки (inlineStr),
+без общей таблицы строк, которую пришлось бы держать в памяти.
+"""
+import csv
+import io
+import re
+import zipfile
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+from flask import Response, stream_with_context
+
+# Excel с русской локалью открывает CSV с ';' и BOM без мастера импорта
+CSV_DELIMITER = ';'
+
+_XML_ILLEGAL_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>"""
+
+_ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+# Два стиля: обычный и жирный (для заголовка)
+_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+
+_SHEET_START = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>
+<sheetData>"""
+
+_SHEET_END = '</sheetData></worksheet>'
+
+
+class _Sink:
+    """Поток без перемотки для zipfile: накапливает записанное до следующего drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def csv_stream(header, rows):
+    """CSV по строкам: BOM, заголовок, затем строки по мере поступления."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=CSV_DELIMITER)
+    buffer.write('\ufeff')
+    for row in _with_header(header, rows):
+        writer.writerow(['' if value is None else value for value in row])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _cell(value, style=0):
+    style_attr = f' s="{style}"' if style else ''
+    if value is None or value == '':
+        return '<c/>'
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        return f'<c{style_attr}><v>{value}</v></c>'
+    text = escape(_XML_ILLEGAL_RE.sub('', str(value)))
+    return f'<c t="inlineStr"{style_attr}><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_stream(sheet_name, header, rows, chunk_rows=200):
+    """XLSX с одним листом; отдаётся кусками по мере сжатия строк."""
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED)
+    archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+    archive.writestr('_rels/.rels', _ROOT_RELS)
+    # Имя листа: до 31 символа и без []:*?/\
+    name = re.sub(r'[\[\]:*?/\\]', ' ', sheet_name)[:31] or 'Лист1'
+    archive.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(name, {'"': '&quot;'})))
+    archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+    archive.writestr('xl/styles.xml', _STYLES)
+    yield sink.drain()
+
+    with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+        sheet.write(_SHEET_START.encode('utf-8'))
+        sheet.write(('<row>' + ''.join(_cell(value, style=1) for value in header) + '</row>').encode('utf-8'))
+        pending = []
+        for row in rows:
+            pending.append('<row>' + ''.join(_cell(value) for value in row) + '</row>')
+            if len(pending) >= chunk_rows:
+                sheet.write(''.join(pending).encode('utf-8'))
+                pending.clear()
+                data = sink.drain()
+                if data:
+                    yield data
+        sheet.write((''.join(pending) + _SHEET_END).encode('utf-8'))
+    archive.close()
+    yield sink.drain()
+
+
+def _with_header(header, rows):
+    yield header
+    yield from rows
+
+
+def export_response(filename, sheet_name, header, rows, fmt):
+    """Response с потоковой выгрузкой; fmt — 'csv' или 'xlsx'. filename без расширения."""
+    if fmt == 'xlsx':
+        body = xlsx_stream(sheet_name, header, rows)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        fmt = 'csv'
+        body = csv_stream(header, rows)
+        mimetype = 'text/csv'
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f"attachment; filename*=UTF-8''{quote(f'{filename}.{fmt}')}"}
+    )
@@ -0,0 +1,196 @@
+"""Материализованный путь для дерева папок.
+
+В topics.path хранится цепочка id от корня до самой папки: '/3/17/42/'.
+Поддерево папки — это строки, чей путь начинается с её пути. Такой префикс
+ищется по индексу ix_topics_path диапазоном [path, path без '/' + '0'):
+'0' — следующий после '/' символ, а в пути есть только цифры и '/'.
+Поэтому проверка «является ли папка потомком», подсчёт уроков в поддереве,
+хлебные крошки и выгрузка поддерева делаются одним запросом на любой глубине.
+
+Путь назначается при вставке папки (обработчик after_insert) и
+переписывается одним UPDATE у всего поддерева при перемещении. При удалении
+поддерево удаляется вместе с путями, обновлять ничего не нужно.
+
+Дерево для диалога «Переместить» (folder_tree) собирается за один проход и
+кэшируется по teachers.tree_version. Версия увеличивается при любом изменении
+папок учителя или переносе его уроков между папками (обработчики сессии ниже).
+"""
+from collections import defaultdict
+
+from sqlalchemy import event, func, and_, literal
+from sqlalchemy.orm import Session, aliased, attributes
+
+from models import db, Teacher, Topic, Lesson
+
+# teacher_id → (tree_version, дерево)
+_tree_cache = {}
+
+
+def subtree_bounds(path):
+    """Границы диапазона путей поддерева (включая саму папку)."""
+    return path, path[:-1] + '0'
+
+
+def in_subtree(column, path):
+    low, high = subtree_bounds(path)
+    return and_(column >= low, column < high)
+
+
+def is_descendant(topic, ancestor):
+    """Лежит ли topic внутри ancestor (или совпадает с ним)."""
+    return topic.path.startswith(ancestor.path)
+
+
+def subtree_topics(topic):
+    """Папка и все её подпапки одним запросом, родители раньше детей."""
+    return Topic.query.filter(in_subtree(Topic.path, topic.path)).order_by(Topic.id).all()
+
+
+def subtree_has_lessons(topic):
+    return db.session.query(Lesson.id).join(Topic, Lesson.topic_id == Topic.id).filter(
+        in_subtree(Topic.path, topic.path)
+    ).first() is not None
+
+
+def subtree_lesson_counts(topics):
+    """Число уроков в каждой папке вместе с подпапками: {topic_id: count}."""
+    if not topics:
+        return {}
+    ancestor = aliased(Topic)
+    descendant = aliased(Topic)
+    upper = func.substr(ancestor.path, 1, func.length(ancestor.path) - 1).concat('0')
+    rows = db.session.query(ancestor.id, func.count(Lesson.id)).join(
+        descendant, and_(descendant.path >= ancestor.path, descendant.path < upper)
+    ).join(
+        Lesson, Lesson.topic_id == descendant.id
+    ).filter(
+        ancestor.id.in_([t.id for t in topics])
+    ).group_by(ancestor.id).all()
+    return dict(rows)
+
+
+def breadcrumbs(topic):
+    """Цепочка папок от корня до topic одним запросом."""
+    ids = [int(part) for part in topic.path.strip('/').split('/')]
+    by_id = {t.id: t for t in Topic.query.filter(Topic.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def move_subtree(topic, new_parent):
+    """Переносит папку вместе с поддеревом: один UPDATE путей."""
+    old_path = topic.path
+    new_path = (new_parent.path if new_parent else '/') + f'{topic.id}/'
+    topic.parent_id = new_parent.id if new_parent else None
+    db.session.execute(
+        db.update(Topic)
+        .where(in_subtree(Topic.path, old_path))
+        .values(path=literal(new_path).concat(func.substr(Topic.path, len(old_path) + 1)))
+        .execution_options(synchronize_session=False)
+    )
+    # Загруженные в сессию папки поддерева перечитают путь из базы
+    for obj in db.session.identity_map.values():
+        if isinstance(obj, Topic) and obj.path and obj.path.startswith(old_path):
+            db.session.expire(obj, ['path'])
+
+
+def rebuild_paths():
+    """Пересчитывает пути всех папок (миграция существующих баз)."""
+    rows = db.session.execute(db.select(Topic.id, Topic.parent_id)).all()
+    parents = dict(rows)
+    paths = {}
+
+    def path_of(topic_id):
+        if topic_id not in paths:
+            parent_id = parents.get(topic_id)
+            prefix = path_of(parent_id) if parent_id in parents else '/'
+            paths[topic_id] = f'{prefix}{topic_id}/'
+        return paths[topic_id]
+
+    for topic_id in parents:
+        path_of(topic_id)
+    if paths:
+        db.session.execute(db.update(Topic), [{'id': i, 'path': p} for i, p in paths.items()])
+    db.session.commit()
+    return len(paths)
+
+
+@event.listens_for(Topic, 'after_insert')
+def _assign_path(mapper, connection, topic):
+    parent_path = '/'
+    if topic.parent_id is not None:
+        parent_path = connection.execute(
+            db.select(Topic.path).where(Topic.id == topic.parent_id)
+        ).scalar() or '/'
+    path = f'{parent_path}{topic.id}/'
+    connection.execute(db.update(Topic).where(Topic.id == topic.id).values(path=path))
+    attributes.set_committed_value(topic, 'path', path)
+
+
+def build_folder_tree(topics, lesson_counts):
+    """Вложенные узлы {id, name, lesson_count, children} за один проход по списку."""
+    nodes = {}
+    children = defaultdict(list)
+    for t in sorted(topics, key=lambda t: t.id):
+        nodes[t.id] = {'id': t.id, 'name': t.name, 'lesson_count': lesson_counts.get(t.id, 0), 'children': []}
+        children[t.parent_id].append(nodes[t.id])
+    for topic_id, node in nodes.items():
+        node['children'] = children[topic_id]
+    return children[None]
+
+
+def folder_tree(teacher):
+    """Дерево папок учителя из кэша; пересобирается, когда меняется версия."""
+    cached = _tree_cache.get(teacher.id)
+    if cached and cached[0] == teacher.tree_version:
+        return cached[1]
+    topics = Topic.query.filter_by(teacher_id=teacher.id).all()
+    # Уроки только самой папки: суммы по поддереву не нужны диалогу
+    counts = dict(db.session.query(Lesson.topic_id, func.count(Lesson.id)).filter(
+        Lesson.teacher_id == teacher.id, Lesson.topic_id.isnot(None)
+    ).group_by(Lesson.topic_id).all())
+    tree = build_folder_tree(topics, counts)
+    _tree_cache[teacher.id] = (teacher.tree_version, tree)
+    return tree
+
+
+def _tree_changed(session, obj):
+    """teacher_id, если изменение объекта меняет дерево папок."""
+    if isinstance(obj, Topic):
+        if obj in session.new or obj in session.deleted:
+            return obj.teacher_id
+        if any(attributes.get_history(obj, name).has_changes() for name in ('name', 'parent_id')):
+            return obj.teacher_id
+    if isinstance(obj, Lesson):
+        if obj in session.new or obj in session.deleted:
+            return obj.teacher_id
+        if attributes.get_history(obj, 'topic_id').has_changes():
+            return obj.teacher_id
+    return None
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changed_trees(session, flush_context, instances):
+    changed = session.info.setdefault('changed_trees', set())
+    with session.no_autoflush:
+        for obj in (*session.new, *session.deleted, *session.dirty):
+            changed.add(_tree_changed(session, obj))
+    changed.discard(None)
+
+
+def bump_tree_versions(session, teacher_ids):
+    """Увеличивает версию дерева. Нужна там, где уроки или папки удаляются в обход сессии."""
+    session.connection().execute(
+        db.update(Teacher).where(Teacher.id.in_(teacher_ids))
+        .values(tree_version=Teacher.tree_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    for obj in session.identity_map.values():
+        if isinstance(obj, Teacher) and obj.id in teacher_ids:
+            session.expire(obj, ['tree_version'])
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_tree_versions(session, flush_context):
+    changed = session.info.pop('changed_trees', None)
+    if changed:
+        bump_tree_versions(session, changed)